@@ -1,220 +1,296 @@
-from aiohttp_requests import requests
+import asyncio
+import random
+import string
+import time
+from collections import OrderedDict
 
-BASE_URL = 'http://elo-service:8000/foos'
-
-
-async def get_player(username):
-    try:
-        resp = await requests.get(f'{BASE_URL}/player/{username}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status == 404:
-        return {
-            'success': False,
-            'error': 'Player with that username was not found.'
-        }
-    elif resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
-
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
-
-
-async def create_player(username):
-    try:
-        resp = await requests.post(f'{BASE_URL}/player/', data={'username': username})
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status != 201:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
-
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
-
-
-async def get_leaderboards(num=10):
-    try:
-        resp = await requests.get(f'{BASE_URL}/leaderboards/{num}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
-
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
-
-
-async def get_loserboards(num=10):
-    try:
-        resp = await requests.get(f'{BASE_URL}/loserboards/{num}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
+import aiohttp
 
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
-
-
-async def get_team(player1, player2):
-    try:
-        resp = await requests.get(f'{BASE_URL}/team/{player1}/{player2}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status == 404:
-        return {
-            'success': False,
-            'error': 'Players were not found or haven\'t played a match together.'
-        }
-
-    if resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
-
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
-
-
-async def get_dream_teams(num):
-    try:
-        resp = await requests.get(f'{BASE_URL}/dream_teams/{num}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+import tracing
 
-    if resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
+BASE_URL = 'http://elo-service:8000/foos'
 
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
+# Lookups are cheap for the elo service, so give up on them quickly rather
+# than leave a command hanging. Writes update elos server-side and get longer.
+READ_TIMEOUT = aiohttp.ClientTimeout(total=5, connect=2)
+WRITE_TIMEOUT = aiohttp.ClientTimeout(total=15, connect=2)
 
+MAX_CONNECTIONS = 20
+# How many requests the bot has in flight at once; the rest wait their turn
+# rather than piling onto the elo service.
+MAX_CONCURRENT_REQUESTS = 8
+KEEPALIVE_TIMEOUT = 60
 
-async def get_nightmare_teams(num):
-    try:
-        resp = await requests.get(f'{BASE_URL}/nightmare_teams/{num}/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
+TIMEOUT_ERROR = 'The elo service took too long to respond.'
 
-    if resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
+CACHE_TTL = 30
+CACHE_MAX_ENTRIES = 256
 
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
+# Retries for requests that failed to reach the elo service, each after a
+# random wait of up to RETRY_BACKOFF * 2 ** attempt seconds
+MAX_RETRIES = 2
+RETRY_BACKOFF = 0.1
 
+SLOW_REQUEST_SECONDS = 1
 
-async def record_match(winning_team, losing_team, winning_score, losing_score):
-    try:
-        resp = await requests.post(f'{BASE_URL}/record_match/', json={
-            'winning_team': winning_team,
-            'losing_team': losing_team,
-            'winning_score': winning_score,
-            'losing_score': losing_score
-        })
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status == 404:
-        return {
-            'success': False,
-            'error': 'One of the users provided doesn\'t exist'
-        }
-
-    elif resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
 
+def _error(message):
     return {
-        'success': True,
-        'data': await resp.json()
+        'success': False,
+        'error': message
     }
 
 
-async def delete_latest_match():
-    try:
-        resp = await requests.delete(f'{BASE_URL}/delete_latest_match/')
-    except Exception as e:
-        return {
-            'success': False,
-            'error': str(e)
-        }
-
-    if resp.status == 404:
-        return {
-            'success': False,
-            'error': 'No match found.'
-        }
-
-    elif resp.status != 200:
-        return {
-            'success': False,
-            'error': await resp.text()
-        }
-
-    return {
-        'success': True,
-        'data': await resp.json()
-    }
+class ResponseCache:
+    """
+    Keeps successful lookups for ttl seconds, up to max_entries of them,
+    evicting the least recently used first. Keys are (endpoint, args).
+    Writes empty it all with invalidate(), as one match can move the elo,
+    rank and percentile in nearly every lookup.
+
+    Concurrent lookups of the same key share a single request to the elo
+    service. A lookup that was in flight when the cache was invalidated still
+    answers the callers already waiting on it, but isn't stored or shared
+    with anyone who asks afterwards.
+    """
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._in_flight = {}  # key -> task fetching it
+
+    async def get_or_fetch(self, key, fetch):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                return result
+            del self._entries[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._fetch(key, fetch))
+            self._in_flight[key] = task
+        # One caller giving up (e.g. its command being cancelled) shouldn't
+        # cancel the request for everyone else waiting on it.
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key, fetch):
+        task = asyncio.current_task()
+        try:
+            result = await fetch()
+        finally:
+            # Otherwise the cache was invalidated while we were waiting
+            invalidated = self._in_flight.get(key) is not task
+            if not invalidated:
+                del self._in_flight[key]
+
+        if result['success'] and not invalidated:
+            self._entries[key] = (time.monotonic() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def invalidate(self):
+        """
+        Drops every entry, and keeps lookups in flight from being stored.
+        """
+        self._entries.clear()
+        self._in_flight.clear()
+
+
+class Endpoint:
+    """
+    Declares one elo service endpoint. params are the positional arguments
+    of the client method; the ones named in path are formatted into it and
+    the rest are sent as the body, as form data (body='data') or JSON
+    (body='json').
+
+    errors maps response statuses to the error message to show for them;
+    any other status besides ok_status reports the response text.
+
+    Successful results of cached endpoints go through the client's
+    ResponseCache. Calling an endpoint with invalidates_cache set empties
+    the cache whatever the outcome, since even a failed write may have been
+    applied.
+    """
+    def __init__(self, method, path, params=(), body=None, ok_status=200, errors=None,
+                 timeout=READ_TIMEOUT, cached=False, invalidates_cache=False):
+        self.method = method
+        self.path = path
+        self.params = params
+        self.body = body
+        self.ok_status = ok_status
+        self.errors = errors or {}
+        self.timeout = timeout
+        self.cached = cached
+        self.invalidates_cache = invalidates_cache
+
+        path_fields = {field for _, field, _, _ in string.Formatter().parse(path) if field}
+        self.body_params = [param for param in params if param not in path_fields]
+
+    def can_retry(self, error):
+        # Nothing was sent if the connection couldn't be made. Otherwise the
+        # request may have been applied, so only reads are safe to repeat.
+        if isinstance(error, asyncio.TimeoutError):
+            return False
+        return isinstance(error, aiohttp.ClientConnectorError) or self.method == 'GET'
+
+
+ENDPOINTS = {
+    'get_player': Endpoint(
+        'GET', 'player/{username}/', ('username',),
+        errors={404: 'Player with that username was not found.'},
+        cached=True),
+    'create_player': Endpoint(
+        'POST', 'player/', ('username',), body='data', ok_status=201, timeout=WRITE_TIMEOUT),
+    'get_leaderboards': Endpoint('GET', 'leaderboards/{num}/', ('num',), cached=True),
+    'get_loserboards': Endpoint('GET', 'loserboards/{num}/', ('num',), cached=True),
+    'get_team': Endpoint(
+        'GET', 'team/{player1}/{player2}/', ('player1', 'player2'),
+        errors={404: 'Players were not found or haven\'t played a match together.'},
+        cached=True),
+    'get_dream_teams': Endpoint('GET', 'dream_teams/{num}/', ('num',), cached=True),
+    'get_nightmare_teams': Endpoint('GET', 'nightmare_teams/{num}/', ('num',), cached=True),
+    'record_match': Endpoint(
+        'POST', 'record_match/', ('winning_team', 'losing_team', 'winning_score', 'losing_score'),
+        body='json',
+        errors={404: 'One of the users provided doesn\'t exist'},
+        timeout=WRITE_TIMEOUT,
+        # Besides the boards, it can change the rank and percentile of any
+        # player or team, which come with every lookup
+        invalidates_cache=True),
+    # Pages of each of the boards above after or before a cursor
+    'get_leaderboards_page': Endpoint(
+        'GET', 'leaderboards/{num}/{direction}/{cursor}/', ('num', 'direction', 'cursor'), cached=True),
+    'get_loserboards_page': Endpoint(
+        'GET', 'loserboards/{num}/{direction}/{cursor}/', ('num', 'direction', 'cursor'), cached=True),
+    'get_dream_teams_page': Endpoint(
+        'GET', 'dream_teams/{num}/{direction}/{cursor}/', ('num', 'direction', 'cursor'), cached=True),
+    'get_nightmare_teams_page': Endpoint(
+        'GET', 'nightmare_teams/{num}/{direction}/{cursor}/', ('num', 'direction', 'cursor'), cached=True),
+    'delete_latest_match': Endpoint(
+        'DELETE', 'delete_latest_match/',
+        errors={404: 'No match found.'},
+        timeout=WRITE_TIMEOUT,
+        # We don't know who was in the deleted match
+        invalidates_cache=True),
+}
+
+
+class EloServiceClient:
+    """
+    Talks to the elo service over one pooled aiohttp session, so a burst of
+    commands reuses warm keep-alive connections instead of opening a socket
+    per request. Call open() from the running event loop before use (the bot
+    does this in on_ready) and close() on shutdown.
+
+    Has a method for each of ENDPOINTS, taking its params. Every one returns
+    {'success': True, 'data': ...} or {'success': False, 'error': message}.
+
+    on_request, if set, is called with (endpoint name, status or None,
+    seconds taken) after every request actually sent to the elo service.
+    """
+    def __init__(self, base_url=BASE_URL, max_connections=MAX_CONNECTIONS,
+                 max_concurrent_requests=MAX_CONCURRENT_REQUESTS):
+        self.base_url = base_url
+        self.max_connections = max_connections
+        self.max_concurrent_requests = max_concurrent_requests
+        self.cache = ResponseCache()
+        self.on_request = None
+        self._session = None
+        self._slots = None
+
+    async def open(self):
+        # on_ready fires again after every reconnect, so only open once
+        if self._session is not None and not self._session.closed:
+            return
+
+        connector = aiohttp.TCPConnector(
+            limit=self.max_connections,
+            keepalive_timeout=KEEPALIVE_TIMEOUT)
+        self._session = aiohttp.ClientSession(connector=connector, timeout=READ_TIMEOUT)
+        self._slots = asyncio.BoundedSemaphore(self.max_concurrent_requests)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def request(self, name, *args):
+        """
+        Calls the endpoint called name with args, going through the cache for
+        cached endpoints and emptying it after those that invalidate it.
+        """
+        endpoint = ENDPOINTS[name]
+        if len(args) != len(endpoint.params):
+            raise TypeError(f'{name}() takes {len(endpoint.params)} arguments ({len(args)} given)')
+
+        # Counted from the command's side, so time spent waiting on a cached
+        # or shared request is included
+        with tracing.span('api'):
+            if endpoint.cached:
+                return await self.cache.get_or_fetch((name, args), lambda: self._execute(name, endpoint, args))
+
+            try:
+                return await self._execute(name, endpoint, args)
+            finally:
+                if endpoint.invalidates_cache:
+                    self.cache.invalidate()
+
+    async def _execute(self, name, endpoint, args):
+        params = dict(zip(endpoint.params, args))
+        url = f'{self.base_url}/{endpoint.path.format(**params)}'
+        kwargs = {'timeout': endpoint.timeout}
+        if endpoint.body:
+            kwargs[endpoint.body] = {param: params[param] for param in endpoint.body_params}
+
+        for attempt in range(MAX_RETRIES + 1):
+            async with self._slots:
+                start = time.perf_counter()
+                status = None
+                try:
+                    async with self._session.request(endpoint.method, url, **kwargs) as resp:
+                        status = resp.status
+                        if resp.status == endpoint.ok_status:
+                            return {
+                                'success': True,
+                                'data': await resp.json()
+                            }
+                        elif resp.status in endpoint.errors:
+                            return _error(endpoint.errors[resp.status])
+                        return _error(await resp.text())
+                except asyncio.TimeoutError:
+                    return _error(TIMEOUT_ERROR)
+                except aiohttp.ClientConnectionError as e:
+                    if attempt == MAX_RETRIES or not endpoint.can_retry(e):
+                        return _error(str(e))
+                except Exception as e:
+                    return _error(str(e))
+                finally:
+                    self._observe(name, status, time.perf_counter() - start)
+
+            await asyncio.sleep(random.uniform(0, RETRY_BACKOFF * 2 ** attempt))
+
+    def _observe(self, name, status, seconds):
+        if seconds > SLOW_REQUEST_SECONDS:
+            print(f'Slow elo service request: {name} took {seconds:.2f}s (status {status})')
+        if self.on_request is not None:
+            self.on_request(name, status, seconds)
+
+
+def _endpoint_method(name):
+    async def method(self, *args):
+        return await self.request(name, *args)
+    method.__name__ = name
+    method.__qualname__ = f'EloServiceClient.{name}'
+    return method
+
+
+for _name in ENDPOINTS:
+    setattr(EloServiceClient, _name, _endpoint_method(_name))
+
+
+client = EloServiceClient()
@@ -0,0 +1,101 @@
+import re
+
+import discord
+
+from discord_config import HELP_COLOR
+import tracing
+
+# <name> is a required argument and [name] an optional one
+_ARGUMENT_RE = re.compile(r'<(\w+)>|\[(\w+)\]')
+
+
+class Command:
+    """
+    A bot command. Its arguments are read from usage, e.g.
+    '!top [num] [teams]', and passed to the handler in order after going
+    through their converter, if they have one. Optional arguments that
+    weren't given are left to the handler's defaults.
+
+    cost is how many rate limit tokens running it takes.
+    """
+    def __init__(self, name, handler, usage, description, aliases=(), converters=None, cost=1):
+        self.name = name
+        self.handler = handler
+        self.usage = usage
+        self.description = description
+        self.aliases = aliases
+        self.converters = converters or {}
+        self.cost = cost
+
+        arguments = _ARGUMENT_RE.findall(usage)
+        self.required = [required for required, _ in arguments if required]
+        self.arguments = [required or optional for required, optional in arguments]
+
+    def parse(self, tokens):
+        """
+        Returns the handler's arguments for the tokens after the command, or
+        None if they don't fit the usage.
+        """
+        if not len(self.required) <= len(tokens) <= len(self.arguments) or tokens[:1] == ['help']:
+            return None
+
+        args = []
+        for argument, token in zip(self.arguments, tokens):
+            converter = self.converters.get(argument)
+            try:
+                args.append(converter(token) if converter else token)
+            except ValueError:
+                return None
+        return args
+
+
+class CommandRegistry:
+    """
+    Maps the first word of a message to its command, aliases included, so
+    dispatching costs one prefix check for ordinary chat and one dict lookup
+    for commands.
+    """
+    def __init__(self, prefix='!'):
+        self.prefix = prefix
+        self.commands = []
+        self._by_name = {}
+
+    def register(self, name, handler, usage, description, aliases=(), converters=None, cost=1):
+        command = Command(name, handler, usage, description, aliases, converters, cost)
+        self.commands.append(command)
+        for key in (name, *aliases):
+            if key in self._by_name:
+                raise ValueError(f'{key} is already registered')
+            self._by_name[key] = command
+        return command
+
+    def find(self, content):
+        """
+        Returns (command, tokens after the command) for a message, or
+        (None, None) if it isn't a command.
+        """
+        if not content.startswith(self.prefix):
+            return None, None
+
+        tokens = content.lower().split()
+        command = self._by_name.get(tokens[0])
+        if command is None:
+            return None, None
+        return command, tokens[1:]
+
+    async def run(self, command, tokens, message):
+        """
+        Runs command with the tokens after it, replying with its usage
+        instead if they don't fit.
+        """
+        with tracing.span('parse'):
+            args = command.parse(tokens)
+        if args is None:
+            embed = discord.Embed(
+                title='Usage',
+                description=command.usage,
+                color=HELP_COLOR)
+            await message.channel.send(embed=embed)
+            return
+
+        await command.handler(message, *args)
@@ -7,7 +7,13 @@ CLIENT_ID = os.environ.get('DISCORD_CLIENT_ID')
 CLIENT_SECRET = os.environ.get('DISCORD_CLIENT_SECRET')
 TOKEN = os.environ.get('DISCORD_TOKEN')
 
+# Serves the bot's command latencies for Prometheus at
+# http://BOT_METRICS_HOST:BOT_METRICS_PORT/metrics, if a port is set
+METRICS_HOST = os.environ.get('BOT_METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.environ.get('BOT_METRICS_PORT') or 0)
+
 SUCCESS_COLOR = 0x00ff00
 INFO_COLOR = 0x00cbff
 HELP_COLOR = 0xffe900
+WARNING_COLOR = 0xff8c00
 ERROR_COLOR = 0xff0000
@@ -3,25 +3,12 @@ import discord
 
 from discord_config import (
     ERROR_COLOR,
-    HELP_COLOR,
     INFO_COLOR,
     SUCCESS_COLOR
 )
 
 
-async def create_user(message):
-    try:
-        _, username = message.content.split(' ')
-        if username == 'help':
-            raise ValueError
-    except ValueError:
-        embed = discord.Embed(
-            title='Usage',
-            description='!createuser <username>',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        return
-
+async def create_user(message, username):
     if not username or not username.isalpha():
         embed = discord.Embed(
             title='Error',
@@ -30,7 +17,7 @@ async def create_user(message):
         await message.channel.send(embed=embed)
         return
 
-    resp = await api.create_player(username)
+    resp = await api.client.create_player(username)
     if not resp['success']:
         embed = discord.Embed(
             title=f'Unable to create user',
@@ -48,19 +35,7 @@ async def create_user(message):
     await message.channel.send(embed=embed)
 
 
-async def get_stats(message):
-    try:
-        _, username = message.content.split(' ')
-        if username == 'help':
-            raise ValueError
-    except ValueError:
-        embed = discord.Embed(
-            title='Usage',
-            description='!elo <username>',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        return
-
+async def get_stats(message, username):
     if not username or not username.isalpha():
         embed = discord.Embed(
             title='Error',
@@ -69,7 +44,7 @@ async def get_stats(message):
         await message.channel.send(embed=embed)
         return
 
-    resp = await api.get_player(username)
+    resp = await api.client.get_player(username)
     if not resp['success']:
         embed = discord.Embed(
             title=f'Unable to get stats for {username}',
@@ -81,6 +56,7 @@ async def get_stats(message):
     data = resp['data']
     names_and_scores = [
         ('Elo', data['elo']),
+        *_rank_lines(data),
         ('Wins', data['wins']),
         ('Losses', data['losses']),
         ('Win Percentage', f'{data["win_percentage"]:0.1f}%'),
@@ -98,17 +74,7 @@ async def get_stats(message):
     await message.channel.send(embed=embed)
 
 
-async def get_team(message):
-    try:
-        _, player1, player2 = message.content.split(' ')
-    except ValueError:
-        embed = discord.Embed(
-            title='Usage',
-            description='!team <player1> <player2>',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        return
-
+async def get_team(message, player1, player2):
     if not player1 or not player2 or not player1.isalnum() or not player2.isalnum():
         embed = discord.Embed(
             title='Error',
@@ -120,7 +86,7 @@ async def get_team(message):
     player1 = player1.lower()
     player2 = player2.lower()
 
-    resp = await api.get_team(player1, player2)
+    resp = await api.client.get_team(player1, player2)
     if not resp['success']:
         embed = discord.Embed(
             title='Unable to get stats for team',
@@ -132,6 +98,7 @@ async def get_team(message):
     data = resp['data']
     names_and_scores = [
         ('Elo', data['elo']),
+        *_rank_lines(data),
         ('Wins', data['wins']),
         ('Losses', data['losses']),
         ('Win Percentage', f'{data["win_percentage"]:0.1f}%'),
@@ -149,158 +116,70 @@ async def get_team(message):
     await message.channel.send(embed=embed)
 
 
-async def top(message):
-    is_team = False
-    try:
-        message_tuple = message.content.split(' ')
-        if len(message_tuple) == 3:
-            is_team = message_tuple[2].lower() in ('team', 'teams')
-        top_num = int(message_tuple[1])
-    except Exception:
-        embed = discord.Embed(
-            title='Usage',
-            description='!top <num> [teams]',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        top_num = 10
+MAX_BOARD_SIZE = 50
 
-    if is_team:
-        await _top_teams(message.channel, top_num)
-    else:
-        await _top_players(message.channel, top_num)
+# board -> (elo service endpoint, key of the rows in its response, title)
+BOARDS = {
+    'top_players': ('get_leaderboards', 'players', 'Top players'),
+    'bottom_players': ('get_loserboards', 'players', 'Bottom players'),
+    'dream_teams': ('get_dream_teams', 'teams', 'Dream teams'),
+    'nightmare_teams': ('get_nightmare_teams', 'teams', 'Nightmare teams'),
+}
 
+# The board page last shown in each channel, for !next and !prev
+_board_pages = {}
 
-async def _top_players(channel, num=10):
-    resp = await api.get_leaderboards(num)
 
-    if not resp['success']:
-        embed = discord.Embed(
-            title='Something went wrong',
-            description=resp['error'][:1500],
-            color=ERROR_COLOR)
-        await channel.send(embed=embed)
-        return
+async def top(message, num=10, teams=None):
+    board = 'dream_teams' if teams in ('team', 'teams') else 'top_players'
+    await _show_board(message.channel, board, num)
 
-    players = resp['data']['players']
-    if not players:
-        embed = discord.Embed(
-            title='Error',
-            description='No players have played >= 3 games',
-            color=ERROR_COLOR)
-        await channel.send(embed=embed)
-        return
 
-    # Names are of the form "01. username"
-    names_and_scores = [
-        (f'{i + 1:0>2}. {player["username"]}', player['elo'])
-        for i, player in enumerate(players)]
-    output = _get_output_from_names_and_scores(names_and_scores)
+async def dream_teams(message, num=10):
+    await _show_board(message.channel, 'dream_teams', num)
 
-    embed = discord.Embed(
-        title=f'Top {len(names_and_scores)} players',
-        description=output,
-        color=INFO_COLOR
-    )
-    await channel.send(embed=embed)
 
+async def bottom(message, num=10, teams=None):
+    board = 'nightmare_teams' if teams in ('team', 'teams') else 'bottom_players'
+    await _show_board(message.channel, board, num)
 
-async def _top_teams(channel, num=10):
-    resp = await api.get_dream_teams(num)
 
-    if not resp['success']:
-        embed = discord.Embed(
-            title='Error',
-            description=resp['error'][:1500],
-            color=ERROR_COLOR)
-        await channel.send(embed=embed)
-        return
+async def next_page(message):
+    await _turn_page(message.channel, 'after')
 
-    teams = resp['data']['teams']
-    if not teams:
-        embed = discord.Embed(
-            title='Error',
-            description='No teams have played >= 3 games',
-            color=ERROR_COLOR)
-        await channel.send(embed=embed)
-        return
-
-    # Names are of the form "01. a and b"
-    team_names_and_scores = [
-        (f'{i + 1:0>2}. {" and ".join(sorted(team["players"]))}', team["elo"])
-        for i, team in enumerate(teams)]
-
-    output = _get_output_from_names_and_scores(team_names_and_scores)
-
-    embed = discord.Embed(
-        title='Dream teams',
-        description=output,
-        color=INFO_COLOR
-    )
-    await channel.send(embed=embed)
-
-
-async def dream_teams(message):
-    await _top_teams(message.channel)
 
+async def previous_page(message):
+    await _turn_page(message.channel, 'before')
 
-async def bottom(message):
-    is_team = False
-    try:
-        message_tuple = message.content.split(' ')
-        if len(message_tuple) == 3:
-            is_team = message_tuple[2].lower() in ('team', 'teams')
-        top_num = int(message_tuple[1])
-    except Exception:
-        embed = discord.Embed(
-            title='Usage',
-            description='!bottom <num> [teams]',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        top_num = 10
-
-    if is_team:
-        await _bottom_teams(message.channel, top_num)
-    else:
-        await _bottom_players(message.channel, top_num)
-
-
-async def _bottom_teams(channel, num=10):
-    resp = await api.get_nightmare_teams(num)
-
-    if not resp['success']:
-        embed = discord.Embed(
-            title='Error',
-            description=resp['error'][:1500],
-            color=ERROR_COLOR)
-        await channel.send(embed=embed)
-        return
 
-    teams = resp['data']['teams']
-    if not teams:
+async def _turn_page(channel, direction):
+    page = _board_pages.get(channel.id)
+    cursor = page and page['next' if direction == 'after' else 'prev']
+    if not cursor:
         embed = discord.Embed(
             title='Error',
-            description='No teams have played >= 3 games',
+            description='No more pages. Show a board first with !top or !bottom.',
             color=ERROR_COLOR)
         await channel.send(embed=embed)
         return
 
-    # Names are of the form "01. a and b"
-    team_names_and_scores = [
-        (f'{i + 1:0>2}. {" and ".join(sorted(team["players"]))}', team["elo"])
-        for i, team in enumerate(teams)]
+    first_rank = page['first_rank'] + page['count'] if direction == 'after' else page['first_rank']
+    await _show_board(channel, page['board'], page['num'], direction, cursor, first_rank)
 
-    output = _get_output_from_names_and_scores(team_names_and_scores)
 
-    embed = discord.Embed(
-        title='Nightmare teams',
-        description=output,
-        color=INFO_COLOR
-    )
-    await channel.send(embed=embed)
-
-
-async def _bottom_players(channel, num=10):
-    resp = await api.get_loserboards(num)
+async def _show_board(channel, board, num, direction=None, cursor=None, first_rank=1):
+    """
+    Shows a page of num rows of board: the first one, or the one right after
+    or before cursor. first_rank is the rank of the row after the cursor, or
+    of the cursor row itself when going backwards; ranks are only as accurate
+    as the board was stable while paging through it.
+    """
+    endpoint, key, title = BOARDS[board]
+    num = max(1, min(num, MAX_BOARD_SIZE))
+    if cursor is None:
+        resp = await api.client.request(endpoint, num)
+    else:
+        resp = await api.client.request(f'{endpoint}_page', num, direction, cursor)
 
     if not resp['success']:
         embed = discord.Embed(
@@ -310,41 +189,55 @@ async def _bottom_players(channel, num=10):
         await channel.send(embed=embed)
         return
 
-    players = resp['data']['players']
-    if not players:
+    data = resp['data']
+    rows = data[key]
+    if not rows:
+        if cursor is not None:
+            description = 'No more pages'
+        elif key == 'players':
+            description = 'No players have played >= 3 games'
+        else:
+            description = 'No teams have played >= 3 games'
         embed = discord.Embed(
             title='Error',
-            description='No players have played >= 3 games',
+            description=description,
             color=ERROR_COLOR)
         await channel.send(embed=embed)
         return
 
-    # Names are of the form "01. username"
+    if direction == 'before':
+        first_rank -= len(rows)
+
+    # Names are of the form "01. username" or "01. a and b"
+    if key == 'players':
+        names = [row['username'] for row in rows]
+    else:
+        names = [' and '.join(sorted(row['players'])) for row in rows]
     names_and_scores = [
-        (f'{i + 1:0>2}. {player["username"]}', player['elo'])
-        for i, player in enumerate(players)]
+        (f'{first_rank + i:0>2}. {name}', row['elo'])
+        for i, (name, row) in enumerate(zip(names, rows))]
     output = _get_output_from_names_and_scores(names_and_scores)
 
     embed = discord.Embed(
-        title=f'Bottom {len(names_and_scores)} players',
+        title=f'{title} {first_rank}-{first_rank + len(rows) - 1}',
         description=output,
         color=INFO_COLOR
     )
+    if data['prev'] or data['next']:
+        embed.set_footer(text='!prev and !next to turn the page')
     await channel.send(embed=embed)
 
+    _board_pages[channel.id] = {
+        'board': board,
+        'num': num,
+        'first_rank': first_rank,
+        'count': len(rows),
+        'prev': data['prev'],
+        'next': data['next'],
+    }
 
-async def record_match(message):
-    try:
-        _, wp1, wp2, lp1, lp2, losing_score = message.content.split(' ')
-    except ValueError:
-        embed = discord.Embed(
-            title='Usage',
-            description='!record <winning_player1> <winning_player2> '
-                        '<losing_player1> <losing_player2> <losing_score>',
-            color=HELP_COLOR)
-        await message.channel.send(embed=embed)
-        return
 
+async def record_match(message, wp1, wp2, lp1, lp2, losing_score):
     try:
         losing_score = int(losing_score)
     except ValueError:
@@ -363,7 +256,7 @@ async def record_match(message):
         await message.channel.send(embed=embed)
         return
 
-    resp = await api.record_match([wp1, wp2], [lp1, lp2], 5, losing_score)
+    resp = await api.client.record_match([wp1, wp2], [lp1, lp2], 5, losing_score)
     if not resp['success']:
         embed = discord.Embed(
             title='Error occurred while recording match',
@@ -400,7 +293,7 @@ async def record_match(message):
 
 
 async def delete_latest_match(message):
-    resp = await api.delete_latest_match()
+    resp = await api.client.delete_latest_match()
 
     if not resp['success']:
         embed = discord.Embed(
@@ -417,6 +310,16 @@ async def delete_latest_match(message):
     await message.channel.send(embed=embed)
 
 
+def _rank_lines(data):
+    # Only players with 3+ games and teams with 3+ wins are ranked
+    if data.get('rank') is None:
+        return [('Rank', 'Unranked')]
+    return [
+        ('Rank', f'#{data["rank"]}'),
+        ('Percentile', f'{data["percentile"]:0.1f}%'),
+    ]
+
+
 def _get_output_from_names_and_scores(names_and_scores, fill='.'):
     """
     names_and_scores is a list of tuples [(username1, score1), ...].
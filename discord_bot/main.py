@@ -1,18 +1,53 @@
+import time
 import traceback
 
 import discord
 
 from discord_config import (
     HELP_COLOR,
-    TOKEN
+    INFO_COLOR,
+    METRICS_HOST,
+    METRICS_PORT,
+    TOKEN,
+    WARNING_COLOR
 )
+from commands import CommandRegistry
+from ratelimit import RateLimiter, check_limits
+import api
 import handlers
+import tracing
 
-client = discord.Client()
+# Each user can fire off 5 commands at once, then one every 3 seconds. A
+# channel as a whole gets 15 at once, then one a second.
+user_limiter = RateLimiter(rate=1 / 3, capacity=5)
+channel_limiter = RateLimiter(rate=1, capacity=15)
+
+# Embed descriptions are cut off past this
+MAX_DESCRIPTION_LENGTH = 2048
+
+api.client.on_request = tracing.observe_request
+
+
+class EloBot(discord.Client):
+    metrics_runner = None
+
+    async def close(self):
+        await api.client.close()
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        await super().close()
+
+
+client = EloBot()
 
 
 @client.event
 async def on_ready():
+    await api.client.open()
+    # on_ready fires again after every reconnect, so only start serving once
+    if METRICS_PORT and client.metrics_runner is None:
+        client.metrics_runner = await tracing.serve_metrics(METRICS_HOST, METRICS_PORT)
+
     print("Logged in as")
     print(client.user.name)
     print(client.user.id)
@@ -20,37 +55,118 @@ async def on_ready():
 
 
 async def help_me(message):
-    help_msg = "\t\n".join(sorted(handler_map.keys()))
+    help_msg = "\n".join(
+        f"{command.usage} - {command.description}"
+        + (f" (also {', '.join(command.aliases)})" if command.aliases else "")
+        for command in sorted(registry.commands, key=lambda command: command.name))
     embed = discord.Embed(
         title="Accepted commands",
         description=help_msg,
         color=HELP_COLOR)
     await message.channel.send(embed=embed)
 
-handler_map = {
-    '!help': help_me,
-    '!createuser': handlers.create_user,
-    '!elo': handlers.get_stats,
-    '!stats': handlers.get_stats,
-    '!team': handlers.get_team,
-    '!top': handlers.top,
-    '!bottom': handlers.bottom,
-    '!leaderboard': handlers.top,
-    '!dreamteam': handlers.dream_teams,
-    '!report': handlers.record_match,
-    '!record': handlers.record_match,
-    '!undo': handlers.delete_latest_match
-}
+
+async def bot_stats(message):
+    permissions = getattr(message.author, 'guild_permissions', None)
+    if permissions is None or not permissions.administrator:
+        embed = discord.Embed(
+            title="Not allowed",
+            description="Only server admins can see the bot's stats.",
+            color=WARNING_COLOR)
+        await message.channel.send(embed=embed)
+        return
+
+    stats = "\n".join(tracing.summary()) or "No commands handled yet."
+    embed = discord.Embed(
+        title="Command latency",
+        description=f"```\n{stats[:MAX_DESCRIPTION_LENGTH - 8]}\n```",
+        color=INFO_COLOR)
+    await message.channel.send(embed=embed)
+
+registry = CommandRegistry()
+registry.register(
+    '!help', help_me,
+    '!help', 'Lists these commands')
+registry.register(
+    '!createuser', handlers.create_user,
+    '!createuser <username>', 'Adds a player')
+registry.register(
+    '!elo', handlers.get_stats,
+    '!elo <username>', "Shows a player's elo and stats",
+    aliases=('!stats',))
+registry.register(
+    '!team', handlers.get_team,
+    '!team <player1> <player2>', "Shows a team's elo and stats")
+registry.register(
+    '!top', handlers.top,
+    '!top [num] [teams]', 'Shows the highest rated players or teams',
+    aliases=('!leaderboard',),
+    converters={'num': int},
+    cost=2)
+registry.register(
+    '!bottom', handlers.bottom,
+    '!bottom [num] [teams]', 'Shows the lowest rated players or teams',
+    converters={'num': int},
+    cost=2)
+registry.register(
+    '!dreamteam', handlers.dream_teams,
+    '!dreamteam [num]', 'Shows the highest rated teams',
+    converters={'num': int},
+    cost=2)
+registry.register(
+    '!next', handlers.next_page,
+    '!next', 'Shows the next page of the last board shown in the channel',
+    cost=2)
+registry.register(
+    '!prev', handlers.previous_page,
+    '!prev', 'Shows the previous page of the last board shown in the channel',
+    cost=2)
+registry.register(
+    '!record', handlers.record_match,
+    '!record <winning_player1> <winning_player2> <losing_player1> <losing_player2> <losing_score>',
+    'Records a match won 5 to losing_score',
+    aliases=('!report',))
+registry.register(
+    '!undo', handlers.delete_latest_match,
+    '!undo', 'Deletes the latest match')
+registry.register(
+    '!botstats', bot_stats,
+    '!botstats', "Shows how long the bot's commands take, split into parsing, elo service, "
+                 "embed and discord time (admins only)")
+
+
+async def slow_down(message, wait):
+    embed = discord.Embed(
+        title="Slow down",
+        description=f"Too many commands, try again in {wait:.0f} seconds.",
+        color=WARNING_COLOR)
+    await message.channel.send(embed=embed)
 
 
 @client.event
 async def on_message(message):
+    start = time.perf_counter()
+    command, tokens = registry.find(message.content)
+    if command is None:
+        return
+    find_seconds = time.perf_counter() - start
+
     try:
-        for keyword, handler in handler_map.items():
-            if message.content.lower().startswith(keyword):
-                message.content = message.content.lower()
-                await handler(message)
-                break
+        buckets = (user_limiter.bucket(message.author.id), channel_limiter.bucket(message.channel.id))
+        wait = check_limits(buckets, command.cost)
+        if wait:
+            # Warn once per burst rather than answering every extra message
+            if not any(bucket.warned for bucket in buckets):
+                await slow_down(message, max(wait, 1))
+            for bucket in buckets:
+                bucket.warned = True
+            return
+        for bucket in buckets:
+            bucket.warned = False
+
+        with tracing.trace(command.name) as trace:
+            trace.add('parse', find_seconds)
+            await registry.run(command, tokens, tracing.TracedMessage(message))
     except Exception as e:
         traceback.print_exc()
         await message.channel.send(f'Exception occurred: {str(e)[:1950]}')
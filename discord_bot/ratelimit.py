@@ -0,0 +1,73 @@
+import time
+from collections import OrderedDict
+
+
+class TokenBucket:
+    """
+    Holds up to capacity tokens and gains rate of them per second. Each
+    command spends its cost in tokens, so bursts are allowed up to capacity
+    but the sustained pace is limited to rate.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        # Whether the owner was told to slow down since their last command got through
+        self.warned = False
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, cost=1):
+        """
+        Returns how many seconds until cost tokens are available, 0 if they are now.
+        """
+        self._refill()
+        return max(0., (cost - self.tokens) / self.rate)
+
+    def take(self, cost=1):
+        self._refill()
+        self.tokens -= cost
+
+
+class RateLimiter:
+    """
+    A TokenBucket per key (e.g. per user id), created on first use. Only the
+    max_keys most recently used buckets are kept; a forgotten key starts
+    over with a full bucket, which is what it would have refilled to anyway
+    unless it was very recently busy.
+    """
+    def __init__(self, rate, capacity, max_keys=10000):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.rate, self.capacity)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket
+
+
+def check_limits(buckets, cost=1):
+    """
+    Spends cost from every bucket if all of them can afford it.
+
+    Returns 0 if the command may run, otherwise the seconds to wait before
+    it could, without spending anything.
+    """
+    wait = max(bucket.wait_time(cost) for bucket in buckets)
+    if wait:
+        return wait
+
+    for bucket in buckets:
+        bucket.take(cost)
+    return 0
@@ -0,0 +1,420 @@
+import asyncio
+import contextlib
+import unittest
+from unittest import mock
+
+import aiohttp
+
+import api
+from commands import CommandRegistry
+from ratelimit import RateLimiter, TokenBucket, check_limits
+import tracing
+
+
+def _ok(data):
+    return {
+        'success': True,
+        'data': data
+    }
+
+
+class _Fetcher:
+    """
+    A fetch for ResponseCache that answers with the number of the call, and
+    while blocked holds every call until release().
+    """
+    def __init__(self, blocked=False):
+        self.calls = 0
+        self._released = asyncio.Event()
+        if not blocked:
+            self._released.set()
+
+    def release(self):
+        self._released.set()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self._released.wait()
+        return _ok(call)
+
+
+class ResponseCacheTests(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_lookups_share_a_request(self):
+        cache = api.ResponseCache()
+        fetch = _Fetcher(blocked=True)
+
+        lookups = [asyncio.ensure_future(cache.get_or_fetch(('get_player', ('alice',)), fetch)) for _ in range(3)]
+        await asyncio.sleep(0)
+        fetch.release()
+
+        self.assertEqual(await asyncio.gather(*lookups), [_ok(1)] * 3)
+        self.assertEqual(fetch.calls, 1)
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(1))
+        self.assertEqual(fetch.calls, 1)
+
+    async def test_cancelled_caller_does_not_cancel_the_request(self):
+        cache = api.ResponseCache()
+        fetch = _Fetcher(blocked=True)
+
+        cancelled = asyncio.ensure_future(cache.get_or_fetch(('get_player', ('alice',)), fetch))
+        waiting = asyncio.ensure_future(cache.get_or_fetch(('get_player', ('alice',)), fetch))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        fetch.release()
+
+        self.assertEqual(await waiting, _ok(1))
+        self.assertTrue(cancelled.cancelled())
+        # And its result was still stored
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(1))
+        self.assertEqual(fetch.calls, 1)
+
+    async def test_lookup_in_flight_when_invalidated_is_not_stored(self):
+        cache = api.ResponseCache()
+        fetch = _Fetcher(blocked=True)
+
+        before = asyncio.ensure_future(cache.get_or_fetch(('get_player', ('alice',)), fetch))
+        await asyncio.sleep(0)
+        cache.invalidate()
+        # Asking again after the invalidation doesn't join the stale request
+        after = asyncio.ensure_future(cache.get_or_fetch(('get_player', ('alice',)), fetch))
+        await asyncio.sleep(0)
+        fetch.release()
+
+        self.assertEqual(await before, _ok(1))
+        self.assertEqual(await after, _ok(2))
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(2))
+        self.assertEqual(fetch.calls, 2)
+
+    async def test_failures_are_not_stored(self):
+        cache = api.ResponseCache()
+
+        async def fail():
+            return api._error('Player with that username was not found.')
+
+        await cache.get_or_fetch(('get_player', ('alice',)), fail)
+
+        fetch = _Fetcher()
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(1))
+
+    async def test_least_recently_used_are_evicted(self):
+        cache = api.ResponseCache(max_entries=2)
+        fetch = _Fetcher()
+
+        for username in ('alice', 'bob'):
+            await cache.get_or_fetch(('get_player', (username,)), fetch)
+        await cache.get_or_fetch(('get_player', ('alice',)), fetch)
+        await cache.get_or_fetch(('get_player', ('carol',)), fetch)
+        self.assertEqual(fetch.calls, 3)
+
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(1))
+        self.assertEqual(await cache.get_or_fetch(('get_player', ('bob',)), fetch), _ok(4))
+
+    async def test_entries_expire(self):
+        cache = api.ResponseCache(ttl=30)
+        fetch = _Fetcher()
+
+        with mock.patch('api.time.monotonic', return_value=1000):
+            await cache.get_or_fetch(('get_player', ('alice',)), fetch)
+        with mock.patch('api.time.monotonic', return_value=1029):
+            self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(1))
+        with mock.patch('api.time.monotonic', return_value=1030):
+            self.assertEqual(await cache.get_or_fetch(('get_player', ('alice',)), fetch), _ok(2))
+
+
+class _Response:
+    def __init__(self, status, data):
+        self.status = status
+        self._data = data
+
+    async def json(self):
+        return self._data
+
+    async def text(self):
+        return str(self._data)
+
+
+class _Session:
+    """
+    Stands in for the client's aiohttp session, answering each request with
+    the next of outcomes: an exception to raise or a (status, data) response.
+    """
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.sent = []
+
+    def request(self, method, url, **kwargs):
+        self.sent.append((method, url))
+        return self._respond(self.outcomes.pop(0))
+
+    @contextlib.asynccontextmanager
+    async def _respond(self, outcome):
+        if isinstance(outcome, BaseException):
+            raise outcome
+        yield _Response(*outcome)
+
+
+def _connector_error():
+    connection_key = mock.Mock(host='elo-service', port=8000, ssl=None)
+    return aiohttp.ClientConnectorError(connection_key, ConnectionRefusedError('Connection refused'))
+
+
+class EndpointRetryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.client = api.EloServiceClient(base_url='http://elo-service/foos')
+        self.client._slots = asyncio.BoundedSemaphore(1)
+        self.observed = []
+        self.client.on_request = lambda name, status, seconds: self.observed.append((name, status))
+        patcher = mock.patch.object(api, 'RETRY_BACKOFF', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_can_retry(self):
+        get = api.ENDPOINTS['get_player']
+        post = api.ENDPOINTS['record_match']
+
+        self.assertTrue(get.can_retry(_connector_error()))
+        self.assertTrue(post.can_retry(_connector_error()))
+        self.assertTrue(get.can_retry(aiohttp.ServerDisconnectedError()))
+        self.assertFalse(post.can_retry(aiohttp.ServerDisconnectedError()))
+        self.assertFalse(get.can_retry(asyncio.TimeoutError()))
+        self.assertFalse(get.can_retry(aiohttp.ServerTimeoutError()))
+
+    async def test_write_is_not_retried_once_sent(self):
+        self.client._session = _Session(aiohttp.ServerDisconnectedError(), (200, {}))
+
+        result = await self.client.record_match(['alice', 'bob'], ['carol', 'dave'], 5, 3)
+
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.client._session.sent), 1)
+
+    async def test_connector_errors_are_retried(self):
+        self.client._session = _Session(_connector_error(), _connector_error(), (201, {'username': 'alice'}))
+
+        result = await self.client.create_player('alice')
+
+        self.assertEqual(result, _ok({'username': 'alice'}))
+        self.assertEqual(self.observed, [('create_player', None), ('create_player', None), ('create_player', 201)])
+
+    async def test_connector_errors_give_up_after_max_retries(self):
+        self.client._session = _Session(*[_connector_error() for _ in range(api.MAX_RETRIES + 2)])
+
+        result = await self.client.get_player('alice')
+
+        self.assertFalse(result['success'])
+        self.assertEqual(len(self.client._session.sent), api.MAX_RETRIES + 1)
+
+    async def test_timeouts_are_not_retried(self):
+        self.client._session = _Session(asyncio.TimeoutError(), (200, {}))
+
+        result = await self.client.get_player('alice')
+
+        self.assertEqual(result, api._error(api.TIMEOUT_ERROR))
+        self.assertEqual(len(self.client._session.sent), 1)
+
+
+class _Channel:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, *args, **kwargs):
+        self.sent.append(kwargs.get('embed') or args[0])
+
+
+class _Message:
+    def __init__(self, content=''):
+        self.content = content
+        self.channel = _Channel()
+
+
+class CommandRegistryTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.calls = []
+
+        async def top(message, num=10, teams=None):
+            self.calls.append((num, teams))
+
+        self.registry = CommandRegistry()
+        self.top = self.registry.register(
+            '!top', top, '!top [num] [teams]', 'Shows the highest rated players or teams',
+            aliases=('!leaderboard',), converters={'num': int})
+        self.record = self.registry.register(
+            '!record', top, '!record <winner1> <winner2> <loser1> <loser2> <losing_score>', 'Records a match')
+
+    def test_find(self):
+        self.assertEqual(self.registry.find('!top 5 teams'), (self.top, ['5', 'teams']))
+        self.assertEqual(self.registry.find('!LEADERBOARD'), (self.top, []))
+        self.assertEqual(self.registry.find('!topp'), (None, None))
+        self.assertEqual(self.registry.find('top 5'), (None, None))
+        self.assertEqual(self.registry.find('!'), (None, None))
+
+    def test_names_are_unique(self):
+        with self.assertRaises(ValueError):
+            self.registry.register('!leaderboard', None, '!leaderboard', 'Clashes with an alias')
+
+    def test_parse(self):
+        self.assertEqual(self.top.parse([]), [])
+        self.assertEqual(self.top.parse(['5']), [5])
+        self.assertEqual(self.top.parse(['5', 'teams']), [5, 'teams'])
+        self.assertIsNone(self.top.parse(['five']))
+        self.assertIsNone(self.top.parse(['5', 'teams', 'please']))
+        self.assertIsNone(self.top.parse(['help']))
+
+        self.assertEqual(self.record.parse(['a', 'b', 'c', 'd', '3']), ['a', 'b', 'c', 'd', '3'])
+        self.assertIsNone(self.record.parse(['a', 'b', 'c', 'd']))
+
+    async def test_run(self):
+        message = _Message('!top 5')
+        await self.registry.run(self.top, ['5'], message)
+        self.assertEqual(self.calls, [(5, None)])
+        self.assertEqual(message.channel.sent, [])
+
+        message = _Message('!top five')
+        await self.registry.run(self.top, ['five'], message)
+        self.assertEqual(self.calls, [(5, None)])
+        self.assertEqual([embed.description for embed in message.channel.sent], ['!top [num] [teams]'])
+
+
+class _Clock:
+    def __init__(self, now=1000.):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class RateLimitTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch('ratelimit.time.monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bucket_allows_bursts_then_refills(self):
+        bucket = TokenBucket(rate=0.5, capacity=3)
+
+        for _ in range(3):
+            self.assertEqual(bucket.wait_time(), 0)
+            bucket.take()
+        self.assertEqual(bucket.wait_time(), 2)
+        self.assertEqual(bucket.wait_time(cost=2), 4)
+
+        self.clock.now += 2
+        self.assertEqual(bucket.wait_time(), 0)
+        bucket.take()
+        self.assertEqual(bucket.wait_time(), 2)
+
+        # Never holds more than capacity, however long it sits
+        self.clock.now += 3600
+        self.assertEqual(bucket.tokens, 0)
+        bucket.wait_time()
+        self.assertEqual(bucket.tokens, 3)
+
+    def test_check_limits_spends_from_every_bucket_or_none(self):
+        user = TokenBucket(rate=1 / 3, capacity=5)
+        channel = TokenBucket(rate=1, capacity=2)
+
+        self.assertEqual(check_limits((user, channel), cost=2), 0)
+        self.assertEqual((user.tokens, channel.tokens), (3, 0))
+
+        # The channel is out, so the user keeps their tokens
+        self.assertEqual(check_limits((user, channel)), 1)
+        self.assertEqual((user.tokens, channel.tokens), (3, 0))
+
+        self.clock.now += 1
+        self.assertEqual(check_limits((user, channel)), 0)
+        self.assertAlmostEqual(user.tokens, 2 + 1 / 3)
+        self.assertEqual(channel.tokens, 0)
+
+    def test_limiter_forgets_least_recently_used_keys(self):
+        limiter = RateLimiter(rate=1, capacity=5, max_keys=2)
+
+        alice = limiter.bucket('alice')
+        limiter.bucket('bob')
+        self.assertIs(limiter.bucket('alice'), alice)
+        limiter.bucket('carol')
+
+        self.assertIs(limiter.bucket('alice'), alice)
+        self.assertEqual(len(limiter._buckets), 2)
+        self.assertNotIn('bob', limiter._buckets)
+
+
+class TracingTests(unittest.IsolatedAsyncioTestCase):
+    def setUp(self):
+        self.clock = _Clock()
+        patcher = mock.patch('tracing.time.perf_counter', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for stats in (tracing.commands, tracing.requests, tracing.request_errors):
+            self.addCleanup(stats.clear)
+
+    def test_percentiles(self):
+        histogram = tracing.Histogram()
+        self.assertEqual(histogram.percentile(50), 0)
+
+        for seconds in range(100, 0, -1):
+            histogram.observe(seconds / 1000)
+
+        self.assertEqual(histogram.percentile(50), 0.05)
+        self.assertEqual(histogram.percentile(95), 0.095)
+        self.assertEqual(histogram.percentile(100), 0.1)
+        self.assertEqual(histogram.percentile(0.1), 0.001)
+        self.assertAlmostEqual(histogram.mean, 0.0505)
+
+    async def test_trace_puts_the_rest_in_embed(self):
+        sent = []
+
+        async def send(content):
+            self.clock.now += 0.003
+            sent.append(content)
+
+        message = tracing.TracedMessage(mock.Mock(channel=mock.Mock(send=send)))
+
+        with tracing.trace('!elo') as trace:
+            trace.add('parse', 0.001)
+            self.clock.now += 0.001
+            with tracing.span('api'):
+                self.clock.now += 0.02
+            self.clock.now += 0.004
+            await message.channel.send('alice')
+            self.clock.now += 0.005
+
+        self.assertEqual(sent, ['alice'])
+        stats = tracing.commands['!elo']
+        self.assertEqual(stats.total.count, 1)
+        self.assertAlmostEqual(stats.total.sum, 0.033)
+        self.assertAlmostEqual(stats.phases['parse'].sum, 0.001)
+        self.assertAlmostEqual(stats.phases['api'].sum, 0.02)
+        self.assertAlmostEqual(stats.phases['send'].sum, 0.003)
+        self.assertAlmostEqual(stats.phases['embed'].sum, 0.009)
+        self.assertEqual(stats.errors, 0)
+
+        with self.assertRaises(ValueError), tracing.trace('!elo'):
+            raise ValueError
+        self.assertEqual(stats.errors, 1)
+
+    def test_render(self):
+        for seconds in (0.003, 0.02, 0.02, 30):
+            with tracing.trace('!top'):
+                self.clock.now += seconds
+        tracing.observe_request('get_player', 200, 0.01)
+        tracing.observe_request('get_player', None, 2)
+
+        lines = tracing.render().splitlines()
+
+        self.assertIn('bot_command_duration_seconds_bucket{command="!top",le="0.005"} 1', lines)
+        self.assertIn('bot_command_duration_seconds_bucket{command="!top",le="0.025"} 3', lines)
+        self.assertIn('bot_command_duration_seconds_bucket{command="!top",le="10"} 3', lines)
+        self.assertIn('bot_command_duration_seconds_bucket{command="!top",le="+Inf"} 4', lines)
+        self.assertIn('bot_command_duration_seconds_count{command="!top"} 4', lines)
+        self.assertIn('bot_api_request_duration_seconds_bucket{endpoint="get_player",le="+Inf"} 2', lines)
+        self.assertIn('bot_api_request_errors_total{endpoint="get_player"} 1', lines)
+
+        # Every histogram's +Inf bucket counts all of its samples
+        counts = {line.split(' ')[0].replace('_count', ''): line.split(' ')[1]
+                  for line in lines if '_count{' in line}
+        infinite = {line.split(' ')[0].replace('_bucket', '').replace(',le="+Inf"', ''): line.split(' ')[1]
+                    for line in lines if 'le="+Inf"' in line}
+        self.assertEqual(infinite, counts)
+        self.assertEqual(len(counts), 1 + len(tracing.PHASES) + 1)
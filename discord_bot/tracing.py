@@ -0,0 +1,248 @@
+import math
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from aiohttp import web
+
+# Upper bounds in seconds of the histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Percentiles are taken over this many of the latest samples
+RECENT_SAMPLES = 500
+
+# Where a command's time goes. embed is whatever the handler does besides
+# calling the elo service and sending, which is mostly building the embed.
+PHASES = ('parse', 'api', 'embed', 'send')
+
+CONTENT_TYPE = 'text/plain; version=0.0.4'
+
+
+class Histogram:
+    """
+    Counts durations into BUCKETS, and keeps the latest RECENT_SAMPLES of
+    them for percentiles.
+    """
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.sum = 0.
+        self.count = 0
+        self.recent = deque(maxlen=RECENT_SAMPLES)
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+        self.sum += seconds
+        self.count += 1
+        self.recent.append(seconds)
+
+    def percentile(self, p):
+        """
+        Nearest-rank percentile p (0-100] of the recent samples.
+        """
+        samples = sorted(self.recent)
+        return samples[max(0, math.ceil(p / 100 * len(samples)) - 1)] if samples else 0.
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else 0.
+
+
+class CommandStats:
+    def __init__(self):
+        self.total = Histogram()
+        self.phases = {phase: Histogram() for phase in PHASES}
+        self.errors = 0
+
+
+# Command name -> CommandStats
+commands = {}
+# Elo service endpoint name -> Histogram of its requests, as sent
+requests = {}
+# Elo service endpoint name -> requests that failed or got a 5xx
+request_errors = {}
+
+
+class Trace:
+    """
+    The time one command has spent in each of PHASES so far.
+    """
+    def __init__(self, command):
+        self.command = command
+        self.seconds = dict.fromkeys(PHASES, 0.)
+
+    def add(self, phase, seconds):
+        self.seconds[phase] += seconds
+
+
+_current = ContextVar('bot_trace', default=None)
+
+
+@contextmanager
+def trace(command):
+    """
+    Traces the command run inside the block, recording where its time went
+    in commands once it's done. Yields the Trace.
+    """
+    current = Trace(command)
+    token = _current.set(current)
+    start = time.perf_counter()
+    error = False
+    try:
+        yield current
+    except Exception:
+        error = True
+        raise
+    finally:
+        total = time.perf_counter() - start
+        _current.reset(token)
+
+        stats = commands.setdefault(command, CommandStats())
+        stats.total.observe(total)
+        stats.errors += error
+        # Whatever wasn't spent elsewhere was the handler's own work
+        current.seconds['embed'] = max(0., total - sum(current.seconds.values()))
+        for phase, seconds in current.seconds.items():
+            stats.phases[phase].observe(seconds)
+
+
+@contextmanager
+def span(phase):
+    """
+    Adds the time spent in the block to phase of the command being traced,
+    if there is one.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current = _current.get()
+        if current is not None:
+            current.add(phase, time.perf_counter() - start)
+
+
+def observe_request(endpoint, status, seconds):
+    """
+    EloServiceClient.on_request hook recording every request sent to the
+    elo service, retries included.
+    """
+    requests.setdefault(endpoint, Histogram()).observe(seconds)
+    if status is None or status >= 500:
+        request_errors[endpoint] = request_errors.get(endpoint, 0) + 1
+
+
+class _TracedChannel:
+    """
+    Stands in for a channel, timing sends to it as the send phase.
+    """
+    def __init__(self, channel):
+        self._channel = channel
+
+    def __getattr__(self, name):
+        return getattr(self._channel, name)
+
+    async def send(self, *args, **kwargs):
+        with span('send'):
+            return await self._channel.send(*args, **kwargs)
+
+
+class TracedMessage:
+    """
+    Stands in for a message, so that the handler's replies to its channel
+    are timed.
+    """
+    def __init__(self, message):
+        self._message = message
+        self.channel = _TracedChannel(message.channel)
+
+    def __getattr__(self, name):
+        return getattr(self._message, name)
+
+
+def summary():
+    """
+    Returns lines describing the latency of every command and endpoint.
+    """
+    lines = []
+    for command, stats in sorted(commands.items()):
+        breakdown = ' '.join(f'{phase} {stats.phases[phase].mean * 1000:.0f}' for phase in PHASES)
+        lines.append(
+            f'{command} x{stats.total.count}: p50 {stats.total.percentile(50) * 1000:.0f}ms '
+            f'p95 {stats.total.percentile(95) * 1000:.0f}ms, mean ms {breakdown}'
+            + (f', {stats.errors} errors' if stats.errors else ''))
+    for endpoint, histogram in sorted(requests.items()):
+        errors = request_errors.get(endpoint, 0)
+        lines.append(
+            f'{endpoint} x{histogram.count}: p50 {histogram.percentile(50) * 1000:.0f}ms '
+            f'p95 {histogram.percentile(95) * 1000:.0f}ms'
+            + (f', {errors} errors' if errors else ''))
+    return lines
+
+
+def _histogram_lines(metric, labels, histogram):
+    lines = []
+    cumulative = 0
+    for bound, count in zip(BUCKETS, histogram.buckets):
+        cumulative += count
+        lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f'{metric}_sum{{{labels}}} {histogram.sum}')
+    lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+def render():
+    """
+    Returns the same as summary in the Prometheus text format.
+    """
+    lines = [
+        '# HELP bot_command_duration_seconds Time to handle a command, by command.',
+        '# TYPE bot_command_duration_seconds histogram',
+    ]
+    for command, stats in sorted(commands.items()):
+        lines.extend(_histogram_lines('bot_command_duration_seconds', f'command="{command}"', stats.total))
+
+    lines.append('# HELP bot_command_phase_seconds Time commands spent parsing, waiting on the elo service, '
+                 'building embeds and sending to discord.')
+    lines.append('# TYPE bot_command_phase_seconds histogram')
+    for command, stats in sorted(commands.items()):
+        for phase in PHASES:
+            lines.extend(_histogram_lines(
+                'bot_command_phase_seconds', f'command="{command}",phase="{phase}"', stats.phases[phase]))
+
+    lines.append('# HELP bot_command_errors_total Commands that raised an exception.')
+    lines.append('# TYPE bot_command_errors_total counter')
+    for command, stats in sorted(commands.items()):
+        lines.append(f'bot_command_errors_total{{command="{command}"}} {stats.errors}')
+
+    lines.append('# HELP bot_api_request_duration_seconds Requests to the elo service, by endpoint.')
+    lines.append('# TYPE bot_api_request_duration_seconds histogram')
+    for endpoint, histogram in sorted(requests.items()):
+        lines.extend(_histogram_lines('bot_api_request_duration_seconds', f'endpoint="{endpoint}"', histogram))
+
+    lines.append('# HELP bot_api_request_errors_total Requests to the elo service that failed or got a 5xx.')
+    lines.append('# TYPE bot_api_request_errors_total counter')
+    for endpoint, errors in sorted(request_errors.items()):
+        lines.append(f'bot_api_request_errors_total{{endpoint="{endpoint}"}} {errors}')
+
+    return '\n'.join(lines) + '\n'
+
+
+async def _metrics(request):
+    return web.Response(body=render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+async def serve_metrics(host, port):
+    """
+    Serves render() at http://host:port/metrics from the running event loop.
+    Returns the runner, to clean up on shutdown.
+    """
+    app = web.Application()
+    app.router.add_get('/metrics', _metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
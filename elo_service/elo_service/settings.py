@@ -48,6 +48,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Last, so it times only the view and the queries it makes
+    'foos.middleware.RequestMetricsMiddleware',
 ]
 
 ROOT_URLCONF = 'elo_service.urls'
@@ -70,9 +72,30 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'elo_service.wsgi.application'
 
+# What gunicorn serves in production; see gunicorn.conf.py
+ASGI_APPLICATION = 'elo_service.asgi.application'
+
 
 # Database
-# https://docs.djangoproject.com/en/1.10/ref/settings/#databases
+# https://docs.djangoproject.com/en/5.2/ref/databases/#postgresql-notes
+# With ELO_DB_POOL on (the default), every server process keeps a pool of
+# open connections that requests borrow, instead of each request connecting
+# and authenticating anew. Under ASGI that is the only way to reuse them,
+# since every request runs in a thread of its own.
+#
+# With it off, ELO_DB_CONN_MAX_AGE is how long in seconds a thread keeps its
+# connection between requests: 0 closes it after every request, 'none'
+# never does. That suits WSGI servers like runserver, whose threads live on.
+
+DB_POOL = os.environ.get('ELO_DB_POOL', 'true').lower() in ('1', 'true', 'yes')
+
+DB_CONN_MAX_AGE = os.environ.get('ELO_DB_CONN_MAX_AGE', '60')
+DB_CONN_MAX_AGE = None if DB_CONN_MAX_AGE.lower() == 'none' else int(DB_CONN_MAX_AGE)
+
+# How many connections the server's pools may hold between them. Postgres
+# allows 100 by default, and manage.py commands and the like need some too.
+# gunicorn.conf.py refuses to start more workers than fit.
+DB_MAX_CONNECTIONS = int(os.environ.get('ELO_DB_MAX_CONNECTIONS', 90))
 
 DATABASES = {
     'default': {
@@ -81,10 +104,73 @@ DATABASES = {
         'USER': 'postgres',
         'HOST': 'db',
         'PORT': 5432,
+        # Pooled connections are returned to the pool after every request instead
+        'CONN_MAX_AGE': 0 if DB_POOL else DB_CONN_MAX_AGE,
+        # Check a kept or pooled connection still works before handing it to a
+        # request, so one dropped by a database restart doesn't fail the request
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {},
+    }
+}
+
+if DB_POOL:
+    DATABASES['default']['OPTIONS']['pool'] = {
+        # Per server process, so up to WEB_CONCURRENCY * max_size in all,
+        # which has to stay within DB_MAX_CONNECTIONS
+        'min_size': int(os.environ.get('ELO_DB_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.environ.get('ELO_DB_POOL_MAX_SIZE', 4)),
+        # Seconds a request waits for a free connection before erroring
+        'timeout': 10,
+        'max_lifetime': 30 * 60,
+    }
+
+
+# Cache
+# https://docs.djangoproject.com/en/2.2/topics/cache/
+# File based so that every server process shares it without running a cache
+# service. Entries are invalidated through foos.caching's ratings version.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.environ.get('ELO_CACHE_DIR', '/tmp/elo_service_cache'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 1000,
+        },
     }
 }
 
 
+# Existing tables keep their integer primary keys
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+
+# Request metrics (see foos.metrics)
+# Requests slower than this are logged with their SQL
+SLOW_REQUEST_SECONDS = float(os.environ.get('ELO_SLOW_REQUEST_SECONDS', 0.5))
+# An existing directory where every server process writes its metrics for
+# /foos/metrics/ to add up; gunicorn.conf.py sets one up. Without it, each
+# process only reports its own requests.
+METRICS_DIR = os.environ.get('ELO_METRICS_DIR')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'foos': {
+            'handlers': ['console'],
+            'level': 'INFO',
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 
@@ -113,8 +199,6 @@ TIME_ZONE = 'UTC'
 
 USE_I18N = True
 
-USE_L10N = True
-
 USE_TZ = True
 
 
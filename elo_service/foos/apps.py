@@ -1,5 +1,10 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class FoosConfig(AppConfig):
     name = 'foos'
+
+    def ready(self):
+        from foos.metrics import install_query_recorder
+        connection_created.connect(install_query_recorder)
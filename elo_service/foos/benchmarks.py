@@ -0,0 +1,264 @@
+import http.client
+import json
+import math
+import random
+import string
+import time
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from foos import elo, importer
+from foos.engines import History, evaluate
+from foos.models import Player
+
+PERCENTILES = (50, 95, 99)
+
+# Chance that a player in a generated match teams up with their usual partner
+USUAL_PARTNER_ODDS = 0.5
+
+# The boards each benchmark iteration reads, by the name they're reported as
+BOARDS = ('leaderboards', 'loserboards', 'dream_teams', 'nightmare_teams')
+
+
+class BenchmarkError(Exception):
+    """
+    Raised when a benchmarked request doesn't succeed, which would make its
+    timing meaningless.
+    """
+
+
+def percentile(sorted_samples, p):
+    """
+    Nearest-rank percentile p (0-100] of an already sorted list.
+    """
+    return sorted_samples[max(0, math.ceil(p / 100 * len(sorted_samples)) - 1)]
+
+
+def summarize(seconds):
+    """
+    Returns the count, mean, PERCENTILES and max of a list of durations in
+    seconds, the latter in milliseconds.
+    """
+    samples = sorted(seconds)
+    summary = {
+        'count': len(samples),
+        'mean_ms': sum(samples) / len(samples) * 1000,
+    }
+    for p in PERCENTILES:
+        summary[f'p{p}_ms'] = percentile(samples, p) * 1000
+    summary['max_ms'] = samples[-1] * 1000
+    return summary
+
+
+class ServiceClient:
+    """
+    Minimal client for a running elo service, keeping one keep-alive
+    connection open like the discord bot does, so that timings are of the
+    service and not of connecting to it.
+    """
+    def __init__(self, url):
+        url = urlsplit(url)
+        self.path = url.path.rstrip('/')
+        self._connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+
+    def request(self, method, path, body=None, content_type=None):
+        """
+        Returns (status, seconds taken) for a request to path under the url.
+        """
+        headers = {'Content-Type': content_type} if content_type else {}
+        start = time.perf_counter()
+        self._connection.request(method, f'{self.path}/{path}', body=body, headers=headers)
+        response = self._connection.getresponse()
+        response.read()
+        return response.status, time.perf_counter() - start
+
+    def post_json(self, path, data):
+        return self.request('POST', path, json.dumps(data), 'application/json')
+
+    def post_form(self, path, data):
+        body = '&'.join(f'{key}={value}' for key, value in data.items())
+        return self.request('POST', path, body, 'application/x-www-form-urlencoded')
+
+    def close(self):
+        self._connection.close()
+
+
+def _username(i):
+    # Usernames have to be alphabetical
+    letters = ''
+    while True:
+        i, remainder = divmod(i, 26)
+        letters = string.ascii_lowercase[remainder] + letters
+        if not i:
+            return f'player{letters}'
+
+
+def generate_matches(usernames, num_matches, seed=0, skew=1.0):
+    """
+    Returns num_matches made up matches between usernames, in the form
+    importer.parse_matches returns, one minute apart and ending now.
+
+    Like in a real league, a few regulars play most of the games: how often
+    each player plays falls off as 1 / rank ** skew. Players often team up
+    with their usual partner, and the team with more (hidden) skill usually
+    wins. The same seed always gives the same matches.
+    """
+    if len(usernames) < 4:
+        raise ValueError('A league needs at least 4 players')
+
+    rng = random.Random(seed)
+    activity = [1 / rank ** skew for rank in range(1, len(usernames) + 1)]
+    rng.shuffle(activity)
+    skill = {username: rng.gauss(0, 1) for username in usernames}
+    partner = {username: rng.choice([other for other in usernames if other != username])
+               for username in usernames}
+
+    start = timezone.now() - timedelta(minutes=num_matches)
+    matches = []
+    for i in range(num_matches):
+        picked = []
+        while len(picked) < 4:
+            # Each team is someone, plus most of the time their usual partner
+            if len(picked) % 2 and partner[picked[-1]] not in picked and rng.random() < USUAL_PARTNER_ODDS:
+                username = partner[picked[-1]]
+            else:
+                username = rng.choices(usernames, activity)[0]
+            if username not in picked:
+                picked.append(username)
+
+        team1, team2 = picked[:2], picked[2:]
+        skill_difference = sum(skill[username] for username in team1) - sum(skill[username] for username in team2)
+        if rng.random() >= 1 / (1 + 10 ** -skill_difference):
+            team1, team2 = team2, team1
+        matches.append((start + timedelta(minutes=i), team1, team2, 5, rng.randint(0, 4)))
+    return matches
+
+
+def create_league(num_players, num_matches, seed=0, skew=1.0):
+    """
+    Creates num_players players and imports num_matches generated matches
+    between them (see generate_matches). Returns the usernames.
+    """
+    usernames = [_username(i) for i in range(num_players)]
+    Player.objects.bulk_create([Player(username=username) for username in usernames], batch_size=1000)
+    importer.import_matches(generate_matches(usernames, num_matches, seed, skew))
+    return usernames
+
+
+class _Timings:
+    """
+    Collects the seconds taken and queries made by each run of each
+    benchmarked operation.
+    """
+    def __init__(self):
+        self.samples = {}
+
+    def measure(self, name, operation):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.perf_counter()
+            result = operation()
+            seconds = time.perf_counter() - start
+        self.samples.setdefault(name, []).append((seconds, len(queries)))
+        return result
+
+    def results(self):
+        results = {}
+        for name, samples in self.samples.items():
+            query_counts = [queries for _, queries in samples]
+            results[name] = {
+                **summarize([seconds for seconds, _ in samples]),
+                'queries_mean': sum(query_counts) / len(query_counts),
+                'queries_max': max(query_counts),
+            }
+        return results
+
+
+def run_benchmarks(usernames, iterations=100, recalculations=5, seed=0):
+    """
+    Times the hot paths of the service through its views, in process, on
+    the league of usernames. Every iteration records a match and then reads
+    the players, team and boards it changed, first uncached, then again from
+    the cache. The matches are then undone one by one, leaving the league as
+    it was, before timing full recalculations.
+
+    Returns {operation: summary} with the latency summary of every
+    operation (see summarize) and the mean and max queries it made.
+    """
+    rng = random.Random(seed)
+    client = Client()
+    timings = _Timings()
+
+    def check(response, name):
+        if response.status_code != 200:
+            raise BenchmarkError(f'{name} returned {response.status_code}: {response.content[:200]!r}')
+
+    def get(path):
+        check(client.get(path), path)
+
+    for _ in range(iterations):
+        wp1, wp2, lp1, lp2 = rng.sample(usernames, 4)
+        response = timings.measure('record_match', lambda: client.post(
+            '/foos/record_match/',
+            json.dumps({
+                'winning_team': [wp1, wp2],
+                'losing_team': [lp1, lp2],
+                'winning_score': 5,
+                'losing_score': rng.randint(0, 4)
+            }),
+            content_type='application/json'))
+        check(response, 'record_match')
+
+        for suffix in ('', '_cached'):
+            timings.measure(f'get_player{suffix}', lambda: get(f'/foos/player/{wp1}/'))
+            timings.measure(f'get_team{suffix}', lambda: get(f'/foos/team/{wp1}/{wp2}/'))
+            for board in BOARDS:
+                timings.measure(f'{board}{suffix}', lambda: get(f'/foos/{board}/10/'))
+
+    for _ in range(iterations):
+        response = timings.measure('delete_latest_match', lambda: client.delete('/foos/delete_latest_match/'))
+        check(response, 'delete_latest_match')
+
+    for _ in range(recalculations):
+        timings.measure('recalculate_all_elos', elo.recalculate_all_elos)
+
+    return timings.results()
+
+
+def generated_history(num_players, num_matches, seed=0, skew=1.0):
+    """
+    Returns a History of num_matches generated matches (see generate_matches)
+    between num_players players, without touching the database.
+    """
+    history = History()
+    usernames = [_username(i) for i in range(num_players)]
+    for _, winning_usernames, losing_usernames, _, _ in generate_matches(usernames, num_matches, seed, skew):
+        history.add(winning_usernames, losing_usernames)
+    return history
+
+
+def run_engine_benchmarks(history, engines, repeats=3):
+    """
+    Replays history with each of engines repeats times.
+
+    Returns {engine name: results}, with the fastest replay's seconds and
+    matches per second, and how well the engine predicted the winners (see
+    engines.evaluate).
+    """
+    results = {}
+    for engine in engines:
+        seconds = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            _, predictions = engine.replay(history)
+            seconds.append(time.perf_counter() - start)
+        results[engine.name] = {
+            'seconds': min(seconds),
+            'matches_per_second': len(history) / min(seconds),
+            **evaluate(predictions),
+        }
+    return results
@@ -0,0 +1,29 @@
+from django.db import connection
+
+MAX_BATCH_SIZE = 1000
+
+
+def insert_rows(model, columns, rows):
+    """
+    Inserts rows of plain tuples, already in their database representation,
+    into model's table with multi-row INSERTs. This is for the big bulk
+    writes (replaying or importing the whole match history), where
+    bulk_create would spend most of its time building and compiling a model
+    instance for every row.
+    """
+    if not rows:
+        return
+
+    fields = [model._meta.get_field(column) for column in columns]
+    batch_size = min(connection.ops.bulk_batch_size(fields, rows), MAX_BATCH_SIZE)
+    table = connection.ops.quote_name(model._meta.db_table)
+    column_names = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+    placeholders = '(' + ', '.join(['%s'] * len(columns)) + ')'
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            cursor.execute(
+                f'INSERT INTO {table} ({column_names}) VALUES {", ".join([placeholders] * len(batch))}',
+                [value for row in batch for value in row])
+
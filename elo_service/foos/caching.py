@@ -0,0 +1,73 @@
+import functools
+import hashlib
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.http import HttpResponse
+
+RATINGS_VERSION_KEY = 'foos:ratings_version'
+
+
+def ratings_version():
+    """
+    Returns a token that changes whenever any elo or stat counter does. It
+    is part of every cached view's key, so changing it invalidates them all.
+    """
+    version = cache.get(RATINGS_VERSION_KEY)
+    if version is None:
+        cache.add(RATINGS_VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(RATINGS_VERSION_KEY)
+    return version
+
+
+def _set_new_ratings_version(on_bump=None):
+    old_version = cache.get(RATINGS_VERSION_KEY)
+    # A fresh token rather than an increment: the file and local-memory
+    # backends can't increment atomically, and a token never comes back
+    # around to match entries cached under an older version.
+    new_version = uuid.uuid4().hex
+    if on_bump is not None:
+        on_bump(old_version, new_version)
+    cache.set(RATINGS_VERSION_KEY, new_version, None)
+
+
+def bump_ratings_version(on_bump=None):
+    """
+    Invalidates every cached view once the current transaction commits, so
+    that nothing computed from the data before the write is served after it.
+
+    on_bump, if given, is then called with the old and new versions, just
+    before the new one is stored, to bring state derived from the ratings
+    up to date without a rebuild (see ranks._Ranks). Anything it publishes
+    is in place by the time anyone sees the new version.
+    """
+    transaction.on_commit(lambda: _set_new_ratings_version(on_bump))
+
+
+def cached_view(view):
+    """
+    Caches successful GET responses from view, keyed by path and ratings
+    version, so they're served from the cache until the next write. view
+    must be async, like every foos view.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if request.method != 'GET':
+            return await view(request, *args, **kwargs)
+
+        # Read the version before the data, so a write landing in between
+        # leaves the entry under the outdated version.
+        path = hashlib.md5(request.get_full_path().encode()).hexdigest()
+        key = f'foos:view:{await sync_to_async(ratings_version)()}:{path}'
+        cached = await cache.aget(key)
+        if cached is not None:
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        response = await view(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            await cache.aset(key, (response.content, response['Content-Type']))
+        return response
+    return wrapper
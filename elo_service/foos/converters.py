@@ -0,0 +1,45 @@
+MAX_BOARD_SIZE = 50
+
+
+class BoardSizeConverter:
+    """
+    How many rows of a leaderboard to return, from 1 to MAX_BOARD_SIZE.
+    """
+    regex = '[0-9]+'
+
+    def to_python(self, value):
+        value = int(value)
+        if not 1 <= value <= MAX_BOARD_SIZE:
+            raise ValueError(f'Board size must be between 1 and {MAX_BOARD_SIZE}')
+        return value
+
+    def to_url(self, value):
+        return str(value)
+
+
+class DirectionConverter:
+    """
+    Whether a leaderboard page comes after or before its cursor.
+    """
+    regex = 'after|before'
+
+    def to_python(self, value):
+        return value
+
+    def to_url(self, value):
+        return value
+
+
+class BoardCursorConverter:
+    """
+    The position of a row in a leaderboard, as <elo>.<id> in the URL and
+    (elo, id) in the view.
+    """
+    regex = '-?[0-9]+\\.[0-9]+'
+
+    def to_python(self, value):
+        elo, obj_id = value.split('.')
+        return int(elo), int(obj_id)
+
+    def to_url(self, value):
+        return '%d.%d' % value
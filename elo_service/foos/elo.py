@@ -1,99 +1,317 @@
-from django.db import transaction
+from django.db import connection, transaction
 
-from foos.models import Match, Player, Team
+from foos.bulk import insert_rows
+from foos.caching import bump_ratings_version
+from foos.engines import EloEngine, History
+from foos.models import Match, Player, PlayerEloChange, Team, TeamEloChange
+from foos.ranks import MIN_RANKED_GAMES, MIN_RANKED_WINS, ranks
+from foos.stats import STAT_FIELDS, count_match, remove_match_stats
 
 STARTING_ELO = 1000
 
-def update_team_elos(match):
+K = 32
+RPA = 400
+
+# What records and replays matches. Other engines are only for comparison
+# (see foos/engines.py), since the elos are what everyone knows.
+ENGINE = EloEngine(k=K, rpa=RPA, starting_elo=STARTING_ELO)
+
+
+def _lock_players(player_ids):
+    """
+    Locks the given players in id order until the end of the transaction.
+    Every writer locks the players before the teams, each in id order, so
+    that two writers touching the same rows queue up instead of deadlocking.
+
+    Returns {player_id: player} read under the lock.
+    """
+    players = Player.objects.select_for_update().filter(id__in=player_ids).order_by('id')
+    return {player.id: player for player in players}
+
+
+def _lock_teams(team_ids):
+    """
+    Locks the given teams in id order. See _lock_players.
+    """
+    teams = Team.objects.select_for_update().filter(id__in=team_ids).order_by('id')
+    return {team.id: team for team in teams}
+
+
+def validate_match(winning_usernames, losing_usernames, winning_score, losing_score):
+    """
+    Checks a reported match against the rules of the game.
+
+    Returns a description of the first problem found, or None if it's valid.
     """
-    Using the standard Elo algorithm with K = 32:
-    https://metinmediamath.wordpress.com/2013/11/27/how-to-calculate-the-elo-rating-including-example/
+    if winning_score != 5:
+        return 'Winning score must be 5'
+    elif winning_score <= losing_score:
+        return f'Winning score {winning_score} must be greater than losing score {losing_score}'
+    elif losing_score < 0:
+        return 'Losing score must be >= 0'
+    elif len(winning_usernames) != 2 or len(losing_usernames) != 2:
+        return f'Teams must be 2 people each. Provided: {winning_usernames} and {losing_usernames}'
+
+    common_players = [player for player in winning_usernames if player in losing_usernames]
+    if len(common_players) > 0:
+        return 'Winning and losing teams cannot share players'
+
+    if (winning_usernames[0] == winning_usernames[1]
+            or losing_usernames[0] == losing_usernames[1]):
+        return 'Teams cannot have the same person twice.'
+
+    return None
+
+
+@transaction.atomic
+def record_match(winning_players, losing_players, winning_score, losing_score):
+    """
+    Records a match between two pairs of players, creating their teams if
+    needed, and updates the elo and stat counters of all four players and
+    both teams in one transaction. The rows are locked before their elos are
+    read, so concurrent reports involving the same people apply one after
+    the other instead of overwriting each other.
+
+    Returns (match, players), where players are the four updated Players in
+    the order given and match.winning_team/losing_team are the updated Teams.
     """
-    winning_team = match.winning_team
-    losing_team = match.losing_team
+    player_ids = [player.id for player in (*winning_players, *losing_players)]
+    players = _lock_players(player_ids)
+    wp1, wp2, lp1, lp2 = [players[player_id] for player_id in player_ids]
+
+    winning_team, _ = Team.objects.get_or_create_for_players(wp1, wp2)
+    losing_team, _ = Team.objects.get_or_create_for_players(lp1, lp2)
+    teams = _lock_teams((winning_team.id, losing_team.id))
+    winning_team, losing_team = teams[winning_team.id], teams[losing_team.id]
+
+    match = Match.objects.create(
+        winning_team=winning_team,
+        losing_team=losing_team,
+        winning_score=winning_score,
+        losing_score=losing_score
+    )
+
+    players_before = [wp1.elo, wp2.elo, lp1.elo, lp2.elo]
+    wp1.elo, wp2.elo, lp1.elo, lp2.elo = ENGINE.player_elos_after_match(*players_before)
 
-    K = 32
-    RPA = 400
+    teams_before = [winning_team.elo, losing_team.elo]
+    winning_team.elo, losing_team.elo = ENGINE.team_elos_after_match(*teams_before)
 
-    r_winning_team = 10 ** (winning_team.elo / RPA)
-    r_losing_team = 10 ** (losing_team.elo / RPA)
+    count_match(match, (wp1, wp2, winning_team), (lp1, lp2, losing_team))
 
-    expected_winning_team = r_winning_team / (r_winning_team + r_losing_team)
-    expected_losing_team = r_losing_team / (r_winning_team + r_losing_team)
+    Player.objects.bulk_update((wp1, wp2, lp1, lp2), ['elo', *STAT_FIELDS])
+    Team.objects.bulk_update((winning_team, losing_team), ['elo', *STAT_FIELDS])
 
-    winning_team.elo = round(winning_team.elo + K * (1 - expected_winning_team))
-    losing_team.elo = round(losing_team.elo + K * (0 - expected_losing_team))
+    PlayerEloChange.objects.bulk_create([
+        PlayerEloChange(match=match, player=player, elo_before=elo_before, elo_after=player.elo,
+                        timestamp=match.timestamp)
+        for player, elo_before in zip((wp1, wp2, lp1, lp2), players_before)
+    ])
+    TeamEloChange.objects.bulk_create([
+        TeamEloChange(match=match, team=team, elo_before=elo_before, elo_after=team.elo)
+        for team, elo_before in zip((winning_team, losing_team), teams_before)
+    ])
 
-    winning_team.save()
-    losing_team.save()
+    # Everyone here has played one more game, and the winners won one more
+    player_changes = [
+        (elo_before, player.elo, player.games - 1 >= MIN_RANKED_GAMES, player.games >= MIN_RANKED_GAMES)
+        for player, elo_before in zip((wp1, wp2, lp1, lp2), players_before)
+    ]
+    team_changes = [
+        (elo_before, team.elo, team.wins - won >= MIN_RANKED_WINS, team.wins >= MIN_RANKED_WINS)
+        for team, elo_before, won in zip((winning_team, losing_team), teams_before, (1, 0))
+    ]
+    bump_ratings_version(
+        lambda old_version, new_version: ranks.publish_match(old_version, new_version, player_changes, team_changes))
+    return match, (wp1, wp2, lp1, lp2)
 
 
-def update_player_elos(match):
+def revert_match_elos(match):
     """
-    Algorithm from:
-    https://gamedesignerkid.blogspot.com/2017/04/how-to-use-elo-ranking-for-team.html
+    Puts the players and teams from match back to the elos they had before it
+    was played, using the elo changes journaled when it was recorded. This is
+    only correct for the latest match, since nobody in it has played since.
+
+    Returns False without changing anything if the match has no journal
+    (e.g. it was recorded before journaling existed), in which case the caller
+    has to fall back to recalculate_all_elos once the match is deleted.
     """
-    K = 32
-    RPA = 400
+    player_changes = list(match.player_elo_changes.values_list('player_id', 'elo_before'))
+    team_changes = list(match.team_elo_changes.values_list('team_id', 'elo_before'))
+    if len(player_changes) != 4 or len(team_changes) != 2:
+        return False
 
-    wp1, wp2 = match.winning_team.players.all()[:2]
-    lp1, lp2 = match.losing_team.players.all()[:2]
+    Player.objects.bulk_update(
+        [Player(id=player_id, elo=elo) for player_id, elo in player_changes], ['elo'])
+    Team.objects.bulk_update(
+        [Team(id=team_id, elo=elo) for team_id, elo in team_changes], ['elo'])
+    return True
 
-    # Get the elo for each team. This is computed using the sum of the player's
-    # elos, rather than the actual elo assigned for that team.
-    winning_team_elo = wp1.elo + wp2.elo
-    losing_team_elo = lp1.elo + lp2.elo
 
-    # Find out what percentage each player contributed
-    # to the team's overall elo
-    wp1_elo_percent = wp1.elo / winning_team_elo
-    wp2_elo_percent = wp2.elo / winning_team_elo
+def replay_all_matches(player_changes=None, team_changes=None):
+    """
+    Replays every match in memory, oldest first, without touching the DB
+    beyond two reads: one for the team rosters and one for the matches.
 
-    lp1_elo_percent = lp1.elo / losing_team_elo
-    lp2_elo_percent = lp2.elo / losing_team_elo
+    Returns ({player_id: elo}, {team_id: elo}) for every player and team that
+    has played a match. Anyone missing from the result is at STARTING_ELO.
 
-    # Factor for each team
-    r_winning_team = 10 ** (winning_team_elo / RPA)
-    r_losing_team = 10 ** (losing_team_elo / RPA)
+    If player_changes is given, a (match_id, player_id, elo_before, elo_after,
+    timestamp) tuple is appended to it for every player in every match, and
+    if team_changes is given, a (match_id, team_id, elo_before, elo_after)
+    tuple for both teams. These are in the column order of PlayerEloChange
+    and TeamEloChange, with the timestamp ready to insert as is.
+    """
+    rosters = {}
+    for team_id, player_id in (Team.players.through.objects
+                                   .order_by('id')
+                                   .values_list('team_id', 'player_id')):
+        rosters.setdefault(team_id, []).append(player_id)
 
-    # How much each team was expected to win this match
-    expected_winning_team = r_winning_team / (r_winning_team + r_losing_team)
-    expected_losing_team = r_losing_team / (r_winning_team + r_losing_team)
+    matches = (Match.objects
+                   .order_by('timestamp', 'id')
+                   .values_list('id', 'winning_team_id', 'losing_team_id', 'timestamp'))
 
-    # Based on their expectation, adjust their elo accordingly
-    new_winning_team_elo = winning_team_elo + K * (1 - expected_winning_team)
-    new_losing_team_elo = losing_team_elo + K * (0 - expected_losing_team)
+    player_elos = {}
+    team_elos = {}
+    for match_id, winning_team_id, losing_team_id, timestamp in matches.iterator():
+        player_ids = rosters[winning_team_id][:2] + rosters[losing_team_id][:2]
+        players_before = [player_elos.get(player_id, STARTING_ELO) for player_id in player_ids]
+        players_after = ENGINE.player_elos_after_match(*players_before)
+        player_elos.update(zip(player_ids, players_after))
 
-    # How much did the team's elo change?
-    delta_winning_team = new_winning_team_elo - winning_team_elo
-    delta_losing_team = new_losing_team_elo - losing_team_elo
+        team_ids = (winning_team_id, losing_team_id)
+        teams_before = [team_elos.get(team_id, STARTING_ELO) for team_id in team_ids]
+        teams_after = ENGINE.team_elos_after_match(*teams_before)
+        team_elos.update(zip(team_ids, teams_after))
 
-    # They get reverse of their share of the delta elo
-    # so that the person with the higher elo gets a smaller
-    # bump than the one with a lower elo
-    delta_wp1 = delta_winning_team * wp2_elo_percent
-    delta_wp2 = delta_winning_team * wp1_elo_percent
-    wp1.elo = round(wp1.elo + delta_wp1)
-    wp2.elo = round(wp2.elo + delta_wp2)
+        if player_changes is not None:
+            timestamp = connection.ops.adapt_datetimefield_value(timestamp)
+            player_changes.extend(
+                (match_id, player_id, before, after, timestamp)
+                for player_id, before, after in zip(player_ids, players_before, players_after))
+        if team_changes is not None:
+            team_changes.extend(
+                (match_id, team_id, before, after)
+                for team_id, before, after in zip(team_ids, teams_before, teams_after))
 
-    # If they lost then they lose points proportionally so that the
-    # higher ranked player loses more points.
-    delta_lp1 = delta_losing_team * lp1_elo_percent
-    delta_lp2 = delta_losing_team * lp2_elo_percent
-    lp1.elo = round(lp1.elo + delta_lp1)
-    lp2.elo = round(lp2.elo + delta_lp2)
+    return player_elos, team_elos
+
+
+def load_history():
+    """
+    Returns the engines.History of every recorded match, oldest first, keyed
+    by player and team id, for replaying with any rating engine. Like
+    replay_all_matches, this takes two reads.
+    """
+    rosters = {}
+    for team_id, player_id in (Team.players.through.objects
+                                   .order_by('id')
+                                   .values_list('team_id', 'player_id')):
+        rosters.setdefault(team_id, []).append(player_id)
+
+    history = History()
+    matches = (Match.objects
+                   .order_by('timestamp', 'id')
+                   .values_list('winning_team_id', 'losing_team_id'))
+    for winning_team_id, losing_team_id in matches.iterator():
+        history.add(rosters[winning_team_id][:2], rosters[losing_team_id][:2], winning_team_id, losing_team_id)
+    return history
+
+
+@transaction.atomic
+def delete_latest_match():
+    """
+    Deletes the most recent match and takes it back out of the elos and stat
+    counters of the players and teams that played it.
+
+    Returns the deleted match. Raises Match.DoesNotExist if there are none.
+    """
+    while True:
+        match = (Match.objects
+                     .select_related('winning_team__player_low', 'winning_team__player_high',
+                                     'losing_team__player_low', 'losing_team__player_high')
+                     .latest('timestamp', 'id'))
+        player_ids = [
+            match.winning_team.player_low_id, match.winning_team.player_high_id,
+            match.losing_team.player_low_id, match.losing_team.player_high_id
+        ]
+        _lock_players(player_ids)
+        _lock_teams((match.winning_team_id, match.losing_team_id))
+
+        # A newer match may have been recorded while we waited for the locks,
+        # in which case that is the one to undo.
+        if Match.objects.latest('timestamp', 'id').id == match.id:
+            break
+
+    # Undoing the latest match only needs the elos it changed put back.
+    # Matches recorded before the elo journal existed need a full replay.
+    reverted = revert_match_elos(match)
+    remove_match_stats(match)
+    match.delete()
+    if not reverted:
+        recalculate_all_elos()
+
+    bump_ratings_version()
+    return match
 
-    # Persist to DB
-    wp1.save()
-    wp2.save()
-    lp1.save()
-    lp2.save()
 
 @transaction.atomic
 def recalculate_all_elos():
+    player_changes = []
+    team_changes = []
+    player_elos, team_elos = replay_all_matches(player_changes, team_changes)
+
     Player.objects.all().update(elo=STARTING_ELO)
     Team.objects.all().update(elo=STARTING_ELO)
 
-    for match in Match.objects.all():
-        update_player_elos(match)
-        update_team_elos(match)
+    Player.objects.bulk_update(
+        [Player(id=player_id, elo=elo) for player_id, elo in player_elos.items()],
+        ['elo'],
+        batch_size=500)
+    Team.objects.bulk_update(
+        [Team(id=team_id, elo=elo) for team_id, elo in team_elos.items()],
+        ['elo'],
+        batch_size=500)
+
+    # Rewrite the journal so every match can be undone without a replay.
+    PlayerEloChange.objects.all().delete()
+    TeamEloChange.objects.all().delete()
+    insert_rows(PlayerEloChange, ('match', 'player', 'elo_before', 'elo_after', 'timestamp'), player_changes)
+    insert_rows(TeamEloChange, ('match', 'team', 'elo_before', 'elo_after'), team_changes)
+
+    bump_ratings_version()
+
+
+def rating_history(player, max_points):
+    """
+    Returns [(timestamp, elo)] with player's elo after each of their matches,
+    oldest first. Longer histories are cut into max_points runs of
+    consecutive matches, each represented by its last one, so the final point
+    is always the player's current elo.
+    """
+    history = list(player.elo_changes
+                       .order_by('timestamp', 'id')
+                       .values_list('timestamp', 'elo_after'))
+    if len(history) <= max_points:
+        return history
+    return [history[(i + 1) * len(history) // max_points - 1] for i in range(max_points)]
+
+
+def find_elo_mismatches():
+    """
+    Replays every match without writing anything and compares the result
+    against the stored elos.
+
+    Returns a list of (model, id, stored_elo, replayed_elo) for every player
+    and team whose stored elo is wrong.
+    """
+    player_elos, team_elos = replay_all_matches()
+
+    mismatches = []
+    for model, replayed in ((Player, player_elos), (Team, team_elos)):
+        for obj_id, stored_elo in model.objects.values_list('id', 'elo').iterator():
+            replayed_elo = replayed.get(obj_id, STARTING_ELO)
+            if stored_elo != replayed_elo:
+                mismatches.append((model, obj_id, stored_elo, replayed_elo))
+    return mismatches
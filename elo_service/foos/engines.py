@@ -0,0 +1,417 @@
+import math
+from abc import ABC, abstractmethod
+
+# Match outcomes closer to certain than this count as this sure when scoring
+# predictions, so that one confident miss doesn't make the log loss infinite
+MIN_PROBABILITY = 1e-15
+
+
+class History:
+    """
+    A sequence of 2v2 results, with the players and teams in it numbered from
+    0 in the order they first played, so that engines can keep ratings in
+    plain lists. player_keys and team_keys hold what each number stands for.
+
+    Each of matches is (wp1, wp2, lp1, lp2, winning_team, losing_team).
+    """
+    def __init__(self):
+        self.player_keys = []
+        self.team_keys = []
+        self.matches = []
+        self._players = {}
+        self._teams = {}
+
+    def __len__(self):
+        return len(self.matches)
+
+    @staticmethod
+    def _number(keys, numbers, key):
+        number = numbers.get(key)
+        if number is None:
+            number = numbers[key] = len(keys)
+            keys.append(key)
+        return number
+
+    def add(self, winning_players, losing_players, winning_team=None, losing_team=None):
+        """
+        Adds a match between two pairs of player keys. Teams are keyed by
+        their sorted players unless their keys are given.
+        """
+        players = [self._number(self.player_keys, self._players, key)
+                   for key in (*winning_players, *losing_players)]
+        teams = [self._number(self.team_keys, self._teams, key if key is not None else tuple(sorted(team)))
+                 for key, team in ((winning_team, winning_players), (losing_team, losing_players))]
+        self.matches.append((*players, *teams))
+
+
+class RatingEngine(ABC):
+    """
+    Rates players and teams from 2v2 results. An engine keeps its ratings in
+    a state of plain lists indexed by the player and team numbers of a
+    History (see new_state), and holds nothing itself besides its
+    parameters, so one engine can replay any number of histories.
+    """
+    name = None
+
+    @abstractmethod
+    def new_state(self, num_players, num_teams):
+        """
+        Returns the state for num_players and num_teams who haven't played:
+        a dict of lists of numbers.
+        """
+
+    @abstractmethod
+    def win_probability(self, state, match):
+        """
+        Returns how likely the first team of match was to win, going by the
+        ratings in state.
+        """
+
+    @abstractmethod
+    def update(self, state, match):
+        """
+        Applies the result of match, won by its first team, to state.
+        """
+
+    @abstractmethod
+    def ratings(self, state):
+        """
+        Returns (player ratings, team ratings), the numbers to show and rank
+        by, as lists.
+        """
+
+    def replay(self, history):
+        """
+        Replays every match of history in order from new ratings.
+
+        Returns (state, predictions), with predictions the probability the
+        winners of each match had of winning it, beforehand.
+        """
+        state = self.new_state(len(history.player_keys), len(history.team_keys))
+        predictions = []
+        for match in history.matches:
+            predictions.append(self.win_probability(state, match))
+            self.update(state, match)
+        return state, predictions
+
+
+def evaluate(predictions):
+    """
+    Scores the predictions of a replay: the mean log loss and Brier score,
+    and the share of matches whose winners were the favorites, a coin flip
+    counting as half right.
+    """
+    log_loss = brier = correct = 0.
+    for p in predictions:
+        log_loss -= math.log(min(max(p, MIN_PROBABILITY), 1 - MIN_PROBABILITY))
+        brier += (1 - p) ** 2
+        correct += 1 if p > 0.5 else 0.5 if p == 0.5 else 0
+    count = len(predictions) or 1
+    return {
+        'log_loss': log_loss / count,
+        'brier': brier / count,
+        'accuracy': correct / count,
+    }
+
+
+class EloEngine(RatingEngine):
+    """
+    The elo the service has always used. Teams are rated by the standard Elo
+    algorithm, and players by running it on the sums of their elos, with the
+    change shared out between teammates. Elos are whole numbers.
+    """
+    name = 'elo'
+
+    def __init__(self, k=32, rpa=400, starting_elo=1000):
+        self.k = k
+        self.rpa = rpa
+        self.starting_elo = starting_elo
+
+    def team_elos_after_match(self, winning_elo, losing_elo):
+        """
+        Using the standard Elo algorithm:
+        https://metinmediamath.wordpress.com/2013/11/27/how-to-calculate-the-elo-rating-including-example/
+
+        Returns the new (winning_elo, losing_elo).
+        """
+        r_winning_team = 10 ** (winning_elo / self.rpa)
+        r_losing_team = 10 ** (losing_elo / self.rpa)
+
+        expected_winning_team = r_winning_team / (r_winning_team + r_losing_team)
+        expected_losing_team = r_losing_team / (r_winning_team + r_losing_team)
+
+        return (
+            round(winning_elo + self.k * (1 - expected_winning_team)),
+            round(losing_elo + self.k * (0 - expected_losing_team))
+        )
+
+    def player_elos_after_match(self, wp1_elo, wp2_elo, lp1_elo, lp2_elo):
+        """
+        Algorithm from:
+        https://gamedesignerkid.blogspot.com/2017/04/how-to-use-elo-ranking-for-team.html
+
+        Returns the new (wp1_elo, wp2_elo, lp1_elo, lp2_elo).
+        """
+        # Get the elo for each team. This is computed using the sum of the player's
+        # elos, rather than the actual elo assigned for that team.
+        winning_team_elo = wp1_elo + wp2_elo
+        losing_team_elo = lp1_elo + lp2_elo
+
+        # Find out what percentage each player contributed
+        # to the team's overall elo
+        wp1_elo_percent = wp1_elo / winning_team_elo
+        wp2_elo_percent = wp2_elo / winning_team_elo
+
+        lp1_elo_percent = lp1_elo / losing_team_elo
+        lp2_elo_percent = lp2_elo / losing_team_elo
+
+        # Factor for each team
+        r_winning_team = 10 ** (winning_team_elo / self.rpa)
+        r_losing_team = 10 ** (losing_team_elo / self.rpa)
+
+        # How much each team was expected to win this match
+        expected_winning_team = r_winning_team / (r_winning_team + r_losing_team)
+        expected_losing_team = r_losing_team / (r_winning_team + r_losing_team)
+
+        # Based on their expectation, adjust their elo accordingly
+        new_winning_team_elo = winning_team_elo + self.k * (1 - expected_winning_team)
+        new_losing_team_elo = losing_team_elo + self.k * (0 - expected_losing_team)
+
+        # How much did the team's elo change?
+        delta_winning_team = new_winning_team_elo - winning_team_elo
+        delta_losing_team = new_losing_team_elo - losing_team_elo
+
+        # They get reverse of their share of the delta elo
+        # so that the person with the higher elo gets a smaller
+        # bump than the one with a lower elo
+        delta_wp1 = delta_winning_team * wp2_elo_percent
+        delta_wp2 = delta_winning_team * wp1_elo_percent
+
+        # If they lost then they lose points proportionally so that the
+        # higher ranked player loses more points.
+        delta_lp1 = delta_losing_team * lp1_elo_percent
+        delta_lp2 = delta_losing_team * lp2_elo_percent
+
+        return (
+            round(wp1_elo + delta_wp1),
+            round(wp2_elo + delta_wp2),
+            round(lp1_elo + delta_lp1),
+            round(lp2_elo + delta_lp2)
+        )
+
+    def new_state(self, num_players, num_teams):
+        return {
+            'players': [self.starting_elo] * num_players,
+            'teams': [self.starting_elo] * num_teams,
+        }
+
+    def win_probability(self, state, match):
+        # The player elos are what the service has always predicted with,
+        # since a new team's elo says nothing about its players
+        players = state['players']
+        wp1, wp2, lp1, lp2, _, _ = match
+        difference = players[lp1] + players[lp2] - players[wp1] - players[wp2]
+        return 1 / (1 + 10 ** (difference / self.rpa))
+
+    def update(self, state, match):
+        players, teams = state['players'], state['teams']
+        wp1, wp2, lp1, lp2, winning_team, losing_team = match
+        players[wp1], players[wp2], players[lp1], players[lp2] = self.player_elos_after_match(
+            players[wp1], players[wp2], players[lp1], players[lp2])
+        teams[winning_team], teams[losing_team] = self.team_elos_after_match(
+            teams[winning_team], teams[losing_team])
+
+    def ratings(self, state):
+        return state['players'], state['teams']
+
+
+# Glicko-2 ratings are shown on the Glicko scale, and computed on this one
+GLICKO2_SCALE = 173.7178
+GLICKO2_TOLERANCE = 1e-6
+
+
+def _g(phi):
+    return 1 / math.sqrt(1 + 3 * phi * phi / math.pi ** 2)
+
+
+def glicko2_update(mu, phi, sigma, results, tau):
+    """
+    One Glicko-2 rating period, from http://www.glicko.net/glicko/glicko2.pdf
+    with everything on the Glicko-2 scale. results are (mu, phi, score) of
+    the opponents, scoring 1 for a win and 0 for a loss.
+
+    Returns the new (mu, phi, sigma).
+    """
+    v_inverse = improvement = 0.
+    for opponent_mu, opponent_phi, score in results:
+        g = _g(opponent_phi)
+        expected = 1 / (1 + math.exp(-g * (mu - opponent_mu)))
+        v_inverse += g * g * expected * (1 - expected)
+        improvement += g * (score - expected)
+    v = 1 / v_inverse
+    delta = v * improvement
+
+    # The new volatility, by the Illinois algorithm
+    a = math.log(sigma * sigma)
+
+    def f(x):
+        e = math.exp(x)
+        return e * (delta * delta - phi * phi - v - e) / (2 * (phi * phi + v + e) ** 2) - (x - a) / tau ** 2
+
+    low = a
+    if delta * delta > phi * phi + v:
+        high = math.log(delta * delta - phi * phi - v)
+    else:
+        k = 1
+        while f(a - k * tau) < 0:
+            k += 1
+        high = a - k * tau
+    f_low, f_high = f(low), f(high)
+    while abs(high - low) > GLICKO2_TOLERANCE:
+        middle = low + (low - high) * f_low / (f_high - f_low)
+        f_middle = f(middle)
+        if f_middle * f_high <= 0:
+            low, f_low = high, f_high
+        else:
+            f_low /= 2
+        high, f_high = middle, f_middle
+    sigma = math.exp(low / 2)
+
+    phi = 1 / math.sqrt(1 / (phi * phi + sigma * sigma) + 1 / v)
+    return mu + phi * phi * improvement, phi, sigma
+
+
+class Glicko2Engine(RatingEngine):
+    """
+    Glicko-2, with every match its own rating period for the people in it.
+    A player is rated as if they had played one opponent, as strong as the
+    other team's average and as uncertain as its players' root mean square
+    deviation. Teams play each other as themselves.
+    """
+    name = 'glicko2'
+
+    def __init__(self, rating=1500, deviation=350, volatility=0.06, tau=0.5):
+        self.rating = rating
+        self.deviation = deviation
+        self.volatility = volatility
+        self.tau = tau
+
+    def new_state(self, num_players, num_teams):
+        state = {}
+        for kind, count in (('player', num_players), ('team', num_teams)):
+            state[f'{kind}_mu'] = [0.] * count
+            state[f'{kind}_phi'] = [self.deviation / GLICKO2_SCALE] * count
+            state[f'{kind}_sigma'] = [self.volatility] * count
+        return state
+
+    @staticmethod
+    def _side(mu, phi, side):
+        # The average rating and root mean square deviation of a side
+        return (sum(mu[i] for i in side) / len(side),
+                math.sqrt(sum(phi[i] ** 2 for i in side) / len(side)))
+
+    def _rate(self, state, kind, winners, losers):
+        mu, phi, sigma = state[f'{kind}_mu'], state[f'{kind}_phi'], state[f'{kind}_sigma']
+        # Everyone is rated against the other side as it was before the match
+        opponents = ((winners, self._side(mu, phi, losers), 1), (losers, self._side(mu, phi, winners), 0))
+        updated = [
+            (i, glicko2_update(mu[i], phi[i], sigma[i], [(opponent_mu, opponent_phi, score)], self.tau))
+            for side, (opponent_mu, opponent_phi), score in opponents
+            for i in side
+        ]
+        for i, (new_mu, new_phi, new_sigma) in updated:
+            mu[i], phi[i], sigma[i] = new_mu, new_phi, new_sigma
+
+    def win_probability(self, state, match):
+        mu, phi = state['player_mu'], state['player_phi']
+        winning_mu, winning_phi = self._side(mu, phi, match[:2])
+        losing_mu, losing_phi = self._side(mu, phi, match[2:4])
+        g = _g(math.sqrt(winning_phi ** 2 + losing_phi ** 2))
+        return 1 / (1 + math.exp(-g * (winning_mu - losing_mu)))
+
+    def update(self, state, match):
+        self._rate(state, 'player', match[:2], match[2:4])
+        self._rate(state, 'team', match[4:5], match[5:])
+
+    def ratings(self, state):
+        return ([self.rating + GLICKO2_SCALE * mu for mu in state['player_mu']],
+                [self.rating + GLICKO2_SCALE * mu for mu in state['team_mu']])
+
+
+def _normal_pdf(x):
+    return math.exp(-x * x / 2) / math.sqrt(2 * math.pi)
+
+
+def _normal_cdf(x):
+    return math.erfc(-x / math.sqrt(2)) / 2
+
+
+class TrueSkillEngine(RatingEngine):
+    """
+    A TrueSkill-like Gaussian model without draws. Everyone's skill is a
+    normal distribution, a side's performance is the sum of its players'
+    skills plus noise of variance beta ** 2 per player, and each match moves
+    the winners' and losers' means apart in proportion to their variances,
+    which shrink as they play. tau ** 2 is added to the variance of everyone
+    playing beforehand, so that skills can keep changing. Teams play each
+    other as one player each.
+
+    Ratings are shown conservatively, as mu - 3 sigma.
+    """
+    name = 'trueskill'
+
+    def __init__(self, mu=25., sigma=25 / 3, beta=25 / 6, tau=25 / 300):
+        self.mu = mu
+        self.sigma = sigma
+        self.beta = beta
+        self.tau = tau
+
+    def new_state(self, num_players, num_teams):
+        return {
+            'player_mu': [self.mu] * num_players,
+            'player_variance': [self.sigma ** 2] * num_players,
+            'team_mu': [self.mu] * num_teams,
+            'team_variance': [self.sigma ** 2] * num_teams,
+        }
+
+    def _spread(self, variance, winners, losers):
+        # The standard deviation of the difference in performance
+        return math.sqrt(sum(variance[i] for i in (*winners, *losers))
+                         + (len(winners) + len(losers)) * self.beta ** 2)
+
+    def _rate(self, state, kind, winners, losers):
+        mu, variance = state[f'{kind}_mu'], state[f'{kind}_variance']
+        for i in (*winners, *losers):
+            variance[i] += self.tau ** 2
+
+        c = self._spread(variance, winners, losers)
+        t = (sum(mu[i] for i in winners) - sum(mu[i] for i in losers)) / c
+        # How surprising the win was: roughly -t once it's very surprising,
+        # where the pdf and cdf both underflow
+        p = _normal_cdf(t)
+        v = _normal_pdf(t) / p if p > MIN_PROBABILITY else -t
+        w = v * (v + t)
+
+        for side, sign in ((winners, 1), (losers, -1)):
+            for i in side:
+                mu[i] += sign * variance[i] / c * v
+                variance[i] *= max(1 - variance[i] / c ** 2 * w, MIN_PROBABILITY)
+
+    def win_probability(self, state, match):
+        mu, variance = state['player_mu'], state['player_variance']
+        winners, losers = match[:2], match[2:4]
+        difference = sum(mu[i] for i in winners) - sum(mu[i] for i in losers)
+        return _normal_cdf(difference / self._spread(variance, winners, losers))
+
+    def update(self, state, match):
+        self._rate(state, 'player', match[:2], match[2:4])
+        self._rate(state, 'team', match[4:5], match[5:])
+
+    def ratings(self, state):
+        return tuple(
+            [mu - 3 * math.sqrt(variance) for mu, variance in zip(state[f'{kind}_mu'], state[f'{kind}_variance'])]
+            for kind in ('player', 'team'))
+
+
+# Engine name -> class, each of which works with no arguments
+ENGINES = {engine.name: engine for engine in (EloEngine, Glicko2Engine, TrueSkillEngine)}
@@ -0,0 +1,140 @@
+import csv
+import json
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.db.models import OuterRef, Subquery
+
+from foos.importer import CSV_COLUMNS
+from foos.models import Match, PlayerEloChange, TeamEloChange
+
+FORMATS = ('jsonl', 'csv')
+
+# Same leading columns as the importer takes, so an export can be imported
+CSV_EXPORT_COLUMNS = CSV_COLUMNS + (
+    'match_id',
+    'winning_player_1_elo',
+    'winning_player_2_elo',
+    'losing_player_1_elo',
+    'losing_player_2_elo',
+    'winning_team_elo',
+    'losing_team_elo'
+)
+
+CHUNK_SIZE = 2000
+
+
+def _elo_after(model, **match_filter):
+    return Subquery(
+        model.objects
+            .filter(match=OuterRef('pk'), **match_filter)
+            .values('elo_after')[:1])
+
+
+def iter_matches(chunk_size=CHUNK_SIZE):
+    """
+    Yields every match, oldest first, as a dict with its players and everyone's
+    elo right after it was played. Rows are streamed from a server-side cursor
+    where the backend supports one, so memory use doesn't grow with history.
+
+    Elos are None for matches recorded before the elo journal existed, until
+    the next recalculate_all_elos.
+    """
+    matches = (Match.objects
+                   .order_by('timestamp', 'id')
+                   .annotate(
+                       winning_player_1_elo=_elo_after(
+                           PlayerEloChange, player=OuterRef('winning_team__player_low')),
+                       winning_player_2_elo=_elo_after(
+                           PlayerEloChange, player=OuterRef('winning_team__player_high')),
+                       losing_player_1_elo=_elo_after(
+                           PlayerEloChange, player=OuterRef('losing_team__player_low')),
+                       losing_player_2_elo=_elo_after(
+                           PlayerEloChange, player=OuterRef('losing_team__player_high')),
+                       winning_team_elo=_elo_after(TeamEloChange, team=OuterRef('winning_team')),
+                       losing_team_elo=_elo_after(TeamEloChange, team=OuterRef('losing_team')))
+                   .values_list(
+                       'id',
+                       'timestamp',
+                       'winning_team__player_low__username',
+                       'winning_team__player_high__username',
+                       'losing_team__player_low__username',
+                       'losing_team__player_high__username',
+                       'winning_score',
+                       'losing_score',
+                       'winning_player_1_elo',
+                       'winning_player_2_elo',
+                       'losing_player_1_elo',
+                       'losing_player_2_elo',
+                       'winning_team_elo',
+                       'losing_team_elo'))
+
+    for (match_id, timestamp, wp1, wp2, lp1, lp2, winning_score, losing_score,
+         wp1_elo, wp2_elo, lp1_elo, lp2_elo, winning_team_elo, losing_team_elo) in matches.iterator(chunk_size):
+        yield {
+            'match_id': match_id,
+            'timestamp': timestamp.isoformat(),
+            'winning_team': [wp1, wp2],
+            'losing_team': [lp1, lp2],
+            'winning_score': winning_score,
+            'losing_score': losing_score,
+            'winning_team_elos': [wp1_elo, wp2_elo],
+            'losing_team_elos': [lp1_elo, lp2_elo],
+            'winning_team_elo': winning_team_elo,
+            'losing_team_elo': losing_team_elo
+        }
+
+
+def iter_jsonl(matches):
+    for match in matches:
+        yield json.dumps(match) + '\n'
+
+
+class _Echo:
+    """
+    File-like object for csv.writer that hands each formatted row straight
+    back instead of buffering it.
+    """
+    def write(self, value):
+        return value
+
+
+def iter_csv(matches):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(CSV_EXPORT_COLUMNS)
+    for match in matches:
+        yield writer.writerow([
+            match['timestamp'],
+            *match['winning_team'],
+            *match['losing_team'],
+            match['winning_score'],
+            match['losing_score'],
+            match['match_id'],
+            *match['winning_team_elos'],
+            *match['losing_team_elos'],
+            match['winning_team_elo'],
+            match['losing_team_elo']
+        ])
+
+
+def iter_export(format, chunk_size=CHUNK_SIZE):
+    """
+    Yields the full match history as lines of CSV or JSON lines (NDJSON).
+    """
+    matches = iter_matches(chunk_size)
+    return iter_csv(matches) if format == 'csv' else iter_jsonl(matches)
+
+
+async def aiter_export(format, chunk_size=CHUNK_SIZE):
+    """
+    iter_export for serving under ASGI. The rows are still read with the
+    sync ORM, but a chunk at a time in a worker thread, so the event loop
+    is free to serve other requests in between.
+    """
+    lines = iter_export(format, chunk_size)
+    next_chunk = sync_to_async(lambda: ''.join(islice(lines, chunk_size)))
+    while True:
+        chunk = await next_chunk()
+        if not chunk:
+            return
+        yield chunk
@@ -0,0 +1,189 @@
+import csv
+import json
+
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from foos.bulk import insert_rows
+from foos.elo import recalculate_all_elos, validate_match
+from foos.models import Match, Player, Team
+from foos.stats import rebuild_all_stats
+
+FORMATS = ('csv', 'jsonl')
+
+CSV_COLUMNS = (
+    'timestamp',
+    'winning_player_1',
+    'winning_player_2',
+    'losing_player_1',
+    'losing_player_2',
+    'winning_score',
+    'losing_score'
+)
+
+BATCH_SIZE = 1000
+
+
+class InvalidMatches(Exception):
+    """
+    Raised when an import contains bad matches. Nothing is imported;
+    errors holds one message per problem found.
+    """
+    def __init__(self, errors):
+        super().__init__(f'{len(errors)} problems found in the matches to import')
+        self.errors = errors
+
+
+def _read_csv(lines):
+    for row in csv.DictReader(lines):
+        yield {
+            'timestamp': row.get('timestamp'),
+            'winning_team': [row.get('winning_player_1'), row.get('winning_player_2')],
+            'losing_team': [row.get('losing_player_1'), row.get('losing_player_2')],
+            'winning_score': row.get('winning_score'),
+            'losing_score': row.get('losing_score'),
+        }
+
+
+def parse_matches(lines, format):
+    """
+    Reads matches from an iterable of lines, either CSV with a header of
+    CSV_COLUMNS or JSON lines with the same fields as the record_match
+    endpoint plus a timestamp, and checks every one of them. Timestamps
+    can't be in the future, as a backfilled match must never become the
+    latest one that delete_latest_match would undo.
+
+    Returns a list of (timestamp, winning_usernames, losing_usernames,
+    winning_score, losing_score). Raises InvalidMatches listing every bad
+    match if there are any.
+    """
+    if format == 'csv':
+        rows = _read_csv(lines)
+    else:
+        rows = (line for line in lines if line.strip())
+
+    now = timezone.now()
+    matches = []
+    errors = []
+    try:
+        for row_number, row in enumerate(rows, 1):
+            try:
+                if format == 'jsonl':
+                    row = json.loads(row)
+
+                timestamp = parse_datetime(str(row['timestamp']))
+                if timestamp is None:
+                    raise ValueError(f'Invalid timestamp {row["timestamp"]!r}')
+                if timezone.is_naive(timestamp):
+                    timestamp = timezone.make_aware(timestamp)
+                if timestamp > now:
+                    raise ValueError(f'Timestamp {row["timestamp"]!r} is in the future')
+
+                winning_usernames = [str(username) for username in row['winning_team']]
+                losing_usernames = [str(username) for username in row['losing_team']]
+                winning_score = int(row['winning_score'])
+                losing_score = int(row['losing_score'])
+            except (KeyError, TypeError, ValueError) as e:
+                errors.append(f'Match {row_number}: {e!r}')
+                continue
+
+            error = validate_match(winning_usernames, losing_usernames, winning_score, losing_score)
+            if error:
+                errors.append(f'Match {row_number}: {error}')
+                continue
+
+            matches.append((timestamp, winning_usernames, losing_usernames, winning_score, losing_score))
+    except csv.Error as e:
+        errors.append(f'Unreadable CSV: {e}')
+
+    if errors:
+        raise InvalidMatches(errors)
+    return matches
+
+
+def _resolve_teams(pairs):
+    """
+    Returns {(player_low_id, player_high_id): team_id} for the given pairs,
+    creating the teams that don't exist yet in bulk.
+    """
+    def existing_teams():
+        teams = (Team.objects
+                     .filter(player_low_id__in={player_low_id for player_low_id, _ in pairs})
+                     .values_list('player_low_id', 'player_high_id', 'id'))
+        return {
+            (player_low_id, player_high_id): team_id
+            for player_low_id, player_high_id, team_id in teams.iterator()
+            if (player_low_id, player_high_id) in pairs
+        }
+
+    team_ids = existing_teams()
+    missing_pairs = pairs - team_ids.keys()
+    if not missing_pairs:
+        return team_ids
+
+    Team.objects.bulk_create(
+        [Team(player_low_id=player_low_id, player_high_id=player_high_id)
+         for player_low_id, player_high_id in missing_pairs],
+        batch_size=BATCH_SIZE)
+
+    # Not every backend hands back the ids of bulk created rows
+    team_ids = existing_teams()
+    Team.players.through.objects.bulk_create(
+        [Team.players.through(team_id=team_ids[pair], player_id=player_id)
+         for pair in missing_pairs
+         for player_id in pair],
+        batch_size=BATCH_SIZE)
+    return team_ids
+
+
+@transaction.atomic
+def import_matches(matches):
+    """
+    Inserts matches returned by parse_matches in bulk, then replays the
+    whole history once to bring every elo, the elo journal and the stat
+    counters up to date. The matches can be from any point in time; they
+    are slotted into the history by their timestamp.
+
+    Returns the number of matches imported. Raises InvalidMatches if any of
+    the usernames don't exist.
+    """
+    # The replay rewrites everyone's elo, so lock every player (in id order,
+    # like record_match) to keep matches from being recorded in the meantime.
+    player_ids = dict(Player.objects
+                          .select_for_update()
+                          .order_by('id')
+                          .values_list('username', 'id'))
+
+    unknown_usernames = {
+        username
+        for _, winning_usernames, losing_usernames, _, _ in matches
+        for username in winning_usernames + losing_usernames
+        if username not in player_ids
+    }
+    if unknown_usernames:
+        raise InvalidMatches([f'Player {username} does not exist' for username in sorted(unknown_usernames)])
+
+    def pair(usernames):
+        return tuple(sorted(player_ids[username] for username in usernames))
+
+    team_ids = _resolve_teams({
+        pair(usernames)
+        for _, winning_usernames, losing_usernames, _, _ in matches
+        for usernames in (winning_usernames, losing_usernames)
+    })
+
+    insert_rows(
+        Match,
+        ('timestamp', 'winning_team', 'losing_team', 'winning_score', 'losing_score'),
+        [(connection.ops.adapt_datetimefield_value(timestamp),
+          team_ids[pair(winning_usernames)],
+          team_ids[pair(losing_usernames)],
+          winning_score,
+          losing_score)
+         for timestamp, winning_usernames, losing_usernames, winning_score, losing_score in matches])
+
+    recalculate_all_elos()
+    rebuild_all_stats()
+
+    return len(matches)
@@ -0,0 +1,89 @@
+import json
+import platform
+import subprocess
+import time
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, setup_databases, teardown_databases
+from foos.benchmarks import BenchmarkError, create_league, run_benchmarks
+
+# Kept apart from the shared file cache, which the running service reads
+BENCHMARK_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = ('Generates a synthetic league in a throwaway test database (in-memory for SQLite, '
+            'test_<NAME> for Postgres) and times the elo service\'s hot paths on it, with query '
+            'counts and p50/p95/p99 latencies')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=100)
+        parser.add_argument('--matches', type=int, default=5000)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='How much more the most active players play than the rest')
+        parser.add_argument('--iterations', type=int, default=100,
+                            help='Number of times to time each request')
+        parser.add_argument('--recalculations', type=int, default=5,
+                            help='Number of times to time recalculate_all_elos')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+        parser.add_argument('--compare', help='JSON results of an earlier run to compare against')
+
+    def handle(self, *args, **options):
+        with override_settings(CACHES=BENCHMARK_CACHES):
+            old_config = setup_databases(verbosity=0, interactive=False, aliases={'default'})
+            try:
+                start = time.perf_counter()
+                usernames = create_league(options['players'], options['matches'], options['seed'], options['skew'])
+                league_seconds = time.perf_counter() - start
+
+                results = run_benchmarks(usernames, options['iterations'], options['recalculations'], options['seed'])
+            except BenchmarkError as e:
+                raise CommandError(str(e))
+            finally:
+                teardown_databases(old_config, verbosity=0)
+
+        report = {
+            'commit': _git_commit(),
+            'database': connection.vendor,
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'league': {
+                'players': options['players'],
+                'matches': options['matches'],
+                'skew': options['skew'],
+                'seed': options['seed'],
+                'seconds_to_create': league_seconds,
+            },
+            'iterations': options['iterations'],
+            'results': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(report, f, indent=2)
+
+        baseline = {}
+        if options['compare']:
+            with open(options['compare']) as f:
+                baseline = json.load(f)['results']
+
+        self.stdout.write(f'{"operation":<26}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}{"queries":>9}')
+        for name, summary in results.items():
+            line = (f'{name:<26}{summary["p50_ms"]:9.2f}{summary["p95_ms"]:9.2f}{summary["p99_ms"]:9.2f}'
+                    f'{summary["queries_mean"]:9.1f}')
+            if name in baseline:
+                change = summary['p50_ms'] / baseline[name]['p50_ms'] - 1
+                line += f'  p50 {change:+.0%} vs {baseline[name]["p50_ms"]:.2f}ms'
+            self.stdout.write(line)
@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from foos.benchmarks import generated_history, run_engine_benchmarks
+from foos.elo import load_history
+from foos.engines import ENGINES
+
+
+class Command(BaseCommand):
+    help = ('Replays a generated league, or the recorded matches with --recorded, with every rating engine, '
+            'and compares how fast they replay and how well they predict the winners. Nothing is written.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recorded', action='store_true',
+                            help='Replay the recorded matches instead of a generated league')
+        parser.add_argument('--players', type=int, default=100)
+        parser.add_argument('--matches', type=int, default=20000)
+        parser.add_argument('--skew', type=float, default=1.0,
+                            help='How much more the most active players play than the rest')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeats', type=int, default=3, help='Replays per engine, the fastest of which counts')
+        parser.add_argument('--engine', action='append', choices=sorted(ENGINES),
+                            help='Only benchmark this engine; can be repeated')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        if options['recorded']:
+            history = load_history()
+        else:
+            history = generated_history(options['players'], options['matches'], options['seed'], options['skew'])
+        if not len(history):
+            raise CommandError('There are no matches to replay')
+
+        engines = [ENGINES[name]() for name in options['engine'] or ENGINES]
+        results = run_engine_benchmarks(history, engines, options['repeats'])
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f'{len(history)} matches, {len(history.player_keys)} players, '
+                          f'{len(history.team_keys)} teams')
+        self.stdout.write(f'{"engine":<12}{"matches/s":>12}{"log loss":>10}{"brier":>8}{"accuracy":>10}')
+        for name, result in results.items():
+            self.stdout.write(f'{name:<12}{result["matches_per_second"]:12.0f}{result["log_loss"]:10.4f}'
+                              f'{result["brier"]:8.4f}{result["accuracy"]:10.1%}')
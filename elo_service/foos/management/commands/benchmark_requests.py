@@ -0,0 +1,83 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from foos.benchmarks import ServiceClient, summarize
+
+USERNAMES = ('benchmarka', 'benchmarkb', 'benchmarkc', 'benchmarkd')
+
+WARMUP_REQUESTS = 10
+
+
+def _run(url, num_requests):
+    """
+    Returns {endpoint: summary} for num_requests rounds of recording a match
+    and reading the leaderboard from the service at url.
+    """
+    client = ServiceClient(url)
+    try:
+        for username in USERNAMES:
+            status, _ = client.post_form('player/', {'username': username})
+            if status not in (201, 400):
+                raise CommandError(f'Creating player {username} failed with status {status}')
+
+        timings = {'record_match': [], 'leaderboards': []}
+        for i in range(WARMUP_REQUESTS + num_requests):
+            # Rotate who wins so the elos keep moving
+            wp1, wp2, lp1, lp2 = USERNAMES[i % 4:] + USERNAMES[:i % 4]
+            status, record_seconds = client.post_json('record_match/', {
+                'winning_team': [wp1, wp2],
+                'losing_team': [lp1, lp2],
+                'winning_score': 5,
+                'losing_score': i % 5
+            })
+            if status != 200:
+                raise CommandError(f'record_match failed with status {status}')
+
+            status, board_seconds = client.request('GET', 'leaderboards/10/')
+            if status != 200:
+                raise CommandError(f'leaderboards failed with status {status}')
+
+            if i >= WARMUP_REQUESTS:
+                timings['record_match'].append(record_seconds)
+                timings['leaderboards'].append(board_seconds)
+    except OSError as e:
+        raise CommandError(f'Could not reach {url}: {e}')
+    finally:
+        client.close()
+
+    return {endpoint: summarize(seconds) for endpoint, seconds in timings.items()}
+
+
+class Command(BaseCommand):
+    help = ('Times requests to a running elo service, alternating recording a match with reading the '
+            'leaderboard (which the match invalidates, so it is never served from the cache). '
+            'It creates players and records matches, so point it at a throwaway database. '
+            'To compare two setups, such as with and without connection pooling, run a second server '
+            'with the baseline setup (e.g. ELO_DB_POOL=false ELO_BIND=0.0.0.0:8001) and pass it as '
+            '--baseline-url: both are timed and the changes against the baseline reported.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000/foos')
+        parser.add_argument('--baseline-url', help='A server to time first and compare --url against')
+        parser.add_argument('--requests', type=int, default=200, help='Number of requests per endpoint')
+        parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+
+    def handle(self, *args, **options):
+        runs = {}
+        if options['baseline_url']:
+            runs['baseline'] = _run(options['baseline_url'], options['requests'])
+        runs['results'] = _run(options['url'], options['requests'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(runs if 'baseline' in runs else runs['results'], indent=2))
+            return
+
+        for endpoint, summary in runs['results'].items():
+            line = (f'{endpoint:<14} mean {summary["mean_ms"]:7.2f}ms  p50 {summary["p50_ms"]:7.2f}ms  '
+                    f'p95 {summary["p95_ms"]:7.2f}ms  p99 {summary["p99_ms"]:7.2f}ms')
+            if 'baseline' in runs:
+                baseline = runs['baseline'][endpoint]
+                changes = '  '.join(
+                    f'{stat} {summary[f"{stat}_ms"] / baseline[f"{stat}_ms"] - 1:+.0%}' for stat in ('p50', 'p95'))
+                line += f'  vs baseline p50 {baseline["p50_ms"]:.2f}ms: {changes}'
+            self.stdout.write(line)
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from foos.export import CHUNK_SIZE, FORMATS, iter_export
+
+class Command(BaseCommand):
+    help = 'Streams every match, with everyone\'s elo after it, to stdout as JSON lines or CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=FORMATS, default='jsonl')
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=CHUNK_SIZE,
+            help='Number of matches to fetch from the database at a time')
+
+    def handle(self, *args, **options):
+        for line in iter_export(options['format'], options['chunk_size']):
+            self.stdout.write(line, ending='')
@@ -0,0 +1,40 @@
+import os
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from foos.importer import FORMATS, CSV_COLUMNS, InvalidMatches, import_matches, parse_matches
+
+class Command(BaseCommand):
+    help = ('Imports matches in bulk from a CSV file (columns: '
+            + ', '.join(CSV_COLUMNS)
+            + ') or a JSON lines file, then recalculates all elos and stats')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import, or - for stdin')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Defaults to the file extension, or jsonl for stdin')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format']
+        if not format:
+            extension = os.path.splitext(path)[1].lstrip('.').lower()
+            format = 'csv' if extension == 'csv' else 'jsonl'
+
+        try:
+            if path == '-':
+                matches = parse_matches(sys.stdin, format)
+            else:
+                with open(path, newline='', encoding='utf-8') as f:
+                    matches = parse_matches(f, format)
+            imported = import_matches(matches)
+        except InvalidMatches as e:
+            for error in e.errors:
+                self.stderr.write(error)
+            raise CommandError(str(e))
+        except OSError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(f'Imported {imported} matches')
@@ -0,0 +1,8 @@
+from django.core.management.base import BaseCommand
+from foos.stats import rebuild_all_stats
+
+class Command(BaseCommand):
+    help = 'Rebuilds the win, loss and goal counters of every player and team from the matches in DB'
+
+    def handle(self, *args, **options):
+        rebuild_all_stats()
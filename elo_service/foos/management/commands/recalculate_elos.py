@@ -1,8 +1,24 @@
 from django.core.management.base import BaseCommand, CommandError
-from foos.elo import recalculate_all_elos
+from foos.elo import find_elo_mismatches, recalculate_all_elos
 
 class Command(BaseCommand):
     help = 'Recalculates all elos based on current matches in DB'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--check',
+            action='store_true',
+            help='Only replay the matches and report stored elos that differ, without writing anything')
+
     def handle(self, *args, **options):
-        recalculate_all_elos()
\ No newline at end of file
+        if not options['check']:
+            recalculate_all_elos()
+            return
+
+        mismatches = find_elo_mismatches()
+        for model, obj_id, stored_elo, replayed_elo in mismatches:
+            self.stdout.write(f'{model.__name__} {obj_id}: stored {stored_elo}, replayed {replayed_elo}')
+
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} elos do not match a full replay')
+        self.stdout.write('All elos match a full replay')
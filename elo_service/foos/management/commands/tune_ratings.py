@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from foos.elo import K, RPA, load_history
+from foos.tuning import tune_elo
+
+
+def _numbers(value):
+    try:
+        return [float(number) for number in value.split(',')]
+    except ValueError:
+        raise CommandError(f'Expected comma separated numbers, got {value!r}')
+
+
+class Command(BaseCommand):
+    help = ('Replays the recorded matches with every combination of the given K factors and RPAs, '
+            'in parallel, and reports how well each predicted the winners. The history is read once '
+            'and the stored elos are left as they are.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', default='8,16,24,32,40,48,64', help='Comma separated K factors to try')
+        parser.add_argument('--rpa', default='200,300,400,500,600,800', help='Comma separated RPAs to try')
+        parser.add_argument('--workers', type=int, help='Number of processes (default: one per CPU)')
+        parser.add_argument('--top', type=int, default=10, help='Number of configurations to list')
+        parser.add_argument('--json', action='store_true', help='Print every configuration as JSON')
+
+    def handle(self, *args, **options):
+        ks, rpas = _numbers(options['k']), _numbers(options['rpa'])
+        history = load_history()
+        if not len(history):
+            raise CommandError('There are no matches to replay')
+
+        results = tune_elo(history, ks, rpas, options['workers'])
+        if options['json']:
+            self.stdout.write(json.dumps([{'k': k, 'rpa': rpa, **scores} for k, rpa, scores in results], indent=2))
+            return
+
+        self.stdout.write(f'{len(results)} configurations over {len(history)} matches')
+        self.stdout.write(f'{"k":>6}{"rpa":>7}{"log loss":>10}{"brier":>8}{"accuracy":>10}')
+        for place, (k, rpa, scores) in enumerate(results):
+            current = (k, rpa) == (K, RPA)
+            # The current configuration is listed wherever it places
+            if place < options['top'] or current:
+                self.stdout.write(f'{k:6g}{rpa:7g}{scores["log_loss"]:10.4f}{scores["brier"]:8.4f}'
+                                  f'{scores["accuracy"]:10.1%}' + (f'  (current, #{place + 1})' if current else ''))
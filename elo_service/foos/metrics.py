@@ -0,0 +1,289 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the histogram buckets for request and DB time
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+SLOW_REQUEST_SECONDS = 0.5
+METRICS_DIR = None
+
+# How often each process writes its metrics out for the others to read
+SNAPSHOT_SECONDS = 1
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Queries listed in the log entry of a slow request, and how much of their
+# parameters is shown, since bulk writes can have thousands
+MAX_LOGGED_QUERIES = 50
+MAX_LOGGED_PARAMS = 200
+
+
+class RequestQueries:
+    """
+    The queries made while handling one request, as (sql, params, seconds).
+    A duplicate is a query whose SQL, parameters aside, already ran for the
+    request, which is how N+1 query patterns show up.
+    """
+    def __init__(self):
+        self.queries = []
+
+    @property
+    def seconds(self):
+        return sum(seconds for _, _, seconds in self.queries)
+
+    @property
+    def duplicates(self):
+        return len(self.queries) - len({sql for sql, _, _ in self.queries})
+
+
+_request_queries = ContextVar('foos_request_queries', default=None)
+
+
+def _record_query(execute, sql, params, many, context):
+    queries = _request_queries.get()
+    if queries is None:
+        return execute(sql, params, many, context)
+
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        queries.queries.append((sql, params, time.perf_counter() - start))
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    """
+    connection_created receiver that times every query on the connection.
+    It has to be on the connection itself since, under ASGI, the ORM runs
+    in worker threads, each with its own connection; the queries get back
+    to their request through the RequestQueries in the context, which
+    sync_to_async carries over to those threads.
+    """
+    if _record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_record_query)
+
+
+def start_request():
+    """
+    Starts recording the queries of a request. Returns (queries, token),
+    with token to pass to end_request.
+    """
+    queries = RequestQueries()
+    return queries, _request_queries.set(queries)
+
+
+def end_request(token):
+    _request_queries.reset(token)
+
+
+def _histogram():
+    return {'buckets': [0] * len(BUCKETS), 'sum': 0., 'count': 0}
+
+
+def _observe(histogram, seconds):
+    for i, bound in enumerate(BUCKETS):
+        if seconds <= bound:
+            histogram['buckets'][i] += 1
+            break
+    histogram['sum'] += seconds
+    histogram['count'] += 1
+
+
+def _view_totals():
+    return {
+        'duration': _histogram(),
+        'db_duration': _histogram(),
+        'queries': 0,
+        'duplicate_queries': 0,
+        'slow': 0,
+    }
+
+
+class _Metrics:
+    """
+    Totals for the requests handled by this process. Every server process
+    writes its totals to METRICS_DIR, SNAPSHOT_SECONDS after a request
+    (together with any others in the meantime) and on exit, and the metrics
+    endpoint adds up everyone's, so it reports the whole service whichever
+    worker answers. Files of workers that have exited are kept, so that the
+    counters never go down, until the server is restarted (see
+    gunicorn.conf.py).
+    """
+    def __init__(self):
+        self.requests = {}  # (view, method, status) -> count
+        self.views = {}  # view -> _view_totals()
+        self._lock = threading.Lock()
+        self._pending_snapshot = None
+        self._file_name = None
+        atexit.register(self.write_snapshot)
+
+    def record(self, view, method, status, seconds, queries, slow):
+        with self._lock:
+            key = (view, method, str(status))
+            self.requests[key] = self.requests.get(key, 0) + 1
+            totals = self.views.setdefault(view, _view_totals())
+            _observe(totals['duration'], seconds)
+            _observe(totals['db_duration'], queries.seconds)
+            totals['queries'] += len(queries.queries)
+            totals['duplicate_queries'] += queries.duplicates
+            totals['slow'] += slow
+
+            # Batch up the requests of the next SNAPSHOT_SECONDS into one write
+            if self._pending_snapshot or not getattr(settings, 'METRICS_DIR', METRICS_DIR):
+                return
+            self._pending_snapshot = threading.Timer(SNAPSHOT_SECONDS, self.write_snapshot)
+            self._pending_snapshot.daemon = True
+            self._pending_snapshot.start()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': [[*key, count] for key, count in self.requests.items()],
+                'views': json.loads(json.dumps(self.views)),
+            }
+
+    def _path(self, directory):
+        # Not just the pid, which a later worker may be given again
+        if self._file_name is None:
+            self._file_name = f'{os.getpid()}-{time.time_ns()}.json'
+        return os.path.join(directory, self._file_name)
+
+    def write_snapshot(self):
+        with self._lock:
+            if self._pending_snapshot:
+                self._pending_snapshot.cancel()
+                self._pending_snapshot = None
+            idle = not self.requests
+
+        directory = getattr(settings, 'METRICS_DIR', METRICS_DIR)
+        if not directory or idle:
+            return
+
+        path = self._path(directory)
+        try:
+            with open(f'{path}.tmp', 'w') as f:
+                json.dump(self.snapshot(), f)
+            os.replace(f'{path}.tmp', path)
+        except OSError as e:
+            logger.warning('Could not write metrics to %s: %s', path, e)
+
+    def _snapshots(self):
+        """
+        Returns the snapshots of every process, this one's up to date.
+        """
+        snapshots = [self.snapshot()]
+        directory = getattr(settings, 'METRICS_DIR', METRICS_DIR)
+        if not directory or not os.path.isdir(directory):
+            return snapshots
+
+        own_path = self._path(directory)
+        for name in os.listdir(directory):
+            path = os.path.join(directory, name)
+            if not name.endswith('.json') or path == own_path:
+                continue
+            try:
+                with open(path) as f:
+                    snapshots.append(json.load(f))
+            except (OSError, ValueError):
+                # Gone or half written; it'll be there next time
+                continue
+        return snapshots
+
+    def render(self):
+        """
+        Returns everyone's totals in the Prometheus text format.
+        """
+        requests = {}
+        views = {}
+        for snapshot in self._snapshots():
+            for view, method, status, count in snapshot['requests']:
+                requests[view, method, status] = requests.get((view, method, status), 0) + count
+            for view, totals in snapshot['views'].items():
+                merged = views.setdefault(view, _view_totals())
+                for name in ('duration', 'db_duration'):
+                    histogram = merged[name]
+                    histogram['buckets'] = [a + b for a, b in zip(histogram['buckets'], totals[name]['buckets'])]
+                    histogram['sum'] += totals[name]['sum']
+                    histogram['count'] += totals[name]['count']
+                for name in ('queries', 'duplicate_queries', 'slow'):
+                    merged[name] += totals[name]
+
+        lines = [
+            '# HELP foos_requests_total Requests handled by the foos views.',
+            '# TYPE foos_requests_total counter',
+        ]
+        for (view, method, status), count in sorted(requests.items()):
+            lines.append(f'foos_requests_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+        for name, description in (('duration', 'Wall time of requests'),
+                                  ('db_duration', 'Time spent in the database per request')):
+            metric = f'foos_request_{name}_seconds'
+            lines.append(f'# HELP {metric} {description}, by view.')
+            lines.append(f'# TYPE {metric} histogram')
+            for view, totals in sorted(views.items()):
+                histogram = totals[name]
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram['buckets']):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{view="{view}",le="+Inf"}} {histogram["count"]}')
+                lines.append(f'{metric}_sum{{view="{view}"}} {histogram["sum"]}')
+                lines.append(f'{metric}_count{{view="{view}"}} {histogram["count"]}')
+
+        for name, metric, description in (
+                ('queries', 'foos_request_queries_total', 'Database queries made'),
+                ('duplicate_queries', 'foos_request_duplicate_queries_total',
+                 'Queries repeating SQL already run for the same request'),
+                ('slow', 'foos_slow_requests_total', 'Requests slower than SLOW_REQUEST_SECONDS')):
+            lines.append(f'# HELP {metric} {description}, by view.')
+            lines.append(f'# TYPE {metric} counter')
+            for view, totals in sorted(views.items()):
+                lines.append(f'{metric}{{view="{view}"}} {totals[name]}')
+
+        return '\n'.join(lines) + '\n'
+
+
+metrics = _Metrics()
+
+
+def finish_request(request, response, seconds, queries):
+    """
+    Adds the Server-Timing header to response, counts the request towards
+    its view's totals and logs it with its queries if it was slow.
+    Requests that didn't go to a foos view are left alone.
+    """
+    match = request.resolver_match
+    if match is None or not match.func.__module__.startswith('foos.'):
+        return response
+
+    view = match.func.__name__
+    db_seconds = queries.seconds
+    response['Server-Timing'] = ', '.join([
+        f'total;dur={seconds * 1000:.1f}',
+        f'db;dur={db_seconds * 1000:.1f};desc="{len(queries.queries)} queries ({queries.duplicates} duplicates)"',
+        f'app;dur={(seconds - db_seconds) * 1000:.1f}',
+    ])
+
+    slow = seconds > getattr(settings, 'SLOW_REQUEST_SECONDS', SLOW_REQUEST_SECONDS)
+    metrics.record(view, request.method, response.status_code, seconds, queries, slow)
+    if slow:
+        logged = [
+            f'  {query_seconds * 1000:.1f}ms {sql} {params!r:.{MAX_LOGGED_PARAMS}}'
+            for sql, params, query_seconds in queries.queries[:MAX_LOGGED_QUERIES]
+        ]
+        if len(queries.queries) > MAX_LOGGED_QUERIES:
+            logged.append(f'  and {len(queries.queries) - MAX_LOGGED_QUERIES} more')
+        logger.warning(
+            'Slow request: %s %s took %.0fms, %.0fms of it in %d queries (%d duplicates)\n%s',
+            request.method, request.get_full_path(), seconds * 1000, db_seconds * 1000,
+            len(queries.queries), queries.duplicates, '\n'.join(logged))
+    return response
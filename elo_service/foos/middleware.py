@@ -0,0 +1,43 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from foos.metrics import end_request, finish_request, start_request
+
+
+class RequestMetricsMiddleware:
+    """
+    Times every request to a foos view and the queries it makes, reporting
+    them in a Server-Timing header and the metrics endpoint, and logging
+    slow requests with their SQL (see foos.metrics).
+
+    Streaming responses are only timed until they start streaming.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        queries, token = start_request()
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return finish_request(request, response, time.perf_counter() - start, queries)
+
+    async def __acall__(self, request):
+        queries, token = start_request()
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return finish_request(request, response, time.perf_counter() - start, queries)
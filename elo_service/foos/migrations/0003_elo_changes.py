@@ -0,0 +1,34 @@
+# Generated by Django 2.2 on 2026-10-18 08:48
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0002_auto_20190414_2335'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TeamEloChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('elo_before', models.IntegerField()),
+                ('elo_after', models.IntegerField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='team_elo_changes', to='foos.Match')),
+                ('team', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='elo_changes', to='foos.Team')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PlayerEloChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('elo_before', models.IntegerField()),
+                ('elo_after', models.IntegerField()),
+                ('match', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='player_elo_changes', to='foos.Match')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='elo_changes', to='foos.Player')),
+            ],
+        ),
+    ]
@@ -0,0 +1,95 @@
+# Generated by Django 2.2 on 2026-10-18 08:49
+
+from django.db import migrations, models
+
+
+def populate_stat_counters(apps, schema_editor):
+    Match = apps.get_model('foos', 'Match')
+    Player = apps.get_model('foos', 'Player')
+    Team = apps.get_model('foos', 'Team')
+
+    fields = ('wins', 'losses', 'games', 'goals_for', 'goals_against')
+    player_stats = {}
+    team_stats = {}
+
+    def count(stats, key, won, goals_for, goals_against):
+        row = stats.setdefault(key, dict.fromkeys(fields, 0))
+        row['wins' if won else 'losses'] += 1
+        row['games'] += 1
+        row['goals_for'] += goals_for
+        row['goals_against'] += goals_against
+
+    for match in Match.objects.prefetch_related('winning_team__players', 'losing_team__players'):
+        count(team_stats, match.winning_team_id, True, match.winning_score, match.losing_score)
+        count(team_stats, match.losing_team_id, False, match.losing_score, match.winning_score)
+        for player in match.winning_team.players.all():
+            count(player_stats, player.id, True, match.winning_score, match.losing_score)
+        for player in match.losing_team.players.all():
+            count(player_stats, player.id, False, match.losing_score, match.winning_score)
+
+    for model, stats in ((Player, player_stats), (Team, team_stats)):
+        model.objects.bulk_update(
+            [model(id=obj_id, **row) for obj_id, row in stats.items()],
+            fields,
+            batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0003_elo_changes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='games',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='goals_against',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='goals_for',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='losses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='player',
+            name='wins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='games',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='goals_against',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='goals_for',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='losses',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='wins',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(populate_stat_counters, migrations.RunPython.noop),
+    ]
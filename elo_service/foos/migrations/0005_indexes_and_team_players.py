@@ -0,0 +1,93 @@
+# Generated by Django 2.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+STAT_FIELDS = ('wins', 'losses', 'games', 'goals_for', 'goals_against')
+
+
+def merge_duplicate_usernames(apps, schema_editor):
+    """
+    Merges players created more than once under the same username (the
+    check for an existing username and the insert used to race) into the
+    oldest of them, so that the username can be made unique: their team
+    memberships, elo changes and counters are moved over and the duplicates
+    deleted. The merged player's elo is left as is, so run
+    `manage.py recalculate_elos` afterwards if anything was merged.
+
+    Fails instead if a duplicate played in a team with the player it would
+    be merged into, since that team would end up with one player.
+    """
+    Player = apps.get_model('foos', 'Player')
+    PlayerEloChange = apps.get_model('foos', 'PlayerEloChange')
+    Membership = apps.get_model('foos', 'Team').players.through
+
+    duplicates = (Player.objects
+                      .values('username')
+                      .annotate(count=models.Count('id'))
+                      .filter(count__gt=1)
+                      .values_list('username', flat=True))
+    merged = False
+    for username in list(duplicates):
+        canonical, *others = Player.objects.filter(username=username).order_by('id')
+        canonical_teams = set(Membership.objects.filter(player=canonical).values_list('team_id', flat=True))
+        for player in others:
+            shared = canonical_teams.intersection(
+                Membership.objects.filter(player=player).values_list('team_id', flat=True))
+            if shared:
+                raise RuntimeError(
+                    f'Players {canonical.id} and {player.id} are both named {username!r} and played together '
+                    f'in team(s) {sorted(shared)}. Rename one of them before migrating.')
+
+            Membership.objects.filter(player=player).update(player=canonical)
+            PlayerEloChange.objects.filter(player=player).update(player=canonical)
+            for field in STAT_FIELDS:
+                setattr(canonical, field, getattr(canonical, field) + getattr(player, field))
+            canonical.save(update_fields=STAT_FIELDS)
+            player.delete()
+            merged = True
+
+    # Postgres won't alter a table with foreign key checks still pending
+    # from the changes above, so run them now
+    if merged and schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0004_stat_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_usernames, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='player',
+            name='username',
+            field=models.CharField(max_length=32, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='match',
+            name='timestamp',
+            field=models.DateTimeField(auto_now_add=True, db_index=True),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['winning_team', 'timestamp'], name='foos_match_winning_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='match',
+            index=models.Index(fields=['losing_team', 'timestamp'], name='foos_match_losing_ts_idx'),
+        ),
+        # Nullable until 0006 has filled them in from the team rosters
+        migrations.AddField(
+            model_name='team',
+            name='player_low',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='foos.Player'),
+        ),
+        migrations.AddField(
+            model_name='team',
+            name='player_high',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='foos.Player'),
+        ),
+    ]
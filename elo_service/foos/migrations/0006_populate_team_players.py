@@ -0,0 +1,68 @@
+# Generated by Django 2.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+
+STAT_FIELDS = ('wins', 'losses', 'games', 'goals_for', 'goals_against')
+
+
+def populate_team_players(apps, schema_editor):
+    """
+    Fills in player_low/player_high for every team. Teams that were created
+    more than once for the same pair of players (concurrent reports could do
+    that) are merged into the oldest one: their matches and counters are moved
+    over and the duplicates deleted. The merged team's elo is left as is, so
+    run `manage.py recalculate_elos` afterwards if anything was merged.
+
+    Teams used to get their players added after being created, outside a
+    transaction, so a team can be missing players. Those that never played a
+    match are deleted; if one has played, the migration fails, since there's
+    no telling who played in it.
+    """
+    Match = apps.get_model('foos', 'Match')
+    Team = apps.get_model('foos', 'Team')
+    TeamEloChange = apps.get_model('foos', 'TeamEloChange')
+
+    rosters = {}
+    for team_id, player_id in Team.players.through.objects.order_by('team_id', 'player_id').values_list('team_id', 'player_id'):
+        rosters.setdefault(team_id, []).append(player_id)
+
+    canonical_teams = {}
+    for team in Team.objects.order_by('id'):
+        roster = rosters.get(team.id, [])
+        if len(roster) != 2:
+            if Match.objects.filter(models.Q(winning_team=team) | models.Q(losing_team=team)).exists():
+                raise RuntimeError(
+                    f'Team {team.id} has played matches but has {len(roster)} players instead of 2. '
+                    f'Add its missing players (or delete it and its matches) before migrating.')
+            team.delete()
+            continue
+
+        player_low, player_high = roster
+        key = (player_low, player_high)
+
+        if key not in canonical_teams:
+            team.player_low_id = player_low
+            team.player_high_id = player_high
+            team.save(update_fields=['player_low', 'player_high'])
+            canonical_teams[key] = team
+            continue
+
+        canonical = canonical_teams[key]
+        Match.objects.filter(winning_team=team).update(winning_team=canonical)
+        Match.objects.filter(losing_team=team).update(losing_team=canonical)
+        TeamEloChange.objects.filter(team=team).update(team=canonical)
+        for field in STAT_FIELDS:
+            setattr(canonical, field, getattr(canonical, field) + getattr(team, field))
+        canonical.save(update_fields=STAT_FIELDS)
+        team.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0005_indexes_and_team_players'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_team_players, migrations.RunPython.noop),
+    ]
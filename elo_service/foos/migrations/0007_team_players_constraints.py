@@ -0,0 +1,32 @@
+# Generated by Django 2.2 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0006_populate_team_players'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='team',
+            name='player_low',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='foos.Player'),
+        ),
+        migrations.AlterField(
+            model_name='team',
+            name='player_high',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='foos.Player'),
+        ),
+        migrations.AddConstraint(
+            model_name='team',
+            constraint=models.UniqueConstraint(fields=('player_low', 'player_high'), name='foos_team_unique_players'),
+        ),
+        migrations.AddConstraint(
+            model_name='team',
+            constraint=models.CheckConstraint(condition=models.Q(player_low__lt=models.F('player_high')), name='foos_team_ordered_players'),
+        ),
+    ]
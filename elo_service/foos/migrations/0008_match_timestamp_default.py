@@ -0,0 +1,19 @@
+# Generated by Django 2.2 on 2026-10-18 09:20
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0007_team_players_constraints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='match',
+            name='timestamp',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 2.2 on 2026-10-18 11:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_timestamps(apps, schema_editor):
+    Match = apps.get_model('foos', 'Match')
+    PlayerEloChange = apps.get_model('foos', 'PlayerEloChange')
+
+    PlayerEloChange.objects.update(timestamp=models.Subquery(
+        Match.objects.filter(id=models.OuterRef('match_id')).values('timestamp')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0008_match_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='playerelochange',
+            name='timestamp',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(populate_timestamps, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='playerelochange',
+            name='timestamp',
+            field=models.DateTimeField(),
+        ),
+        migrations.AlterField(
+            model_name='playerelochange',
+            name='player',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='elo_changes', to='foos.Player'),
+        ),
+        migrations.AddIndex(
+            model_name='playerelochange',
+            index=models.Index(fields=['player', 'timestamp'], name='foos_elo_change_player_ts_idx'),
+        ),
+    ]
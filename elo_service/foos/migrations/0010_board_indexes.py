@@ -0,0 +1,21 @@
+# Generated by Django 2.2 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('foos', '0009_elo_change_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='player',
+            index=models.Index(condition=models.Q(games__gte=3), fields=['elo', 'id'], name='foos_player_board_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='team',
+            index=models.Index(condition=models.Q(wins__gte=3), fields=['elo', 'id'], name='foos_team_board_idx'),
+        ),
+    ]
@@ -1,15 +1,83 @@
-from django.db import models
+from django.db import models, transaction
+from django.utils import timezone
 
 
 class Player(models.Model):
-    username = models.CharField(max_length=32)
+    username = models.CharField(max_length=32, unique=True)
     elo = models.IntegerField(default=1000)
 
+    # Kept up to date by foos.stats whenever a match is recorded or deleted
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    games = models.IntegerField(default=0)
+    goals_for = models.IntegerField(default=0)
+    goals_against = models.IntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            # Pages of the leader and loser boards, which only show players with 3+ games
+            models.Index(fields=['elo', 'id'], name='foos_player_board_idx',
+                         condition=models.Q(games__gte=3)),
+        ]
+
+
+class TeamManager(models.Manager):
+    def _pair_key(self, player1, player2):
+        player_low_id, player_high_id = sorted((player1.id, player2.id))
+        return {'player_low_id': player_low_id, 'player_high_id': player_high_id}
+
+    def for_players(self, player1, player2):
+        """
+        Returns the team made up of player1 and player2, in either order.
+        Raises Team.DoesNotExist if they have never played together.
+        """
+        return self.get(**self._pair_key(player1, player2))
+
+    def get_or_create_for_players(self, player1, player2):
+        """
+        Like for_players, but creates the team (roster included) if it doesn't
+        exist yet. Safe against concurrent callers: the unique constraint on the
+        player pair makes the loser of a creation race fetch the winner's team.
+
+        Returns (team, created).
+        """
+        with transaction.atomic():
+            team, created = self.get_or_create(**self._pair_key(player1, player2))
+            if created:
+                team.players.add(player1, player2)
+        return team, created
+
 
 class Team(models.Model):
     players = models.ManyToManyField(Player, related_name='teams')
     elo = models.IntegerField(default=1000)
 
+    # The same two players as `players`, lowest id first, so that a pair of
+    # players maps to exactly one team and can be found with one index probe.
+    player_low = models.ForeignKey(Player, related_name='+', on_delete=models.CASCADE)
+    player_high = models.ForeignKey(Player, related_name='+', on_delete=models.CASCADE)
+
+    # Kept up to date by foos.stats whenever a match is recorded or deleted
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+    games = models.IntegerField(default=0)
+    goals_for = models.IntegerField(default=0)
+    goals_against = models.IntegerField(default=0)
+
+    objects = TeamManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['player_low', 'player_high'], name='foos_team_unique_players'),
+            models.CheckConstraint(condition=models.Q(player_low__lt=models.F('player_high')),
+                                   name='foos_team_ordered_players'),
+        ]
+        indexes = [
+            # Pages of the dream and nightmare team boards, which only show teams with 3+ wins
+            models.Index(fields=['elo', 'id'], name='foos_team_board_idx',
+                         condition=models.Q(wins__gte=3)),
+        ]
+
 
 class Match(models.Model):
     winning_team = models.ForeignKey(Team, related_name='winning_matches', on_delete=models.CASCADE)
@@ -18,4 +86,36 @@ class Match(models.Model):
     winning_score = models.IntegerField()
     losing_score = models.IntegerField()
 
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    # Defaults to now rather than auto_now_add so imported matches keep their timestamp
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['winning_team', 'timestamp'], name='foos_match_winning_ts_idx'),
+            models.Index(fields=['losing_team', 'timestamp'], name='foos_match_losing_ts_idx'),
+        ]
+
+
+class PlayerEloChange(models.Model):
+    match = models.ForeignKey(Match, related_name='player_elo_changes', on_delete=models.CASCADE)
+    # Covered by foos_elo_change_player_ts_idx
+    player = models.ForeignKey(Player, related_name='elo_changes', on_delete=models.CASCADE, db_index=False)
+
+    elo_before = models.IntegerField()
+    elo_after = models.IntegerField()
+
+    # Copy of match.timestamp, so a player's rating history is one index range scan
+    timestamp = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['player', 'timestamp'], name='foos_elo_change_player_ts_idx'),
+        ]
+
+
+class TeamEloChange(models.Model):
+    match = models.ForeignKey(Match, related_name='team_elo_changes', on_delete=models.CASCADE)
+    team = models.ForeignKey(Team, related_name='elo_changes', on_delete=models.CASCADE)
+
+    elo_before = models.IntegerField()
+    elo_after = models.IntegerField()
@@ -0,0 +1,227 @@
+import threading
+import time
+from bisect import bisect_left, bisect_right, insort
+
+from django.core.cache import cache
+
+from foos.caching import ratings_version
+from foos.models import Player, Team
+
+# Who is ranked: the same players and teams the boards show
+MIN_RANKED_GAMES = 3
+MIN_RANKED_WINS = 3
+
+# How long the changes of a recorded match stay in the cache for other
+# processes to apply, and how many in a row a process applies before it
+# rebuilds instead
+CHANGE_TIMEOUT = 3600
+MAX_CHAINED_CHANGES = 100
+
+# How many matches recorded at the same moment, on top of the same version,
+# can publish their changes (see _Ranks)
+MAX_CONCURRENT_CHANGES = 8
+
+# Indexes are rebuilt at least this often, in case one missed a change (see
+# _Ranks)
+MAX_INDEX_AGE = 600
+
+
+class RankIndex:
+    """
+    The elos of everyone ranked, kept sorted so that the rank and percentile
+    of an elo are a binary search away instead of a count over the table.
+    """
+    def __init__(self, elos=()):
+        self._elos = sorted(elos)
+
+    def __len__(self):
+        return len(self._elos)
+
+    def add(self, elo):
+        insort(self._elos, elo)
+
+    def __contains__(self, elo):
+        i = bisect_left(self._elos, elo)
+        return i < len(self._elos) and self._elos[i] == elo
+
+    def remove(self, elo):
+        """
+        Removes one of elo. Returns False if there wasn't one.
+        """
+        i = bisect_left(self._elos, elo)
+        if i < len(self._elos) and self._elos[i] == elo:
+            del self._elos[i]
+            return True
+        return False
+
+    def rank(self, elo):
+        """
+        Returns 1 for the highest elo. Equal elos share a rank, like on a
+        podium, so the next elo down is ranked by how many are above it.
+        """
+        return len(self._elos) - bisect_right(self._elos, elo) + 1
+
+    def percentile(self, elo):
+        """
+        Returns the percentage of the ranked at or below elo, or None if
+        nobody is ranked.
+        """
+        if not self._elos:
+            return None
+        return bisect_right(self._elos, elo) / len(self._elos) * 100
+
+
+def _change_key(version, slot):
+    return f'foos:ranks:change:{version}:{slot}'
+
+
+def _published(version):
+    """
+    Returns the (new_version, player_changes, team_changes) published on top
+    of version, in the order they were published.
+    """
+    changes = []
+    for slot in range(MAX_CONCURRENT_CHANGES):
+        change = cache.get(_change_key(version, slot))
+        if change is None:
+            break
+        changes.append(change)
+    return changes
+
+
+class _Ranks:
+    """
+    The player and team RankIndexes of this process, as of a ratings
+    version. Every process serving requests keeps its own.
+
+    Recording a match publishes its changes to the cache under the version
+    it replaced, before the new version is stored (see publish_match). When
+    the version moves on, a process follows those changes from its own
+    version to the current one and applies them in place, so a match costs
+    every process a few cache reads rather than a rebuild. Writes that
+    publish nothing, like deleting a match, imports and recalculations,
+    break the chain, and then the indexes are rebuilt from the DB.
+
+    The version isn't swapped atomically, so matches recorded at the same
+    moment can each replace the same version. Each publishes to the first
+    free slot under it, and a process applies every one of them: either the
+    version it's after is among theirs, or it follows the one that has
+    changes published on top of it in turn. If it can't tell which, it
+    rebuilds.
+
+    The file based cache's add isn't atomic either, so two publishes can
+    still, rarely, land in one slot. An index that missed a change fails to
+    find the old elo of someone changing again, or the current elo of
+    someone looked up, and is rebuilt then; failing that, every index is
+    rebuilt after MAX_INDEX_AGE.
+    """
+    def __init__(self):
+        self.version = None
+        self.players = None
+        self.teams = None
+        self.built_at = None
+        self._lock = threading.Lock()
+
+    def _rebuild(self, version):
+        players = Player.objects.filter(games__gte=MIN_RANKED_GAMES)
+        teams = Team.objects.filter(wins__gte=MIN_RANKED_WINS)
+        self.players = RankIndex(players.values_list('elo', flat=True))
+        self.teams = RankIndex(teams.values_list('elo', flat=True))
+        self.version = version
+        self.built_at = time.monotonic()
+
+    def _apply(self, player_changes, team_changes):
+        """
+        Applies the changes of a match. Returns False if the indexes turn
+        out not to have been as the match left them, having missed a change.
+        """
+        consistent = True
+        for index, changes in ((self.players, player_changes), (self.teams, team_changes)):
+            for elo_before, elo_after, ranked_before, ranked_after in changes:
+                if ranked_before and not index.remove(elo_before):
+                    consistent = False
+                if ranked_after:
+                    index.add(elo_after)
+        return consistent
+
+    def _catch_up(self, version):
+        """
+        Applies the changes published since self.version, up to version.
+        Returns whether that got there.
+        """
+        changes = _published(self.version)
+        for _ in range(MAX_CHAINED_CHANGES):
+            if not changes:
+                return False
+            for _, player_changes, team_changes in changes:
+                if not self._apply(player_changes, team_changes):
+                    return False
+
+            new_versions = [new_version for new_version, _, _ in changes]
+            if version in new_versions:
+                self.version = version
+                return True
+            # Of matches recorded at the same moment, only the last to store
+            # its version has anything published on top of it
+            following = [(new_version, _published(new_version)) for new_version in new_versions]
+            following = [(new_version, changes) for new_version, changes in following if changes]
+            if len(following) != 1:
+                return False
+            self.version, changes = following[0]
+        return False
+
+    def _current(self):
+        version = ratings_version()
+        # No version at all means a cache that doesn't keep anything, such
+        # as the dummy one, and then nothing tells us the index is current
+        if (version is None or self.version is None
+                or time.monotonic() - self.built_at > MAX_INDEX_AGE
+                or version != self.version and not self._catch_up(version)):
+            self._rebuild(version)
+        return self
+
+    def _rank(self, kind, elo):
+        index = getattr(self._current(), kind)
+        if elo not in index:
+            # Either ranked since the index was built, or a change was missed
+            self._rebuild(ratings_version())
+            index = getattr(self, kind)
+        return index.rank(elo), index.percentile(elo)
+
+    def player_rank(self, player):
+        """
+        Returns (rank, percentile) for player, or (None, None) if they aren't
+        ranked yet.
+        """
+        if player.games < MIN_RANKED_GAMES:
+            return None, None
+        with self._lock:
+            return self._rank('players', player.elo)
+
+    def team_rank(self, team):
+        """
+        Returns (rank, percentile) for team, or (None, None) if it isn't
+        ranked yet.
+        """
+        if team.wins < MIN_RANKED_WINS:
+            return None, None
+        with self._lock:
+            return self._rank('teams', team.elo)
+
+    def publish_match(self, old_version, new_version, player_changes, team_changes):
+        """
+        Publishes the changes of a match just recorded, for every process
+        (this one included) to apply when it sees new_version. Called just
+        before new_version replaces old_version.
+
+        The changes are (elo_before, elo_after, ranked_before, ranked_after)
+        for each player and team.
+        """
+        if old_version is None:
+            return
+        for slot in range(MAX_CONCURRENT_CHANGES):
+            if cache.add(_change_key(old_version, slot), (new_version, player_changes, team_changes), CHANGE_TIMEOUT):
+                return
+
+
+ranks = _Ranks()
@@ -0,0 +1,92 @@
+from django.db import transaction
+from django.db.models import F
+
+from foos.caching import bump_ratings_version
+from foos.models import Match, Player, Team
+
+STAT_FIELDS = ('wins', 'losses', 'games', 'goals_for', 'goals_against')
+
+
+def _count_result(obj, won, goals_for, goals_against):
+    if won:
+        obj.wins += 1
+    else:
+        obj.losses += 1
+    obj.games += 1
+    obj.goals_for += goals_for
+    obj.goals_against += goals_against
+
+
+def count_match(match, winners, losers):
+    """
+    Counts a newly recorded match towards the wins, losses, games and goals
+    of the winning and losing teams and players passed in. This only changes
+    the objects in memory, so the caller has to save them, and they must have
+    been read under a lock.
+    """
+    for obj in winners:
+        _count_result(obj, True, match.winning_score, match.losing_score)
+    for obj in losers:
+        _count_result(obj, False, match.losing_score, match.winning_score)
+
+
+def remove_match_stats(match):
+    """
+    Reverses count_match for a match that is about to be deleted.
+    """
+    winning_side = {
+        'wins': F('wins') - 1,
+        'games': F('games') - 1,
+        'goals_for': F('goals_for') - match.winning_score,
+        'goals_against': F('goals_against') - match.losing_score,
+    }
+    losing_side = {
+        'losses': F('losses') - 1,
+        'games': F('games') - 1,
+        'goals_for': F('goals_for') - match.losing_score,
+        'goals_against': F('goals_against') - match.winning_score,
+    }
+
+    Player.objects.filter(teams=match.winning_team_id).update(**winning_side)
+    Player.objects.filter(teams=match.losing_team_id).update(**losing_side)
+    Team.objects.filter(id=match.winning_team_id).update(**winning_side)
+    Team.objects.filter(id=match.losing_team_id).update(**losing_side)
+
+
+@transaction.atomic
+def rebuild_all_stats():
+    """
+    Recomputes every player and team counter from the matches table, for
+    repairing counters that have drifted.
+    """
+    rosters = {}
+    for team_id, player_id in Team.players.through.objects.values_list('team_id', 'player_id'):
+        rosters.setdefault(team_id, []).append(player_id)
+
+    player_stats = {}
+    team_stats = {}
+
+    def count(stats, key, won, goals_for, goals_against):
+        row = stats.setdefault(key, dict.fromkeys(STAT_FIELDS, 0))
+        row['wins' if won else 'losses'] += 1
+        row['games'] += 1
+        row['goals_for'] += goals_for
+        row['goals_against'] += goals_against
+
+    matches = Match.objects.values_list('winning_team_id', 'losing_team_id', 'winning_score', 'losing_score')
+    for winning_team_id, losing_team_id, winning_score, losing_score in matches.iterator():
+        count(team_stats, winning_team_id, True, winning_score, losing_score)
+        count(team_stats, losing_team_id, False, losing_score, winning_score)
+        for player_id in rosters[winning_team_id]:
+            count(player_stats, player_id, True, winning_score, losing_score)
+        for player_id in rosters[losing_team_id]:
+            count(player_stats, player_id, False, losing_score, winning_score)
+
+    for model, stats in ((Player, player_stats), (Team, team_stats)):
+        model.objects.update(**dict.fromkeys(STAT_FIELDS, 0))
+        model.objects.bulk_update(
+            [model(id=obj_id, **row) for obj_id, row in stats.items()],
+            STAT_FIELDS,
+            batch_size=500)
+
+    bump_ratings_version()
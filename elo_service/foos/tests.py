@@ -1,3 +1,910 @@
-from django.test import TestCase
+import json
+import math
+import os
+import random
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.utils import timezone
+
+from . import benchmarks, elo, engines, importer, metrics, tuning
+from .caching import RATINGS_VERSION_KEY, ratings_version
+from .elo import find_elo_mismatches, recalculate_all_elos, STARTING_ELO
+from .models import Match, Player, PlayerEloChange, Team, TeamEloChange
+from .ranks import RankIndex, _change_key, _Ranks
+from .stats import STAT_FIELDS, rebuild_all_stats
+
+# Keeps tests away from the shared file cache. Tests that go through cached
+# views clear it first, since cached responses would outlive the test database.
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+def _team(player1, player2):
+    team, _ = Team.objects.get_or_create_for_players(player1, player2)
+    return team
+
+
+def _play_match(winners, losers, losing_score=0):
+    match, _ = elo.record_match(winners, losers, 5, losing_score)
+    return match
+
+
+def _create_league(num_players=8, num_matches=60, seed=0):
+    rng = random.Random(seed)
+    players = [Player.objects.create(username=f'player{chr(97 + i)}') for i in range(num_players)]
+    for _ in range(num_matches):
+        wp1, wp2, lp1, lp2 = rng.sample(players, 4)
+        _play_match((wp1, wp2), (lp1, lp2), rng.randint(0, 4))
+
+    return players
+
+
+class RecalculateAllElosTests(TestCase):
+    def _elos(self):
+        return (
+            dict(Player.objects.values_list('id', 'elo')),
+            dict(Team.objects.values_list('id', 'elo'))
+        )
+
+    def test_replay_matches_incremental_updates(self):
+        _create_league()
+        expected = self._elos()
+
+        Player.objects.update(elo=1234)
+        Team.objects.update(elo=1234)
+        recalculate_all_elos()
+
+        self.assertEqual(self._elos(), expected)
+
+    def test_players_without_matches_are_reset(self):
+        _create_league()
+        idle = Player.objects.create(username='idle', elo=1500)
+
+        recalculate_all_elos()
+
+        idle.refresh_from_db()
+        self.assertEqual(idle.elo, STARTING_ELO)
+
+    def test_replay_uses_constant_queries(self):
+        _create_league(num_matches=10)
+        # Savepoint, rosters, matches, two resets, two bulk updates,
+        # two journal deletes, two journal inserts, release.
+        with self.assertNumQueries(12):
+            recalculate_all_elos()
+
+    def test_replay_keeps_journal_foreign_keys(self):
+        _create_league(num_matches=10)
+        recalculate_all_elos()
+
+        with connection.cursor() as cursor:
+            for model in (PlayerEloChange, TeamEloChange):
+                constraints = connection.introspection.get_constraints(cursor, model._meta.db_table)
+                self.assertEqual(
+                    sorted(constraint['foreign_key'][0] for constraint in constraints.values()
+                           if constraint['foreign_key']),
+                    sorted(field.related_model._meta.db_table for field in model._meta.fields
+                           if field.is_relation))
+
+    def test_replay_rewrites_journal(self):
+        _create_league(num_matches=10)
+        expected = sorted(PlayerEloChange.objects.values_list('match_id', 'player_id', 'elo_before', 'elo_after', 'timestamp'))
+        PlayerEloChange.objects.all().delete()
+        TeamEloChange.objects.all().delete()
+
+        recalculate_all_elos()
+
+        self.assertEqual(
+            sorted(PlayerEloChange.objects.values_list('match_id', 'player_id', 'elo_before', 'elo_after', 'timestamp')),
+            expected)
+        self.assertEqual(TeamEloChange.objects.count(), 20)
+
+    def test_check_reports_mismatches(self):
+        players = _create_league(num_matches=10)
+        call_command('recalculate_elos', check=True, stdout=StringIO())
+
+        Player.objects.filter(id=players[0].id).update(elo=1)
+        with self.assertRaises(CommandError):
+            call_command('recalculate_elos', check=True, stdout=StringIO())
+
+
+class DeleteLatestMatchTests(TestCase):
+    def _elos(self):
+        return (
+            dict(Player.objects.values_list('id', 'elo')),
+            dict(Team.objects.values_list('id', 'elo'))
+        )
+
+    def test_undo_restores_elos_before_latest_match(self):
+        players = _create_league(num_matches=20)
+        expected = self._elos()
+        _play_match(players[:2], players[2:4])
+
+        response = self.client.delete('/foos/delete_latest_match/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Match.objects.count(), 20)
+        self.assertEqual(self._elos()[0], expected[0])
+        recalculate_all_elos()
+        self.assertEqual(self._elos()[0], expected[0])
+
+    def test_undo_without_journal_replays(self):
+        _create_league(num_matches=20)
+        latest = Match.objects.latest('timestamp', 'id')
+        latest.player_elo_changes.all().delete()
+
+        response = self.client.delete('/foos/delete_latest_match/')
+
+        self.assertEqual(response.status_code, 200)
+        expected = self._elos()
+        recalculate_all_elos()
+        self.assertEqual(self._elos(), expected)
+
+    def test_undo_with_no_matches(self):
+        response = self.client.delete('/foos/delete_latest_match/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class StatCounterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        for username in ('alice', 'bob', 'carol', 'dave'):
+            Player.objects.create(username=username)
+
+    def _record(self, winning_team, losing_team, losing_score):
+        return self.client.post('/foos/record_match/', json.dumps({
+            'winning_team': winning_team,
+            'losing_team': losing_team,
+            'winning_score': 5,
+            'losing_score': losing_score
+        }), content_type='application/json')
+
+    def _counters(self):
+        return (
+            sorted(Player.objects.values_list('id', *STAT_FIELDS)),
+            sorted(Team.objects.values_list('id', *STAT_FIELDS))
+        )
+
+    def test_record_match_updates_counters(self):
+        self._record(['alice', 'bob'], ['carol', 'dave'], 3)
+        self._record(['alice', 'carol'], ['bob', 'dave'], 1)
+
+        response = self.client.get('/foos/player/alice/')
+        self.assertEqual(response.json(), {
+            'username': 'alice',
+            'elo': Player.objects.get(username='alice').elo,
+            'wins': 2,
+            'losses': 0,
+            'win_percentage': 100.,
+            'goals_scored': 10,
+            'goals_allowed': 4,
+            # Ranked from 3 games on
+            'rank': None,
+            'percentile': None
+        })
+
+        response = self.client.get('/foos/team/dave/bob/')
+        self.assertEqual(response.json()['losses'], 1)
+        self.assertEqual(response.json()['goals_scored'], 1)
+        self.assertEqual(response.json()['goals_allowed'], 5)
+
+    def test_undo_reverses_counters(self):
+        self._record(['alice', 'bob'], ['carol', 'dave'], 3)
+        expected = self._counters()
+        self._record(['alice', 'carol'], ['bob', 'dave'], 1)
+
+        self.client.delete('/foos/delete_latest_match/')
+
+        # The teams created by the undone match stay around with no games.
+        players, teams = self._counters()
+        self.assertEqual(players, expected[0])
+        self.assertEqual(teams[:len(expected[1])], expected[1])
+        self.assertEqual([row[1:] for row in teams[len(expected[1]):]], [(0,) * 5] * 2)
+
+    def test_rebuild_matches_incremental_counters(self):
+        self._record(['alice', 'bob'], ['carol', 'dave'], 3)
+        self._record(['alice', 'carol'], ['bob', 'dave'], 1)
+        self._record(['bob', 'dave'], ['alice', 'carol'], 4)
+        expected = self._counters()
+        Player.objects.update(wins=100, games=0)
+
+        rebuild_all_stats()
+
+        self.assertEqual(self._counters(), expected)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class LeaderboardQueryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        _create_league(num_players=12, num_matches=200)
+
+    def test_individual_boards_query_budget(self):
+        for url in ('/foos/leaderboards/50/', '/foos/loserboards/50/'):
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertEqual(len(response.json()['players']), 12)
+
+    def test_team_boards_query_budget(self):
+        for url in ('/foos/dream_teams/50/', '/foos/nightmare_teams/50/'):
+            # Teams joined with both of their players
+            with self.assertNumQueries(1):
+                response = self.client.get(url)
+            self.assertGreater(len(response.json()['teams']), 10)
+
+    def test_walking_pages_forwards_and_back(self):
+        full = [row['username'] for row in self.client.get('/foos/leaderboards/50/').json()['players']]
+
+        pages = [self.client.get('/foos/leaderboards/5/').json()]
+        self.assertIsNone(pages[0]['prev'])
+        while pages[-1]['next']:
+            with self.assertNumQueries(1):
+                pages.append(self.client.get(f'/foos/leaderboards/5/after/{pages[-1]["next"]}/').json())
+        self.assertEqual([row['username'] for page in pages for row in page['players']], full)
+        self.assertEqual([len(page['players']) for page in pages], [5, 5, 2])
+
+        back = self.client.get(f'/foos/leaderboards/5/before/{pages[-1]["prev"]}/').json()
+        self.assertEqual(back, pages[1])
+        back = self.client.get(f'/foos/leaderboards/5/before/{back["prev"]}/').json()
+        self.assertEqual(back, pages[0])
+
+    def test_team_pages_follow_elo_order(self):
+        full = self.client.get('/foos/nightmare_teams/50/').json()['teams']
+        first = self.client.get('/foos/nightmare_teams/4/').json()
+        second = self.client.get(f'/foos/nightmare_teams/4/after/{first["next"]}/').json()
+        self.assertEqual(first['teams'] + second['teams'], full[:8])
+        self.assertEqual([team['elo'] for team in full], sorted(team['elo'] for team in full))
+
+    def test_board_size_is_bounded(self):
+        for url in ('/foos/leaderboards/0/', '/foos/leaderboards/51/', '/foos/dream_teams/1000/',
+                    '/foos/leaderboards/5/after/nope/'):
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_boards_match_recomputed_stats(self):
+        players = self.client.get('/foos/leaderboards/50/').json()['players']
+        for row in players:
+            player = Player.objects.get(username=row['username'])
+            wins = Match.objects.filter(winning_team__players=player)
+            losses = Match.objects.filter(losing_team__players=player)
+            self.assertEqual(row['wins'], wins.count())
+            self.assertEqual(row['losses'], losses.count())
+            self.assertEqual(
+                row['goals_scored'],
+                sum(m.winning_score for m in wins) + sum(m.losing_score for m in losses))
+            self.assertEqual(
+                row['goals_allowed'],
+                sum(m.losing_score for m in wins) + sum(m.winning_score for m in losses))
+
+
+# Writes only invalidate the cache once they commit, which TestCase never does
+@override_settings(CACHES=TEST_CACHES)
+class CachedViewTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.players = _create_league(num_players=6, num_matches=20)
+
+    def _elo(self, username):
+        return self.client.get(f'/foos/player/{username}/').json()['elo']
+
+    def test_boards_are_served_from_cache_until_a_match_is_recorded(self):
+        with self.assertNumQueries(1):
+            board = self.client.get('/foos/leaderboards/10/').json()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/foos/leaderboards/10/').json(), board)
+
+        _play_match(self.players[:2], self.players[2:4])
+
+        board = self.client.get('/foos/leaderboards/10/').json()
+        self.assertEqual({row['username']: row['elo'] for row in board['players']},
+                         dict(Player.objects.filter(games__gte=3).values_list('username', 'elo')))
+
+    def test_undo_and_replay_invalidate(self):
+        username = self.players[0].username
+        self._elo(username)
+
+        elo.delete_latest_match()
+        self.assertEqual(self._elo(username), Player.objects.get(username=username).elo)
+
+        # Writes that skip foos.elo aren't seen until the next ratings change
+        Player.objects.filter(username=username).update(elo=1)
+        self.assertNotEqual(self._elo(username), 1)
+
+        recalculate_all_elos()
+        self.assertEqual(self._elo(username), Player.objects.get(username=username).elo)
+        self.assertNotEqual(self._elo(username), 1)
+
+
+class RankIndexTests(TestCase):
+    def test_ties_share_a_rank(self):
+        index = RankIndex([1000, 1100, 1100, 900])
+        self.assertEqual([index.rank(elo) for elo in (1100, 1000, 900)], [1, 3, 4])
+        self.assertEqual(index.percentile(1100), 100)
+        self.assertEqual(index.percentile(900), 25)
+
+        index.remove(1100)
+        index.add(950)
+        self.assertEqual([index.rank(elo) for elo in (1100, 1000, 950, 900)], [1, 2, 3, 4])
+
+
+# The index is kept up to date as writes commit, which TestCase never does
+@override_settings(CACHES=TEST_CACHES)
+class PlayerRankTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.players = _create_league(num_players=8, num_matches=12)
+
+    def _assert_ranks_match_table(self):
+        ranked = list(Player.objects.filter(games__gte=3).values_list('elo', flat=True))
+        for player in Player.objects.all():
+            data = self.client.get(f'/foos/player/{player.username}/').json()
+            if player.games < 3:
+                self.assertIsNone(data['rank'])
+                continue
+            self.assertEqual(data['rank'], 1 + sum(elo > player.elo for elo in ranked))
+            self.assertEqual(data['percentile'], sum(elo <= player.elo for elo in ranked) / len(ranked) * 100)
+
+    def test_ranks_follow_recorded_matches_without_rebuilding(self):
+        self._assert_ranks_match_table()
+
+        _play_match(self.players[:2], self.players[2:4])
+        # Only the player is read; the index was moved along by the match itself
+        with self.assertNumQueries(1):
+            self.client.get(f'/foos/player/{self.players[0].username}/')
+        self._assert_ranks_match_table()
+
+        elo.delete_latest_match()
+        self._assert_ranks_match_table()
+
+    def _assert_process_ranks_match_table(self, process_ranks):
+        ranked = sorted(Player.objects.filter(games__gte=3).values_list('elo', flat=True))
+        for player in Player.objects.filter(games__gte=3):
+            self.assertEqual(process_ranks.player_rank(player)[0], 1 + sum(elo > player.elo for elo in ranked))
+
+    def test_other_processes_apply_recorded_matches_without_rebuilding(self):
+        other = _Ranks()
+        self._assert_process_ranks_match_table(other)
+
+        for i in range(3):
+            _play_match(self.players[i:i + 2], self.players[4:6])
+        players = list(Player.objects.filter(games__gte=3))
+        with self.assertNumQueries(0):
+            for player in players:
+                other.player_rank(player)
+        self._assert_process_ranks_match_table(other)
+
+    def test_missed_changes_are_rebuilt(self):
+        other = _Ranks()
+        self._assert_process_ranks_match_table(other)
+        version = other.version
+
+        _play_match(self.players[:2], self.players[2:4])
+        next_version, *_ = cache.get(_change_key(version, 0))
+        _play_match(self.players[:2], self.players[2:4])
+        # As if the second match had raced the first and replaced its change
+        cache.set(_change_key(version, 0), cache.get(_change_key(next_version, 0)))
+
+        self._assert_process_ranks_match_table(other)
+
+    def test_concurrent_matches_are_both_applied(self):
+        other = _Ranks()
+        self._assert_process_ranks_match_table(other)
+        version = ratings_version()
+
+        _play_match(self.players[:2], self.players[2:4])
+        caught_up = _Ranks()
+        self._assert_process_ranks_match_table(caught_up)
+        # As if the second match had read the version before the first one
+        # stored its own, so both replace the same version
+        cache.set(RATINGS_VERSION_KEY, version, None)
+        _play_match(self.players[4:6], self.players[6:8])
+
+        players = list(Player.objects.filter(games__gte=3))
+        with self.assertNumQueries(0):
+            for player in players:
+                other.player_rank(player)
+        self._assert_process_ranks_match_table(other)
+        # Having applied only the first, this one can't follow on and rebuilds
+        self._assert_process_ranks_match_table(caught_up)
+
+        _play_match(self.players[:2], self.players[4:6])
+        players = list(Player.objects.filter(games__gte=3))
+        with self.assertNumQueries(0):
+            for player in players:
+                other.player_rank(player)
+        self._assert_process_ranks_match_table(other)
+
+    def test_team_rank(self):
+        winners = [Player.objects.create(username=username) for username in ('alice', 'bob')]
+        losers = self.players[:2]
+        _play_match(winners, losers)
+        data = self.client.get('/foos/team/alice/bob/').json()
+        self.assertIsNone(data['rank'])
+
+        for _ in range(2):
+            _play_match(winners, losers)
+        team = _team(*winners)
+        ranked = list(Team.objects.filter(wins__gte=3).values_list('elo', flat=True))
+
+        data = self.client.get('/foos/team/alice/bob/').json()
+        self.assertEqual(data['rank'], 1 + sum(elo > team.elo for elo in ranked))
+
+
+@override_settings(CACHES=TEST_CACHES)
+class TeamResolutionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = Player.objects.create(username='alice')
+        self.bob = Player.objects.create(username='bob')
+
+    def test_get_or_create_is_order_independent(self):
+        team, created = Team.objects.get_or_create_for_players(self.bob, self.alice)
+        self.assertTrue(created)
+        self.assertEqual(set(team.players.all()), {self.alice, self.bob})
+
+        same_team, created = Team.objects.get_or_create_for_players(self.alice, self.bob)
+        self.assertFalse(created)
+        self.assertEqual(same_team, team)
+        self.assertEqual(Team.objects.for_players(self.bob, self.alice), team)
+
+    def test_get_team_lookup_is_single_query(self):
+        team = _team(self.alice, self.bob)
+        with self.assertNumQueries(1):
+            self.assertEqual(Team.objects.for_players(self.alice, self.bob), team)
+
+    def test_get_team_not_found(self):
+        response = self.client.get('/foos/team/alice/bob/')
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+@skipUnlessDBFeature('has_select_for_update')
+class ConcurrentRecordMatchTests(TransactionTestCase):
+    def _report(self, usernames, losing_score):
+        try:
+            return self.client.post('/foos/record_match/', json.dumps({
+                'winning_team': usernames[:2],
+                'losing_team': usernames[2:],
+                'winning_score': 5,
+                'losing_score': losing_score
+            }), content_type='application/json').status_code
+        finally:
+            connection.close()
+
+    def test_parallel_reports_match_serial_replay(self):
+        usernames = ['alice', 'bob', 'carol', 'dave', 'erin', 'frank']
+        for username in usernames:
+            Player.objects.create(username=username)
+
+        rng = random.Random(0)
+        reports = [(rng.sample(usernames, 4), rng.randint(0, 4)) for _ in range(60)]
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            statuses = list(executor.map(lambda report: self._report(*report), reports))
+
+        self.assertEqual(statuses, [200] * len(reports))
+        self.assertEqual(Match.objects.count(), len(reports))
+        self.assertEqual(find_elo_mismatches(), [])
+
+        counters = sorted(Player.objects.values_list('id', *STAT_FIELDS))
+        rebuild_all_stats()
+        self.assertEqual(sorted(Player.objects.values_list('id', *STAT_FIELDS)), counters)
+
+
+class ImportMatchesTests(TestCase):
+    def setUp(self):
+        for username in ('alice', 'bob', 'carol', 'dave'):
+            Player.objects.create(username=username)
+
+    def _import(self, body, format='jsonl'):
+        return self.client.post(f'/foos/import_matches/?format={format}', body, content_type='text/plain')
+
+    def test_import_jsonl_slots_matches_into_history(self):
+        _play_match(Player.objects.filter(username__in=['alice', 'bob']),
+                    Player.objects.filter(username__in=['carol', 'dave']), 2)
+        body = '\n'.join(json.dumps({
+            'timestamp': f'2019-04-{day:02}T12:00:00',
+            'winning_team': ['carol', 'bob'],
+            'losing_team': ['alice', 'dave'],
+            'winning_score': 5,
+            'losing_score': day % 5
+        }) for day in range(1, 11))
+
+        response = self._import(body)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'imported': 10})
+        self.assertEqual(Match.objects.count(), 11)
+        self.assertEqual(Team.objects.count(), 4)
+        self.assertEqual(find_elo_mismatches(), [])
+        self.assertEqual(Player.objects.get(username='carol').wins, 10)
+        self.assertEqual(Player.objects.get(username='carol').losses, 1)
+        # The match recorded live is still the latest one
+        self.assertEqual(Match.objects.latest('timestamp', 'id').losing_score, 2)
+
+    def test_import_csv_command(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv') as f:
+            f.write('timestamp,winning_player_1,winning_player_2,losing_player_1,losing_player_2,'
+                    'winning_score,losing_score\n')
+            f.write('2019-04-01 12:00:00,alice,bob,carol,dave,5,3\n')
+            f.write('2019-04-02 12:00:00,dave,bob,carol,alice,5,0\n')
+            f.flush()
+            call_command('import_matches', f.name, stdout=StringIO())
+
+        self.assertEqual(Match.objects.count(), 2)
+        self.assertEqual(Player.objects.get(username='bob').wins, 2)
+
+    def test_invalid_matches_import_nothing(self):
+        body = '\n'.join([
+            json.dumps({'timestamp': '2019-04-01T12:00:00', 'winning_team': ['alice', 'bob'],
+                        'losing_team': ['carol', 'dave'], 'winning_score': 5, 'losing_score': 3}),
+            json.dumps({'timestamp': 'yesterday', 'winning_team': ['alice', 'bob'],
+                        'losing_team': ['carol', 'dave'], 'winning_score': 5, 'losing_score': 3}),
+            json.dumps({'timestamp': '2019-04-01T12:00:00', 'winning_team': ['alice', 'bob'],
+                        'losing_team': ['alice', 'dave'], 'winning_score': 5, 'losing_score': 3}),
+            '{not json',
+            json.dumps({'timestamp': '2019-04-01T12:00:00', 'winning_team': ['alice', 'erin'],
+                        'losing_team': ['carol', 'dave'], 'winning_score': 5, 'losing_score': 3}),
+        ])
+
+        response = self._import(body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 3)
+        self.assertEqual(Match.objects.count(), 0)
+
+        response = self._import(body.split('\n')[-1])
+        self.assertEqual(response.json(), {'errors': ['Player erin does not exist']})
+        self.assertEqual(Match.objects.count(), 0)
+
+    def test_future_matches_are_rejected(self):
+        _play_match(Player.objects.filter(username__in=['alice', 'bob']),
+                    Player.objects.filter(username__in=['carol', 'dave']), 2)
+        tomorrow = timezone.now() + timedelta(days=1)
+        body = json.dumps({'timestamp': tomorrow.isoformat(), 'winning_team': ['carol', 'dave'],
+                           'losing_team': ['alice', 'bob'], 'winning_score': 5, 'losing_score': 0})
+
+        response = self._import(body)
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(len(response.json()['errors']), 1)
+        self.assertIn('in the future', response.json()['errors'][0])
+        self.assertEqual(Match.objects.count(), 1)
+
+    @override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=1000)
+    def test_import_larger_than_upload_limit(self):
+        body = '\n'.join(json.dumps({
+            'timestamp': f'2019-04-01T12:{minute:02}:00',
+            'winning_team': ['alice', 'bob'],
+            'losing_team': ['carol', 'dave'],
+            'winning_score': 5,
+            'losing_score': minute % 5
+        }) for minute in range(50))
+        self.assertGreater(len(body), 1000)
+
+        response = self._import(body)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json(), {'imported': 50})
+
+    def test_import_must_be_utf8(self):
+        response = self.client.post('/foos/import_matches/', b'\xff\xfe', content_type='text/plain')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Match.objects.count(), 0)
+
+
+class PlayerHistoryTests(TestCase):
+    def setUp(self):
+        self.players = _create_league(num_players=4, num_matches=30)
+        self.player = self.players[0]
+        self.player.refresh_from_db()
+
+    def _history(self, points=None):
+        url = f'/foos/player/{self.player.username}/history/'
+        response = self.client.get(url if points is None else f'{url}?points={points}')
+        self.assertEqual(response.status_code, 200)
+        return [point['elo'] for point in response.json()['history']]
+
+    def test_full_history(self):
+        expected = list(self.player.elo_changes.order_by('match__timestamp', 'match_id')
+                                               .values_list('elo_after', flat=True))
+        self.assertEqual(len(expected), self.player.games)
+        with self.assertNumQueries(2):
+            self.assertEqual(self._history(), expected)
+
+    def test_downsampled_history_ends_at_current_elo(self):
+        history = self._history(points=7)
+        self.assertEqual(len(history), 7)
+        self.assertEqual(history[-1], self.player.elo)
+
+    def test_history_follows_undo_and_replay(self):
+        before = self._history()
+        teammate, opponent1, opponent2 = self.players[1:4]
+        _play_match((self.player, teammate), (opponent1, opponent2))
+        self.assertEqual(len(self._history()), len(before) + 1)
+
+        elo.delete_latest_match()
+        self.assertEqual(self._history(), before)
+
+        recalculate_all_elos()
+        self.assertEqual(self._history(), before)
+
+    def test_bad_points(self):
+        for points in ('0', 'lots', '100000'):
+            response = self.client.get(f'/foos/player/{self.player.username}/history/?points={points}')
+            self.assertEqual(response.status_code, 400)
+
+
+class ExportMatchesTests(TestCase):
+    def setUp(self):
+        _create_league(num_players=6, num_matches=20)
+
+    def _stream(self, path):
+        # Through the ASGI handler, which is how the async export is served
+        async def get():
+            response = await self.async_client.get(path)
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.streaming)
+            return b''.join([chunk async for chunk in response.streaming_content])
+        return async_to_sync(get)()
+
+    def test_jsonl_export_has_elos_after_each_match(self):
+        rows = [json.loads(line) for line in self._stream('/foos/export_matches/').decode().splitlines()]
+        self.assertEqual([row['match_id'] for row in rows],
+                         list(Match.objects.order_by('timestamp', 'id').values_list('id', flat=True)))
+
+        # Everyone's elo after the last match they played is their current elo
+        latest_elos = {}
+        for row in rows:
+            for usernames, elos in ((row['winning_team'], row['winning_team_elos']),
+                                    (row['losing_team'], row['losing_team_elos'])):
+                latest_elos.update(zip(usernames, elos))
+        self.assertEqual(latest_elos, {
+            player.username: player.elo for player in Player.objects.filter(username__in=latest_elos)
+        })
+
+    def test_csv_export_can_be_imported(self):
+        out = StringIO()
+        call_command('export_matches', '--format', 'csv', '--chunk-size', '7', stdout=out)
+        elos = dict(Player.objects.values_list('username', 'elo'))
+
+        Match.objects.all().delete()
+        recalculate_all_elos()
+        matches = importer.parse_matches(StringIO(out.getvalue()), 'csv')
+        importer.import_matches(matches)
+
+        self.assertEqual(Match.objects.count(), 20)
+        self.assertEqual(dict(Player.objects.values_list('username', 'elo')), elos)
+
+    def test_unknown_format(self):
+        response = self.client.get('/foos/export_matches/?format=xml')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class BenchmarkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_generated_matches_are_valid_and_skewed(self):
+        usernames = [f'player{letter}' for letter in 'abcdefghijklmnopqrst']
+        matches = benchmarks.generate_matches(usernames, 500, seed=1, skew=1.5)
+        # Only the timestamps, which end at the current time, change between runs
+        self.assertEqual([match[1:] for match in matches],
+                         [match[1:] for match in benchmarks.generate_matches(usernames, 500, seed=1, skew=1.5)])
+
+        games = dict.fromkeys(usernames, 0)
+        for _, winning_usernames, losing_usernames, winning_score, losing_score in matches:
+            self.assertIsNone(elo.validate_match(winning_usernames, losing_usernames, winning_score, losing_score))
+            for username in winning_usernames + losing_usernames:
+                games[username] += 1
+        # The regulars play far more than the occasional players
+        self.assertGreater(max(games.values()), 5 * min(games.values()))
+
+    def test_run_benchmarks_leaves_the_league_as_it_was(self):
+        usernames = benchmarks.create_league(8, 40)
+        elos = dict(Player.objects.values_list('username', 'elo'))
+
+        results = benchmarks.run_benchmarks(usernames, iterations=2, recalculations=1)
+
+        self.assertEqual(results['record_match']['count'], 2)
+        self.assertEqual(results['leaderboards']['queries_max'], 1)
+        self.assertEqual(Match.objects.count(), 40)
+        self.assertEqual(dict(Player.objects.values_list('username', 'elo')), elos)
+
+
+@override_settings(CACHES=TEST_CACHES, METRICS_DIR=None)
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.players = _create_league(num_players=6, num_matches=20)
+
+    def test_server_timing_counts_queries(self):
+        response = self.client.get(f'/foos/team/{self.players[0].username}/{self.players[1].username}/')
+        timings = dict(part.strip().split(';', 1) for part in response['Server-Timing'].split(','))
+        # Both players are looked up with the same SQL
+        self.assertIn('desc="3 queries (1 duplicates)"', timings['db'])
+
+    def test_metrics_endpoint(self):
+        self.client.get('/foos/leaderboards/10/')
+        self.client.get('/foos/player/nobody/')
+
+        response = self.client.get('/foos/metrics/')
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+        lines = response.content.decode().splitlines()
+        self.assertIn('# TYPE foos_request_duration_seconds histogram', lines)
+        self.assertTrue(any(line.startswith('foos_requests_total{view="get_player",method="GET",status="404"} ')
+                            for line in lines))
+        self.assertTrue(any(line.startswith('foos_request_queries_total{view="leaderboards"} ') for line in lines))
+
+    def test_metrics_add_up_every_process(self):
+        with tempfile.TemporaryDirectory() as directory, self.settings(METRICS_DIR=directory):
+            self.client.get('/foos/leaderboards/10/')
+            metrics.metrics.write_snapshot()
+            own = self.client.get('/foos/metrics/').content.decode()
+
+            # Another worker's snapshot, which is just like ours
+            with open(os.path.join(directory, 'other.json'), 'w') as f:
+                json.dump(metrics.metrics.snapshot(), f)
+            both = self.client.get('/foos/metrics/').content.decode()
+            # Rather than once the directory is gone
+            metrics.metrics.write_snapshot()
+
+        def leaderboard_requests(content):
+            line = next(line for line in content.splitlines()
+                        if line.startswith('foos_request_duration_seconds_count{view="leaderboards"}'))
+            return int(line.split()[-1])
+        self.assertEqual(leaderboard_requests(both), 2 * leaderboard_requests(own))
+
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with self.settings(SLOW_REQUEST_SECONDS=0), self.assertLogs('foos.metrics', 'WARNING') as logs:
+            self.client.get('/foos/loserboards/10/')
+        self.assertIn('Slow request: GET /foos/loserboards/10/', logs.output[0])
+        self.assertIn('SELECT', logs.output[0])
+
+
+class BenchmarkSummaryTests(SimpleTestCase):
+    def test_nearest_rank_percentiles(self):
+        summary = benchmarks.summarize([i / 1000 for i in range(100, 0, -1)])
+        self.assertEqual(summary['count'], 100)
+        self.assertAlmostEqual(summary['mean_ms'], 50.5)
+        self.assertAlmostEqual(summary['p50_ms'], 50)
+        self.assertAlmostEqual(summary['p95_ms'], 95)
+        self.assertAlmostEqual(summary['p99_ms'], 99)
+        self.assertAlmostEqual(summary['max_ms'], 100)
+
+
+class RatingEngineTests(TestCase):
+    def test_elo_engine_replays_the_stored_elos(self):
+        _create_league()
+
+        history = elo.load_history()
+        state, _ = elo.ENGINE.replay(history)
+        player_elos, team_elos = elo.ENGINE.ratings(state)
+
+        self.assertEqual(dict(zip(history.player_keys, player_elos)),
+                         dict(Player.objects.filter(id__in=history.player_keys).values_list('id', 'elo')))
+        self.assertEqual(dict(zip(history.team_keys, team_elos)), dict(Team.objects.values_list('id', 'elo')))
+
+    def test_incomplete_engines_cannot_be_created(self):
+        class NoRatings(engines.RatingEngine):
+            def new_state(self, num_players, num_teams):
+                return {}
+
+        with self.assertRaises(TypeError):
+            NoRatings()
+
+    def test_glicko2_update_matches_the_paper(self):
+        # The example from http://www.glicko.net/glicko/glicko2.pdf
+        scale = engines.GLICKO2_SCALE
+        opponents = [((1400 - 1500) / scale, 30 / scale, 1),
+                     ((1550 - 1500) / scale, 100 / scale, 0),
+                     ((1700 - 1500) / scale, 300 / scale, 0)]
+        mu, phi, sigma = engines.glicko2_update(0, 200 / scale, 0.06, opponents, tau=0.5)
+        self.assertAlmostEqual(1500 + mu * scale, 1464.06, places=1)
+        self.assertAlmostEqual(phi * scale, 151.52, places=1)
+        self.assertAlmostEqual(sigma, 0.06, places=4)
+
+    def test_engines_predict_winners(self):
+        history = benchmarks.generated_history(20, 1500, seed=1)
+        for name, engine in engines.ENGINES.items():
+            with self.subTest(engine=name):
+                state, predictions = engine().replay(history)
+                scores = engines.evaluate(predictions)
+                self.assertLess(scores['log_loss'], math.log(2))
+                self.assertGreater(scores['accuracy'], 0.6)
+                player_ratings, team_ratings = engine().ratings(state)
+                self.assertEqual((len(player_ratings), len(team_ratings)),
+                                 (len(history.player_keys), len(history.team_keys)))
+
+
+class TuneRatingsTests(TestCase):
+    def test_tune_elo_scores_every_configuration_without_writing(self):
+        _create_league()
+        elos = dict(Player.objects.values_list('id', 'elo'))
+        history = elo.load_history()
+
+        results = tuning.tune_elo(history, [16, elo.K], [elo.RPA, 800], workers=2)
+
+        self.assertEqual(len(results), 4)
+        log_losses = [scores['log_loss'] for _, _, scores in results]
+        self.assertEqual(log_losses, sorted(log_losses))
+        _, predictions = elo.ENGINE.replay(history)
+        self.assertIn((elo.K, elo.RPA, engines.evaluate(predictions)), results)
+        self.assertEqual(dict(Player.objects.values_list('id', 'elo')), elos)
+
+        out = StringIO()
+        call_command('tune_ratings', '--k', '32', '--rpa', '400', '--workers', '1', stdout=out)
+        self.assertIn('(current, #1)', out.getvalue())
+
+
+class MigrationTests(TransactionTestCase):
+    def _migrate(self, target):
+        """
+        Migrates foos to target, or its latest migration if None, and returns
+        the historical models at that point.
+        """
+        executor = MigrationExecutor(connection)
+        targets = [('foos', target)] if target else executor.loader.graph.leaf_nodes('foos')
+        executor.migrate(targets)
+        executor.loader.build_graph()
+        return executor.loader.project_state(targets).apps
+
+    def tearDown(self):
+        self._migrate(None)
+
+    def test_duplicate_usernames_are_merged(self):
+        apps = self._migrate('0004_stat_counters')
+        Player = apps.get_model('foos', 'Player')
+        Team = apps.get_model('foos', 'Team')
+        alice = Player.objects.create(username='alice', wins=2, games=2)
+        bob = Player.objects.create(username='bob')
+        carol = Player.objects.create(username='carol')
+        alice_again = Player.objects.create(username='alice', wins=1, games=3)
+        Team.objects.create().players.add(alice, bob)
+        team = Team.objects.create()
+        team.players.add(alice_again, carol)
+
+        apps = self._migrate('0005_indexes_and_team_players')
+        Player = apps.get_model('foos', 'Player')
+        alice = Player.objects.get(username='alice')
+        self.assertEqual((alice.id, alice.wins, alice.games), (alice.id, 3, 5))
+        self.assertEqual(Player.objects.count(), 3)
+        self.assertEqual(set(team.players.through.objects.filter(team_id=team.id).values_list('player_id', flat=True)),
+                         {alice.id, carol.id})
+
+    def test_teams_missing_players(self):
+        apps = self._migrate('0005_indexes_and_team_players')
+        Player = apps.get_model('foos', 'Player')
+        Team = apps.get_model('foos', 'Team')
+        Match = apps.get_model('foos', 'Match')
+        alice = Player.objects.create(username='alice')
+        bob = Player.objects.create(username='bob')
+        Team.objects.create().players.add(alice, bob)
+        # Never played, so it can just go
+        Team.objects.create().players.add(alice)
+        Team.objects.create()
+
+        apps = self._migrate('0006_populate_team_players')
+        Team = apps.get_model('foos', 'Team')
+        self.assertEqual(list(Team.objects.values_list('player_low_id', 'player_high_id')), [(alice.id, bob.id)])
+
+        apps = self._migrate('0005_indexes_and_team_players')
+        Team = apps.get_model('foos', 'Team')
+        Match = apps.get_model('foos', 'Match')
+        complete = Team.objects.get()
+        incomplete = Team.objects.create()
+        incomplete.players.add(bob.id)
+        Match.objects.create(winning_team=complete, losing_team=incomplete, winning_score=5, losing_score=0)
+
+        with self.assertRaisesMessage(RuntimeError, f'Team {incomplete.id} has played matches'):
+            self._migrate('0006_populate_team_players')
+        Match.objects.all().delete()
@@ -0,0 +1,35 @@
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+from foos.engines import EloEngine, evaluate
+
+# The history each pool worker replays, sent to it once when it starts
+# rather than with every configuration
+_history = None
+
+
+def _start_worker(history):
+    global _history
+    _history = history
+
+
+def _score(parameters):
+    k, rpa = parameters
+    _, predictions = EloEngine(k=k, rpa=rpa).replay(_history)
+    return evaluate(predictions)
+
+
+def tune_elo(history, ks, rpas, workers=None):
+    """
+    Replays history with EloEngine for every combination of ks and rpas,
+    spread over a pool of workers processes (as many as there are CPUs by
+    default). Nothing is read or written besides history.
+
+    Returns [(k, rpa, scores)] with the scores of each (see
+    engines.evaluate), lowest log loss first.
+    """
+    grid = list(product(ks, rpas))
+    with ProcessPoolExecutor(workers, initializer=_start_worker, initargs=(history,)) as pool:
+        scores = list(pool.map(_score, grid))
+    return sorted(((k, rpa, result) for (k, rpa), result in zip(grid, scores)),
+                  key=lambda config: config[2]['log_loss'])
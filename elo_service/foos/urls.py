@@ -1,15 +1,27 @@
-from django.urls import path
+from django.urls import path, register_converter
 
-from . import views
+from . import converters, views
+
+register_converter(converters.BoardSizeConverter, 'board_size')
+register_converter(converters.DirectionConverter, 'direction')
+register_converter(converters.BoardCursorConverter, 'board_cursor')
 
 urlpatterns = [
     path('player/', views.create_player),
     path('player/<username>/', views.get_player),
+    path('player/<username>/history/', views.player_history),
     path('team/<username1>/<username2>/', views.get_team),
     path('record_match/', views.record_match),
     path('delete_latest_match/', views.delete_latest_match),
-    path('leaderboards/<num>/', views.leaderboards),
-    path('loserboards/<num>/', views.loserboards),
-    path('dream_teams/<num>/', views.dream_teams),
-    path('nightmare_teams/<num>/', views.nightmare_teams),
+    path('import_matches/', views.import_matches),
+    path('export_matches/', views.export_matches),
+    path('metrics/', views.request_metrics),
+    path('leaderboards/<board_size:num>/', views.leaderboards),
+    path('leaderboards/<board_size:num>/<direction:direction>/<board_cursor:cursor>/', views.leaderboards),
+    path('loserboards/<board_size:num>/', views.loserboards),
+    path('loserboards/<board_size:num>/<direction:direction>/<board_cursor:cursor>/', views.loserboards),
+    path('dream_teams/<board_size:num>/', views.dream_teams),
+    path('dream_teams/<board_size:num>/<direction:direction>/<board_cursor:cursor>/', views.dream_teams),
+    path('nightmare_teams/<board_size:num>/', views.nightmare_teams),
+    path('nightmare_teams/<board_size:num>/<direction:direction>/<board_cursor:cursor>/', views.nightmare_teams),
 ]
@@ -1,38 +1,31 @@
+import codecs
 import json
 
-from django.db import transaction
-from django.db.models import (
-    Case,
-    Count,
-    DecimalField,
-    ExpressionWrapper,
-    F,
-    Sum,
-    When
-)
+from asgiref.sync import sync_to_async
+from django.db.models import Q
 from django.forms.models import model_to_dict
 from django.http import (
+    HttpResponse,
     HttpResponseBadRequest,
     HttpResponseNotAllowed,
     HttpResponseNotFound,
     HttpResponseServerError,
-    JsonResponse
+    JsonResponse,
+    StreamingHttpResponse
 )
-from django.shortcuts import get_object_or_404
+from django.shortcuts import aget_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 
-from .elo import (
-    recalculate_all_elos,
-    update_player_elos,
-    update_team_elos,
-    STARTING_ELO
-)
+from . import elo, export, importer, metrics
+from .caching import cached_view
+from .elo import STARTING_ELO
 from .models import Match, Player, Team
+from .ranks import ranks
 
 
 
 @csrf_exempt
-def create_player(request):
+async def create_player(request):
     if request.method != 'POST':
         return HttpResponseNotAllowed(['POST'])
 
@@ -47,11 +40,11 @@ def create_player(request):
     except ValueError as e:
         return HttpResponseBadRequest('Username must be a string.')
 
-    if Player.objects.filter(username=username).exists():
+    if await Player.objects.filter(username=username).aexists():
         return HttpResponseBadRequest('A player with that username already exists')
 
     try:
-        Player.objects.create(
+        await Player.objects.acreate(
             username=username,
             elo=STARTING_ELO
         )
@@ -65,7 +58,8 @@ def create_player(request):
     }, status=201)
 
 
-def get_player(request, username):
+@cached_view
+async def get_player(request, username):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
@@ -75,78 +69,85 @@ def get_player(request, username):
     if not username.isalpha():
         return HttpResponseBadRequest('Username must be alphabetical.')
 
-    player = get_object_or_404(Player, username=username)
+    player = await aget_object_or_404(Player, username=username)
+    rank, percentile = await sync_to_async(ranks.player_rank)(player)
 
-    wins = Match.objects.filter(winning_team__players=player)
-    losses = Match.objects.filter(losing_team__players=player)
+    return JsonResponse({
+        **_player_stats(player),
+        'rank': rank,
+        'percentile': percentile
+    })
 
-    total_games = wins.count() + losses.count()
 
-    if wins.count() == 0:
-        win_percentage = 0.
-    elif total_games:
-        win_percentage = wins.count() / total_games * 100
-    else:
-        win_percentage = None
+HISTORY_POINTS = 100
+MAX_HISTORY_POINTS = 1000
+
+
+async def player_history(request, username):
+    """
+    Returns the player's elo after each of their matches, oldest first,
+    downsampled to at most ?points= entries (default HISTORY_POINTS).
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    if not username.isalpha():
+        return HttpResponseBadRequest('Username must be alphabetical.')
+
+    try:
+        points = int(request.GET.get('points', HISTORY_POINTS))
+    except ValueError:
+        return HttpResponseBadRequest('Points must be a number')
+    if not 1 <= points <= MAX_HISTORY_POINTS:
+        return HttpResponseBadRequest(f'Points must be between 1 and {MAX_HISTORY_POINTS}')
 
-    goals_scored = sum([match.winning_score for match in wins] + [match.losing_score for match in losses])
-    goals_allowed = sum([match.losing_score for match in wins] + [match.winning_score for match in losses])
+    player = await aget_object_or_404(Player, username=username)
+    history = await sync_to_async(elo.rating_history)(player, points)
 
     return JsonResponse({
         'username': player.username,
         'elo': player.elo,
-        'wins': wins.count(),
-        'losses': losses.count(),
-        'win_percentage': win_percentage,
-        'goals_scored': goals_scored,
-        'goals_allowed': goals_allowed
+        'games': player.games,
+        'history': [
+            {'timestamp': timestamp.isoformat(), 'elo': elo_after}
+            for timestamp, elo_after in history
+        ]
     })
 
 
-def get_team(request, username1, username2):
+@cached_view
+async def get_team(request, username1, username2):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
     if not username1.isalpha() or not username2.isalpha():
         return HttpResponseBadRequest('Both usernames must be alphabetical')
 
-    player1 = get_object_or_404(Player, username=username1)
-    player2 = get_object_or_404(Player, username=username2)
-
-    teams = (Team.objects
-                .annotate(count=Count('players'))
-                .filter(count=2)
-                .filter(players=player1)
-                .filter(players=player2))
+    player1 = await aget_object_or_404(Player, username=username1)
+    player2 = await aget_object_or_404(Player, username=username2)
 
-    if not teams.exists():
+    try:
+        team = await sync_to_async(Team.objects.for_players)(player1, player2)
+    except Team.DoesNotExist:
         return HttpResponseNotFound('Team with those players was not found.')
-    elif teams.count() > 1:
-        return HttpResponseServerError(
-            'Oh no! Multiple teams with only those players was found. Nikhil\'s code sux.')
-
-    team = teams[0]
-
-    wins = Match.objects.filter(winning_team=team)
-    losses = Match.objects.filter(losing_team=team)
 
-    goals_scored = sum([match.winning_score for match in wins] + [match.losing_score for match in losses])
-    goals_allowed = sum([match.losing_score for match in wins] + [match.winning_score for match in losses])
-
-    win_percentage = wins.count() / (wins.count() + losses.count()) * 100
+    win_percentage = team.wins / team.games * 100 if team.games else 0.
+    rank, percentile = await sync_to_async(ranks.team_rank)(team)
 
     return JsonResponse({
-        'wins': wins.count(),
-        'losses': losses.count(),
+        'wins': team.wins,
+        'losses': team.losses,
         'win_percentage': win_percentage,
-        'goals_scored': goals_scored,
-        'goals_allowed': goals_allowed,
-        'elo': team.elo
+        'goals_scored': team.goals_for,
+        'goals_allowed': team.goals_against,
+        'elo': team.elo,
+        'rank': rank,
+        'percentile': percentile
     })
 
 
 @csrf_exempt
-def record_match(request):
+async def record_match(request):
     """
     This endpoint takes in application/json
     rather than form encoded because it takes a list of usernames
@@ -178,223 +179,233 @@ def record_match(request):
     except ValueError as e:
         return HttpResponseBadRequest(str(e))
 
-    if winning_score != 5:
-            return HttpResponseBadRequest('Winning score must be 5')
-    elif winning_score <= losing_score:
-        return HttpResponseBadRequest(
-            f'Winning score {winning_score} must be greater than losing score {losing_score}')
-    elif losing_score < 0:
-        return HttpResponseBadRequest(
-            f'Losing score must be >= 0')
-    elif len(winning_team_usernames) != 2 or len(losing_team_usernames) != 2:
-        return HttpResponseBadRequest(
-            f'Teams must be 2 people each. Provided: {winning_team_usernames} and {losing_team_usernames}')
-
-    common_players = [player for player in winning_team_usernames if player in losing_team_usernames]
-    if len(common_players) > 0:
-        return HttpResponseBadRequest('Winning and losing teams cannot share players')
-
-    if (winning_team_usernames[0] == winning_team_usernames[1]
-            or losing_team_usernames[0] == losing_team_usernames[1]):
-        return HttpResponseBadRequest('Teams cannot have the same person twice.')
-
-    winning_player_1 = get_object_or_404(Player, username=winning_team_usernames[0])
-    winning_player_2 = get_object_or_404(Player, username=winning_team_usernames[1])
-    losing_player_1 = get_object_or_404(Player, username=losing_team_usernames[0])
-    losing_player_2 = get_object_or_404(Player, username=losing_team_usernames[1])
-
-    winning_team_qs = (Team.objects
-                        .annotate(count=Count('players'))
-                        .filter(count=2)
-                        .filter(players=winning_player_1)
-                        .filter(players=winning_player_2))
-
-    losing_team_qs = (Team.objects
-                        .annotate(count=Count('players'))
-                        .filter(count=2)
-                        .filter(players=losing_player_1)
-                        .filter(players=losing_player_2))
-
-    # Create teams if they don't exist already
-    if not winning_team_qs:
-        winning_team = Team(elo=STARTING_ELO)
-        winning_team.save()
-        winning_team.players.add(winning_player_1)
-        winning_team.players.add(winning_player_2)
-    else:
-        winning_team = winning_team_qs[0]
-
-    if not losing_team_qs:
-        losing_team = Team(elo=STARTING_ELO)
-        losing_team.save()
-        losing_team.players.add(losing_player_1)
-        losing_team.players.add(losing_player_2)
-    else:
-        losing_team = losing_team_qs[0]
-
-    match = Match.objects.create(
-        winning_team=winning_team,
-        losing_team=losing_team,
-        winning_score=winning_score,
-        losing_score=losing_score
-    )
+    error = elo.validate_match(winning_team_usernames, losing_team_usernames, winning_score, losing_score)
+    if error:
+        return HttpResponseBadRequest(error)
 
-    # Calculate new elos for each player and update them
-    update_player_elos(match)
+    winning_player_1 = await aget_object_or_404(Player, username=winning_team_usernames[0])
+    winning_player_2 = await aget_object_or_404(Player, username=winning_team_usernames[1])
+    losing_player_1 = await aget_object_or_404(Player, username=losing_team_usernames[0])
+    losing_player_2 = await aget_object_or_404(Player, username=losing_team_usernames[1])
 
-    # Calculate new elos for each team as a whole
-    update_team_elos(match)
-
-    winning_player_1.refresh_from_db()
-    winning_player_2.refresh_from_db()
-    losing_player_1.refresh_from_db()
-    losing_player_2.refresh_from_db()
+    match, players = await sync_to_async(elo.record_match)(
+        (winning_player_1, winning_player_2),
+        (losing_player_1, losing_player_2),
+        winning_score,
+        losing_score)
 
     return JsonResponse({
         'success': True,
         'new_elo': {
-            'players': {
-                winning_player_1.username: winning_player_1.elo,
-                winning_player_2.username: winning_player_2.elo,
-                losing_player_1.username: losing_player_1.elo,
-                losing_player_2.username: losing_player_2.elo,
-            },
+            'players': {player.username: player.elo for player in players},
             'teams': {
-                'winning_team': winning_team.elo,
-                'losing_team': losing_team.elo
+                'winning_team': match.winning_team.elo,
+                'losing_team': match.losing_team.elo
             }
         }
     })
 
 @csrf_exempt
-@transaction.atomic
-def delete_latest_match(request):
+async def delete_latest_match(request):
     if request.method != 'DELETE':
         return HttpResponseNotAllowed(['DELETE'])
 
     try:
-        match = Match.objects.latest('timestamp')
-    except e:
-        print(str(e))
+        match = await sync_to_async(elo.delete_latest_match)()
+    except Match.DoesNotExist:
         return HttpResponseNotFound('No matches found.')
 
-    winners = [x[0] for x in match.winning_team.players.values_list('username')]
-    winners = ' and '.join(winners)
-    losers = [x[0] for x in match.losing_team.players.values_list('username')]
-    losers = ' and '.join(losers)
+    winners = ' and '.join(sorted([match.winning_team.player_low.username, match.winning_team.player_high.username]))
+    losers = ' and '.join(sorted([match.losing_team.player_low.username, match.losing_team.player_high.username]))
 
     winning_score = match.winning_score
     losing_score = match.losing_score
 
-    match.delete()
-    recalculate_all_elos()
-
     return JsonResponse({
         'message': f'Deleted game with {winners} beating {losers} {winning_score}-{losing_score}'
     }, status=200)
 
 
-def leaderboards(request, num):
+@csrf_exempt
+async def import_matches(request):
+    """
+    Bulk version of record_match for backfilling old matches. The body is
+    either CSV or JSON lines (see foos.importer.parse_matches), picked with
+    ?format=csv or ?format=jsonl. Nothing is imported unless every match is
+    valid.
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+
+    format = request.GET.get('format', 'jsonl')
+    if format not in importer.FORMATS:
+        return HttpResponseBadRequest(f'Format must be one of {", ".join(importer.FORMATS)}')
+
+    # Read the body a line at a time rather than through request.body, which
+    # holds all of it in memory and is capped at DATA_UPLOAD_MAX_MEMORY_SIZE
+    lines = codecs.getreader('utf-8')(request)
+
+    try:
+        matches = await sync_to_async(importer.parse_matches)(lines, format)
+        imported = await sync_to_async(importer.import_matches)(matches)
+    except UnicodeDecodeError as e:
+        return HttpResponseBadRequest(f'Body must be utf-8: {e}')
+    except importer.InvalidMatches as e:
+        return JsonResponse({'errors': e.errors}, status=400)
+
+    return JsonResponse({
+        'imported': imported
+    }, status=201)
+
+
+async def export_matches(request):
+    """
+    Streams the full match history, with everyone's elo after each match,
+    as ?format=jsonl (default) or ?format=csv.
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+
+    format = request.GET.get('format', 'jsonl')
+    if format not in export.FORMATS:
+        return HttpResponseBadRequest(f'Format must be one of {", ".join(export.FORMATS)}')
+
+    content_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    response = StreamingHttpResponse(export.aiter_export(format), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="matches.{format}"'
+    return response
+
+
+async def request_metrics(request):
+    """
+    Request counts, latencies and queries per view in the Prometheus text
+    format, for every server process (see foos.metrics).
+    """
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
-    return _individual_boards(int(num), '-elo')
+
+    content = await sync_to_async(metrics.metrics.render)()
+    return HttpResponse(content, content_type=metrics.CONTENT_TYPE)
 
 
-def loserboards(request, num):
+@cached_view
+async def leaderboards(request, num, direction=None, cursor=None):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
-    return _individual_boards(int(num), 'elo')
+    return await sync_to_async(_individual_boards)(num, True, direction, cursor)
 
 
-def _individual_boards(num, order_by):
-    # Sort players by elo descending
-    players = (Player.objects
-                    .annotate(num_games=Count('teams__winning_matches') + Count('teams__losing_matches'))
-                    .filter(num_games__gte=3)
-                    .order_by(order_by))
+@cached_view
+async def loserboards(request, num, direction=None, cursor=None):
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    return await sync_to_async(_individual_boards)(num, False, direction, cursor)
 
-    leaderboards = []
-    for player in players[:num]:
-        wins = Match.objects.filter(winning_team__players=player)
-        losses = Match.objects.filter(losing_team__players=player)
-
-        total_games = wins.count() + losses.count()
-        if wins.count() == 0:
-            win_percentage = 0.
-        elif total_games:
-            win_percentage = wins.count() / total_games * 100
+
+def _player_stats(player):
+    if player.wins == 0:
+        win_percentage = 0.
+    elif player.games:
+        win_percentage = player.wins / player.games * 100
+    else:
+        win_percentage = None
+
+    return {
+        'username': player.username,
+        'elo': player.elo,
+        'wins': player.wins,
+        'losses': player.losses,
+        'win_percentage': win_percentage,
+        'goals_scored': player.goals_for,
+        'goals_allowed': player.goals_against
+    }
+
+
+def _board_page(queryset, num, descending, direction, cursor):
+    """
+    Returns (rows, prev_cursor, next_cursor) for a page of at most num rows
+    of queryset ordered by elo and then id, highest first if descending.
+    The page is the first one, or the one right after or before cursor,
+    depending on direction. The cursors are None when there is no page
+    before or after this one.
+
+    Pages are found with a range scan from the cursor (keyset pagination),
+    so every page costs the same however deep into the board it is.
+    """
+    backwards = direction == 'before'
+    # A page before the cursor is the page after it in the reversed order
+    reverse = descending != backwards
+
+    if cursor is not None:
+        elo, obj_id = cursor
+        if reverse:
+            queryset = queryset.filter(Q(elo__lt=elo) | Q(elo=elo, id__lt=obj_id))
         else:
-            win_percentage = None
+            queryset = queryset.filter(Q(elo__gt=elo) | Q(elo=elo, id__gt=obj_id))
 
-        goals_scored = sum([match.winning_score for match in wins] + [match.losing_score for match in losses])
-        goals_allowed = sum([match.losing_score for match in wins] + [match.winning_score for match in losses])
+    order_by = ('-elo', '-id') if reverse else ('elo', 'id')
+    # One extra row tells whether there is another page past this one
+    rows = list(queryset.order_by(*order_by)[:num + 1])
+    more = len(rows) > num
+    rows = rows[:num]
+    if backwards:
+        rows.reverse()
+
+    more_before, more_after = (more, cursor is not None) if backwards else (cursor is not None, more)
+    prev_cursor = f'{rows[0].elo}.{rows[0].id}' if rows and more_before else None
+    next_cursor = f'{rows[-1].elo}.{rows[-1].id}' if rows and more_after else None
+    return rows, prev_cursor, next_cursor
 
-        leaderboards.append({
-            'username': player.username,
-            'elo': player.elo,
-            'wins': wins.count(),
-            'losses': losses.count(),
-            'win_percentage': win_percentage,
-            'goals_scored': goals_scored,
-            'goals_allowed': goals_allowed
-        })
+
+def _individual_boards(num, descending, direction=None, cursor=None):
+    # Matches the condition of the foos_player_board_idx index
+    players = Player.objects.filter(games__gte=3)
+    players, prev_cursor, next_cursor = _board_page(players, num, descending, direction, cursor)
 
     return JsonResponse({
-        'players': leaderboards
+        'players': [_player_stats(player) for player in players],
+        'prev': prev_cursor,
+        'next': next_cursor
     })
 
 
-def dream_teams(request, num):
+@cached_view
+async def dream_teams(request, num, direction=None, cursor=None):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
-    return _team_boards(int(num), '-elo')
+    return await sync_to_async(_team_boards)(num, True, direction, cursor)
 
 
-def nightmare_teams(request, num):
+@cached_view
+async def nightmare_teams(request, num, direction=None, cursor=None):
     if request.method != 'GET':
         return HttpResponseNotAllowed(['GET'])
 
-    return _team_boards(int(num), 'elo')
-
-
-def _team_boards(num, order_by):
-    # Sort teams by win percentage descending
-    # with minimum 3 wins
-    teams = (Team.objects.order_by(order_by)
-                 .annotate(wins=Count('winning_matches', distinct=True))
-                 .filter(wins__gte=3)
-                 .annotate(losses=Count('losing_matches', distinct=True))
-                 .annotate(total_games=F('wins') + F('losses'))
-                 .annotate(
-                     win_percentage=Case(
-                         When(losses=0, then=100),
-                         default=ExpressionWrapper(
-                             100.0 * F('wins') / F('total_games'),
-                             output_field=DecimalField()
-                         )
-                     )
-                 ))
+    return await sync_to_async(_team_boards)(num, False, direction, cursor)
 
-    leaderboards = []
-    for team in teams[:num]:
-        usernames = [player.username for player in team.players.all()]
 
-        goals_scored = sum([match.winning_score for match in team.winning_matches.all()]
-                            + [match.losing_score for match in team.losing_matches.all()])
-        goals_allowed = sum([match.losing_score for match in team.winning_matches.all()]
-                            + [match.winning_score for match in team.losing_matches.all()])
+def _team_boards(num, descending, direction=None, cursor=None):
+    # Teams with a minimum of 3 wins, matching the foos_team_board_idx index
+    teams = Team.objects.filter(wins__gte=3).select_related('player_low', 'player_high')
+    teams, prev_cursor, next_cursor = _board_page(teams, num, descending, direction, cursor)
+
+    leaderboards = []
+    for team in teams:
+        usernames = [team.player_low.username, team.player_high.username]
 
         leaderboards.append({
             'players': usernames,
             'elo': team.elo,
             'wins': team.wins,
             'losses': team.losses,
-            'win_percentage': float(team.win_percentage),
-            'goals_scored': goals_scored,
-            'goals_allowed': goals_allowed
+            'win_percentage': team.wins / team.games * 100,
+            'goals_scored': team.goals_for,
+            'goals_allowed': team.goals_against
         })
 
     return JsonResponse({
-        'teams': leaderboards
+        'teams': leaderboards,
+        'prev': prev_cursor,
+        'next': next_cursor
     })
\ No newline at end of file
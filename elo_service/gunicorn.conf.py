@@ -0,0 +1,55 @@
+"""
+Production server settings: gunicorn managing uvicorn workers, each serving
+elo_service.asgi. Run with `gunicorn -c gunicorn.conf.py elo_service.asgi:application`.
+
+Every worker is its own process with its own DB connections, so a slow
+import or recalculation only ties up the thread running it while the other
+workers, and the rest of its own event loop, keep answering. The workers
+share the file based cache (see CACHES in settings.py).
+"""
+import glob
+import multiprocessing
+import os
+
+# The default is capped so that big machines don't run out of database
+# connections, as every worker has a pool of its own
+MAX_DEFAULT_WORKERS = 8
+
+bind = os.environ.get('ELO_BIND', '0.0.0.0:8000')
+
+workers = int(os.environ.get('WEB_CONCURRENCY', min(multiprocessing.cpu_count() * 2 + 1, MAX_DEFAULT_WORKERS)))
+worker_class = 'uvicorn_worker.UvicornWorker'
+
+# Restart workers whose event loop stops responding for this long
+timeout = 120
+graceful_timeout = 30
+# Longer than the discord bot's KEEPALIVE_TIMEOUT, so the bot is always the
+# one to close an idle connection and never sends on one we just closed.
+keepalive = 75
+
+# Recycle workers now and then to bound any slow growth in memory
+max_requests = 5000
+max_requests_jitter = 500
+
+accesslog = '-'
+
+# Where each worker writes its request metrics for /foos/metrics/ to add up
+# (see foos.metrics). The workers inherit it from here.
+os.environ.setdefault('ELO_METRICS_DIR', '/tmp/elo_service_metrics')
+
+
+def on_starting(server):
+    # Better not to start than to have requests fail once the pools fill up.
+    # Imported here, once gunicorn has put the project on the path.
+    from elo_service.settings import DATABASES, DB_MAX_CONNECTIONS
+    pool = DATABASES['default']['OPTIONS'].get('pool')
+    if pool and server.cfg.workers * pool['max_size'] > DB_MAX_CONNECTIONS:
+        raise RuntimeError(
+            f'{server.cfg.workers} workers with up to {pool["max_size"]} pooled connections each could open '
+            f'more than ELO_DB_MAX_CONNECTIONS ({DB_MAX_CONNECTIONS}) between them; lower WEB_CONCURRENCY '
+            f'or ELO_DB_POOL_MAX_SIZE')
+
+    # Counters start over with the server, like Prometheus expects
+    os.makedirs(os.environ['ELO_METRICS_DIR'], exist_ok=True)
+    for path in glob.glob(os.path.join(os.environ['ELO_METRICS_DIR'], '*.json')):
+        os.remove(path)